@@ -12,15 +12,38 @@ AutoSmm Plugin v1.5 - Улучшенная версия
 - Защита от race conditions
 """
 
+import atexit
+import cProfile
+import csv
+import functools
+import gzip
+import io
 import json
 import logging
+import logging.handlers
 import os
+import pstats
+import queue
 import re
 import threading
 import time
-from datetime import datetime
-from typing import TYPE_CHECKING, Optional, List, Dict, Tuple, Any
+import tracemalloc
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    import msvcrt
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from types import MappingProxyType
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from typing import TYPE_CHECKING, Optional, List, Dict, Set, Tuple, Any, Iterator, NamedTuple
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 import telebot
 from telebot import types
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
@@ -58,6 +81,65 @@ PAYORDERS_FILE = f"{STORAGE_PATH}/payorders.json"
 SETTINGS_FILE = f"{STORAGE_PATH}/settings.json"
 CASHLIST_FILE = f"{STORAGE_PATH}/cashlist.json"
 REFILL_FILE = f"{STORAGE_PATH}/refill.json"
+LEDGER_FILE = f"{STORAGE_PATH}/ledger.jsonl"
+STATS_FILE = f"{STORAGE_PATH}/stats.json"
+STATS_OPEN_FILE = f"{STORAGE_PATH}/stats_open.jsonl"
+PAYORDERS_ARCHIVE_FILE = f"{STORAGE_PATH}/payorders_archive.jsonl"
+REFUNDS_FILE = f"{STORAGE_PATH}/refunds.jsonl"
+EXPORTS_PATH = f"{STORAGE_PATH}/exports"
+TRACES_FILE = f"{STORAGE_PATH}/traces.json"
+PROFILES_PATH = f"{STORAGE_PATH}/profiles"
+CHECKER_STATE_FILE = f"{STORAGE_PATH}/checker_state.json"
+DEFERRED_FILE = f"{STORAGE_PATH}/deferred.json"
+REFUND_QUEUE_FILE = f"{STORAGE_PATH}/refund_queue.json"
+CREATE_QUEUE_FILE = f"{STORAGE_PATH}/create_queue.json"
+PROCESSED_PATH = f"{STORAGE_PATH}/processed"
+ETA_FILE = f"{STORAGE_PATH}/eta.json"
+LOCKS_PATH = f"{STORAGE_PATH}/locks"
+
+# Пауза между попытками взять блокировку (Windows) и чтения/замены занятого файла, секунды
+LOCK_POLL_INTERVAL = 0.01
+# Попыток оптимистичной записи до перехода на чтение под блокировкой
+STORAGE_OPTIMISTIC_RETRIES = 3
+
+# Сколько последних заказов хранить в трассировке
+TRACES_KEEP = 2000
+
+# Окно профилирования по умолчанию и предел, секунды
+PROFILE_DEFAULT_SECONDS = 300
+PROFILE_MAX_SECONDS = 3600
+PROFILE_TOP_N = 30
+
+# Как часто чекер просыпается проверить расписание, секунды
+CHECKER_TICK = 5
+# Как часто сторож проверяет, что чекер жив, секунды
+CHECKER_WATCHDOG_TICK = 30
+
+# Сколько услуг карты показывать в /autosmm_providers
+PROVIDERS_MAP_SHOWN = 20
+# Сколько возвратов показывать в /autosmm_refunds
+REFUNDS_SHOWN = 20
+# Заказов в одном запросе статусов (action=status&orders=)
+STATUS_BATCH = 100
+
+# Записей лога в очереди к обработчикам FPC; при переполнении новые отбрасываются
+LOG_QUEUE_SIZE = 10000
+# Окно ограничения однотипных записей лога, секунды
+LOG_WINDOW = 60
+# Предупреждений и ошибок с одного места в коде за окно, остальные подавляются
+LOG_ERROR_BURST = 10
+# Частые записи по заказам: первые LOG_SAMPLE_BURST за окно, дальше каждая LOG_SAMPLE_EVERY
+LOG_SAMPLE_BURST = 5
+LOG_SAMPLE_EVERY = 20
+
+# Массовые операции: заказов за раз и параллельных запросов к панели без пакетного метода
+BULK_MAX_ORDERS = 1000
+BULK_PARALLEL = 4
+# Как часто обновлять сообщение с ходом массовой операции, секунды
+BULK_PROGRESS_EVERY = 2
+
+# Сколько дней хранить дневную статистику
+STATS_DAYS_KEEP = 90
 
 # Настройки по умолчанию
 DEFAULT_SETTINGS = {
@@ -76,26 +158,189 @@ DEFAULT_SETTINGS = {
     "set_recreated_order": False,
     "api_timeout": 30,
     "check_interval": 60,
-    "max_retries": 3
+    "checker_warmup_window": 120,
+    "checker_stall_timeout": 600,
+    "max_retries": 3,
+    "metrics_port": 0,
+    "metrics_host": "127.0.0.1",
+    "set_provider_routing": True,
+    "set_hedged_reads": True,
+    # Создание заказов: потоков очереди, одновременных запросов к панели, темп (0 - без ограничения)
+    "create_workers": 8,
+    "create_concurrency": 3,
+    "create_rate_per_minute": 0,
+    # Лимиты отдельных панелей: {"имя": {"concurrency": 2, "rate_per_minute": 30}}
+    "provider_limits": {},
+    # Интервал сверки с продажами FunPay и панелями, секунды (0 - только по команде)
+    "reconcile_interval": 3600,
+    # Сколько ждать недоступную панель до возврата средств, секунды (0 - возврат сразу)
+    "deferred_deadline": 1800,
+    "router_price_tolerance": 0.05,
+    # Дополнительные панели: [{"name": "...", "url": "...", "key": "..."}]
+    "providers": [],
+    # Логическая услуга -> ID равнозначной услуги на каждой панели
+    "service_map": {}
 }
 
 # ====================
 # УТИЛИТЫ И ВАЛИДАТОРЫ
 # ====================
 
+class InterProcessLock:
+    """Блокировка файла-замка на уровне ОС: разделяется между процессами FPC.
+    
+    Держится открытым дескриптором, поэтому снимается системой при падении процесса.
+    Внутри процесса не реентерабельна - для этого используется ProcessLock.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+    
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+    
+    def _open(self):
+        try:
+            return open(self.path, "a+b")
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            return open(self.path, "a+b")
+    
+    def acquire(self, blocking: bool = True) -> bool:
+        if self._file is not None:
+            return True
+        file = self._open()
+        try:
+            if msvcrt:
+                while True:
+                    try:
+                        file.seek(0)
+                        msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            file.close()
+                            return False
+                        time.sleep(LOCK_POLL_INTERVAL)
+            else:
+                try:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                except BlockingIOError:
+                    file.close()
+                    return False
+        except Exception:
+            file.close()
+            raise
+        self._file = file
+        return True
+    
+    def release(self) -> None:
+        file, self._file = self._file, None
+        if file is None:
+            return
+        try:
+            if msvcrt:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        finally:
+            file.close()
+
+
+class ProcessLock:
+    """Реентерабельная блокировка: потоки процесса + другие процессы на том же хранилище"""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self._thread_lock = threading.RLock()
+        self._os_lock = InterProcessLock(f"{LOCKS_PATH}/{name}.lock")
+        self._depth = 0
+    
+    def acquire(self, blocking: bool = True) -> bool:
+        started = time.perf_counter()
+        if not self._thread_lock.acquire(blocking):
+            return False
+        if self._depth == 0:
+            try:
+                if not self._os_lock.acquire(blocking):
+                    self._thread_lock.release()
+                    return False
+            except Exception:
+                self._thread_lock.release()
+                raise
+            Metrics.observe("autosmm_lock_wait_seconds", time.perf_counter() - started, file=self.name)
+        self._depth += 1
+        return True
+    
+    def release(self) -> None:
+        self._depth -= 1
+        try:
+            if self._depth == 0:
+                self._os_lock.release()
+        finally:
+            self._thread_lock.release()
+    
+    def __enter__(self) -> "ProcessLock":
+        self.acquire()
+        return self
+    
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
 class FileLocker:
-    """Потокобезопасная работа с файлами"""
-    _locks = {
-        'orders': threading.Lock(),
-        'payorders': threading.Lock(),
-        'settings': threading.Lock(),
-        'cashlist': threading.Lock(),
-        'refill': threading.Lock()
-    }
+    """Блокировки файлов хранилища, общие для потоков и процессов"""
+    _types = (
+        'orders', 'payorders', 'settings', 'cashlist', 'refill', 'ledger', 'stats',
+        'payorders_archive', 'refunds', 'traces', 'checker_state', 'deferred', 'refund_queue',
+        'processed', 'eta', 'create_queue',
+    )
+    _locks = {name: ProcessLock(name) for name in _types}
+    _guard = threading.Lock()
     
     @classmethod
-    def get_lock(cls, file_type: str) -> threading.Lock:
-        return cls._locks.get(file_type, threading.Lock())
+    def get_lock(cls, file_type: str) -> ProcessLock:
+        lock = cls._locks.get(file_type)
+        if lock is None:
+            with cls._guard:
+                lock = cls._locks.setdefault(file_type, ProcessLock(file_type))
+        return lock
+
+
+class TaskWorker:
+    """Фоновый исполнитель задач с очередью и одним потоком"""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def submit(self, func, *args, **kwargs) -> int:
+        """Поставить задачу в очередь, возвращает число задач перед ней"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"AutoSmm-{self.name}", daemon=True)
+                self._thread.start()
+        position = self._queue.qsize()
+        self._queue.put((func, args, kwargs))
+        return position
+    
+    def qsize(self) -> int:
+        return self._queue.qsize()
+    
+    def _run(self):
+        while True:
+            func, args, kwargs = self._queue.get()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"Ошибка фоновой задачи {self.name}: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
 
 
 class Validator:
@@ -152,6 +397,13 @@ class Validator:
         except (ValueError, TypeError):
             return False, "ID сервиса должен быть числом"
     
+    @staticmethod
+    def validate_provider_name(name: Any) -> Tuple[bool, Optional[str]]:
+        """Проверка имени провайдера"""
+        if not isinstance(name, str) or not re.fullmatch(r'[A-Za-z0-9_-]{1,32}', name):
+            return False, "Имя провайдера: латиница, цифры, _ и -, до 32 символов"
+        return True, None
+    
     @staticmethod
     def validate_quantity(quantity: Any) -> Tuple[bool, Optional[str]]:
         """Проверка количества"""
@@ -167,443 +419,3396 @@ class Validator:
 
 
 class SettingsCache:
-    """Кэш настроек для избежания частого чтения файла"""
-    _cache = None
-    _last_update = 0
-    _cache_ttl = 60  # секунды
-    _lock = threading.Lock()
+    """Неизменяемый снимок настроек с номером версии.
+    
+    Снимок заменяется целиком при save_settings или при изменении mtime
+    файла, поэтому чтение на горячих путях не копирует словарь и не
+    обращается к диску. Проверенные ключи провайдеров вычисляются один
+    раз на версию, подписчики получают (старый, новый) снимок.
+    """
+    STAT_INTERVAL = 1.0  # как часто проверять mtime, секунды
+    
+    _snapshot: Optional[MappingProxyType] = None
+    _credentials: Dict[str, Tuple[str, str]] = {}
+    _version = 0
+    _mtime: Optional[float] = None
+    _next_stat = 0.0
+    _subscribers: List = []
+    _lock = threading.RLock()
     
     @classmethod
-    def get_settings(cls) -> Dict:
-        """Получить настройки с кэшированием"""
-        with cls._lock:
-            current_time = time.time()
-            if cls._cache is None or (current_time - cls._last_update) > cls._cache_ttl:
-                cls._cache = load_settings()
-                cls._last_update = current_time
-            return cls._cache.copy()
+    def get_settings(cls) -> MappingProxyType:
+        """Текущий снимок настроек (только для чтения)"""
+        snapshot = cls._snapshot
+        if snapshot is None or time.monotonic() >= cls._next_stat:
+            snapshot = cls._refresh()
+        return snapshot
+    
+    @classmethod
+    def version(cls) -> int:
+        cls.get_settings()
+        return cls._version
+    
+    @classmethod
+    def credentials(cls, type_api: Optional[str] = None) -> Tuple[str, str]:
+        """Проверенные (URL, ключ) провайдера, пустые строки если некорректны"""
+        cls.get_settings()
+        return cls._credentials.get(type_api or "API_1", ("", ""))
+    
+    @classmethod
+    def providers(cls) -> List[str]:
+        """Имена провайдеров с заполненными URL и ключом, в порядке настройки"""
+        cls.get_settings()
+        return [name for name, (url, key) in cls._credentials.items() if url and key]
+    
+    @classmethod
+    def subscribe(cls, callback) -> None:
+        """Подписка на смену снимка: callback(old, new), old is None при первой загрузке"""
+        cls._subscribers.append(callback)
     
     @classmethod
     def invalidate(cls):
-        """Сбросить кэш"""
+        """Перечитать файл при следующем обращении"""
+        cls._next_stat = 0.0
+        cls._mtime = None
+    
+    @staticmethod
+    def _file_mtime() -> Optional[float]:
+        try:
+            return os.stat(SETTINGS_FILE).st_mtime_ns
+        except OSError:
+            return None
+    
+    @classmethod
+    def _refresh(cls) -> MappingProxyType:
+        with cls._lock:
+            mtime = cls._file_mtime()
+            cls._next_stat = time.monotonic() + cls.STAT_INTERVAL
+            if cls._snapshot is not None and mtime == cls._mtime:
+                return cls._snapshot
+            cls._mtime = mtime
+            return cls._swap(load_settings())
+    
+    @classmethod
+    def _swap(cls, settings: Dict) -> MappingProxyType:
+        old = cls._snapshot
+        new = MappingProxyType(dict(settings))
+        if old is not None and dict(old) == dict(new):
+            return old
+        
+        credentials = {}
+        for type_api, url_key, api_key_key in (("API_1", "api_url", "api_key"), ("API_2", "api_url_2", "api_key_2")):
+            credentials[type_api] = (
+                cls._validated(url_key, new.get(url_key, ""), Validator.validate_url),
+                cls._validated(api_key_key, new.get(api_key_key, ""), Validator.validate_api_key),
+            )
+        for provider in new.get("providers") or []:
+            name = str(provider.get("name", "")) if isinstance(provider, dict) else ""
+            is_valid, error = Validator.validate_provider_name(name)
+            if not is_valid or name in credentials:
+                logger.warning(f"Провайдер {name!r} пропущен: {error or 'имя уже занято'}")
+                continue
+            credentials[name] = (
+                cls._validated(f"url {name}", provider.get("url", ""), Validator.validate_url),
+                cls._validated(f"key {name}", provider.get("key", ""), Validator.validate_api_key),
+            )
+        
+        cls._credentials = credentials
+        cls._snapshot = new
+        cls._version += 1
+        
+        for callback in list(cls._subscribers):
+            try:
+                callback(old, new)
+            except Exception as e:
+                logger.error(f"Ошибка подписчика настроек: {e}", exc_info=True)
+        return new
+    
+    @staticmethod
+    def _validated(key: str, value: str, validator) -> str:
+        if not value:
+            return ""
+        is_valid, error = validator(value)
+        if not is_valid:
+            logger.warning(f"Некорректный {key}: {error}")
+            return ""
+        return value
+    
+    @classmethod
+    def update(cls, settings: Dict) -> None:
+        """Замена снимка после сохранения файла"""
         with cls._lock:
-            cls._cache = None
-            cls._last_update = 0
+            cls._mtime = cls._file_mtime()
+            cls._next_stat = time.monotonic() + cls.STAT_INTERVAL
+            cls._swap(settings)
 
 
 # ====================
-# РАБОТА С ФАЙЛАМИ (улучшенная)
+# МЕТРИКИ
 # ====================
 
-def ensure_storage_exists():
-    """Создание директории хранилища"""
-    try:
-        os.makedirs(STORAGE_PATH, exist_ok=True)
-    except Exception as e:
-        logger.error(f"Не удалось создать директорию хранилища: {e}")
-
-
-def load_json_safe(filepath: str, default: Any, lock_type: str) -> Any:
-    """Безопасная загрузка JSON с блокировкой"""
-    with FileLocker.get_lock(lock_type):
-        if not os.path.exists(filepath):
-            return default
-        
-        try:
-            with open(filepath, "r", encoding='utf-8') as file:
-                return json.load(file)
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка декодирования JSON из {filepath}: {e}")
-            # Создаем бэкап поврежденного файла
+class Metrics:
+    """Реестр метрик плагина: счетчики, гистограммы и датчики"""
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+    HELP = {
+        "autosmm_orders_created_total": ("counter", "Заказы, созданные на сайте SMM"),
+        "autosmm_orders_failed_total": ("counter", "Заказы, которые не удалось создать"),
+        "autosmm_orders_refunded_total": ("counter", "Возвраты средств покупателям"),
+        "autosmm_orders_completed_total": ("counter", "Выполненные заказы"),
+        "autosmm_api_request_seconds": ("histogram", "Длительность запросов к SMM API"),
+        "autosmm_api_errors_total": ("counter", "Ошибки запросов к SMM API"),
+        "autosmm_api_hedged_total": ("counter", "Дублированные медленные чтения SMM API по победителю"),
+        "autosmm_api_read_timeout_seconds": ("gauge", "Адаптивный таймаут чтения по панелям"),
+        "autosmm_checker_cycle_seconds": ("histogram", "Длительность цикла чекера"),
+        "autosmm_checker_lag_seconds": ("gauge", "Опоздание начала цикла чекера"),
+        "autosmm_checker_last_cycle_timestamp": ("gauge", "Время окончания последнего цикла чекера"),
+        "autosmm_checker_last_cycle_duration_seconds": ("gauge", "Длительность последнего цикла чекера"),
+        "autosmm_checker_heartbeat_timestamp": ("gauge", "Время последнего сигнала жизни чекера"),
+        "autosmm_checker_running": ("gauge", "Чекер запущен"),
+        "autosmm_checker_restarts_total": ("counter", "Перезапуски чекера"),
+        "autosmm_checker_leader": ("gauge", "Этот процесс - лидер чекера на общем хранилище"),
+        "autosmm_storage_seconds": ("histogram", "Длительность чтения/записи файлов хранилища"),
+        "autosmm_storage_file_bytes": ("gauge", "Размер файлов хранилища"),
+        "autosmm_storage_conflicts_total": ("counter", "Конфликты оптимистичной записи между процессами"),
+        "autosmm_lock_wait_seconds": ("histogram", "Ожидание блокировки файла хранилища"),
+        "autosmm_active_orders": ("gauge", "Активные заказы в чекере"),
+        "autosmm_paid_orders": ("gauge", "Оплаченные заказы, ожидающие ссылку"),
+        "autosmm_pending_confirmations": ("gauge", "Заказы, ожидающие подтверждения"),
+        "autosmm_worker_queue": ("gauge", "Задачи в очередях фоновых исполнителей"),
+        "autosmm_startup_seconds": ("gauge", "Длительность запуска плагина по фазам"),
+        "autosmm_messages_total": ("counter", "Входящие сообщения по маршрутам обработки"),
+        "autosmm_links_rejected_total": ("counter", "Ссылки, отклоненные до создания заказа"),
+        "autosmm_orders_routed_total": ("counter", "Созданные заказы по выбранной маршрутизатором панели"),
+        "autosmm_deferred_total": ("counter", "Отложенные заказы по исходам"),
+        "autosmm_deferred_orders": ("gauge", "Заказы, ожидающие доступности панели"),
+        "autosmm_create_queue": ("gauge", "Подтвержденные заказы в очереди на создание"),
+        "autosmm_refund_queue": ("gauge", "Возвраты в очереди: ожидающие и зависшие"),
+        "autosmm_bulk_orders_total": ("counter", "Заказы в массовых операциях по действию и результату"),
+        "autosmm_log_queue": ("gauge", "Записи лога, ожидающие записи обработчиками FPC"),
+        "autosmm_log_suppressed_total": ("counter", "Подавленные записи лога по причинам"),
+        "autosmm_orders_slow_total": ("counter", "Заказы, выполняющиеся дольше p95 своей услуги"),
+        "autosmm_events_duplicate_total": ("counter", "Повторно доставленные события NewOrderEvent"),
+        "autosmm_reconcile_fixes_total": ("counter", "Расхождения, исправленные сверкой, по видам"),
+        "autosmm_reconcile_seconds": ("histogram", "Длительность сверки с FunPay и панелями"),
+        "autosmm_refund_attempts_total": ("counter", "Попытки возврата средств из очереди по исходам"),
+        "autosmm_create_queue_wait_seconds": ("histogram", "Ожидание подтвержденного заказа в очереди на создание"),
+        "autosmm_create_slot_wait_seconds": ("histogram", "Ожидание свободного слота создания на панели"),
+        "autosmm_create_slots_busy": ("gauge", "Одновременные запросы создания заказа по панелям"),
+        "autosmm_create_slots_waiting": ("gauge", "Запросы создания, ожидающие слот панели"),
+    }
+    
+    _counters: Dict[Tuple, float] = {}
+    _gauges: Dict[Tuple, float] = {}
+    _histograms: Dict[Tuple, List] = {}
+    _collectors: List = []
+    _lock = threading.Lock()
+    
+    @staticmethod
+    def _key(name: str, labels: Dict) -> Tuple:
+        return (name,) + tuple(sorted((k, str(v)) for k, v in labels.items()))
+    
+    @classmethod
+    def inc(cls, name: str, value: float = 1, **labels) -> None:
+        key = cls._key(name, labels)
+        with cls._lock:
+            cls._counters[key] = cls._counters.get(key, 0) + value
+    
+    @classmethod
+    def set_gauge(cls, name: str, value: float, **labels) -> None:
+        key = cls._key(name, labels)
+        with cls._lock:
+            cls._gauges[key] = value
+    
+    @classmethod
+    def observe(cls, name: str, value: float, **labels) -> None:
+        key = cls._key(name, labels)
+        with cls._lock:
+            hist = cls._histograms.get(key)
+            if hist is None:
+                hist = cls._histograms[key] = [[0] * len(cls.LATENCY_BUCKETS), 0.0, 0]
+            for i, bound in enumerate(cls.LATENCY_BUCKETS):
+                if value <= bound:
+                    hist[0][i] += 1
+                    break
+            hist[1] += value
+            hist[2] += 1
+    
+    @classmethod
+    def add_collector(cls, func) -> None:
+        """Функция, обновляющая датчики непосредственно перед чтением метрик"""
+        cls._collectors.append(func)
+    
+    @classmethod
+    def _collect(cls) -> None:
+        for func in cls._collectors:
             try:
-                backup_path = f"{filepath}.corrupted_{int(time.time())}"
-                os.rename(filepath, backup_path)
-                logger.warning(f"Поврежденный файл сохранен как {backup_path}")
-            except:
-                pass
-            return default
-        except Exception as e:
-            logger.error(f"Ошибка чтения {filepath}: {e}")
-            return default
+                func()
+            except Exception as e:
+                logger.debug(f"Ошибка сбора метрик: {e}")
+    
+    @classmethod
+    def quantile(cls, hist: List, q: float) -> float:
+        """Оценка квантиля по корзинам гистограммы"""
+        buckets, _, count = hist
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, bucket_count in enumerate(buckets):
+            seen += bucket_count
+            if seen >= rank:
+                return cls.LATENCY_BUCKETS[i]
+        return cls.LATENCY_BUCKETS[-1]
+    
+    @classmethod
+    def snapshot(cls) -> Tuple[Dict, Dict, Dict]:
+        cls._collect()
+        with cls._lock:
+            return (
+                dict(cls._counters),
+                dict(cls._gauges),
+                {k: [list(v[0]), v[1], v[2]] for k, v in cls._histograms.items()}
+            )
+    
+    @staticmethod
+    def _labels_text(key: Tuple, extra: str = "") -> str:
+        parts = [f'{k}="{v}"' for k, v in key[1:]]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+    
+    @classmethod
+    def render_prometheus(cls) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        counters, gauges, histograms = cls.snapshot()
+        by_name: Dict[str, List[str]] = {}
+        
+        for key, value in counters.items():
+            by_name.setdefault(key[0], []).append(f"{key[0]}{cls._labels_text(key)} {value}")
+        for key, value in gauges.items():
+            by_name.setdefault(key[0], []).append(f"{key[0]}{cls._labels_text(key)} {value}")
+        for key, (buckets, total, count) in histograms.items():
+            lines = by_name.setdefault(key[0], [])
+            cumulative = 0
+            for bound, bucket_count in zip(cls.LATENCY_BUCKETS, buckets):
+                cumulative += bucket_count
+                labels = cls._labels_text(key, 'le="%s"' % bound)
+                lines.append(f"{key[0]}_bucket{labels} {cumulative}")
+            labels = cls._labels_text(key, 'le="+Inf"')
+            lines.append(f"{key[0]}_bucket{labels} {count}")
+            lines.append(f"{key[0]}_sum{cls._labels_text(key)} {total}")
+            lines.append(f"{key[0]}_count{cls._labels_text(key)} {count}")
+        
+        output = []
+        for name in sorted(by_name):
+            metric_type, help_text = cls.HELP.get(name, ("untyped", name))
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {metric_type}")
+            output.extend(by_name[name])
+        return "\n".join(output) + "\n"
 
 
-def save_json_safe(filepath: str, data: Any, lock_type: str) -> bool:
-    """Безопасное сохранение JSON с блокировкой и атомарной записью"""
-    with FileLocker.get_lock(lock_type):
-        ensure_storage_exists()
-        temp_filepath = f"{filepath}.tmp"
+class MetricsServer:
+    """Локальный HTTP эндпоинт /metrics для Prometheus"""
+    _server = None
+    
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = Metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
         
+        def log_message(self, format, *args):
+            pass
+    
+    @classmethod
+    def start(cls, host: str, port: int) -> bool:
+        if cls._server is not None or not port:
+            return False
         try:
-            # Запись во временный файл
-            with open(temp_filepath, "w", encoding='utf-8') as file:
-                json.dump(data, file, indent=4, ensure_ascii=False)
-            
-            # Атомарная замена
-            os.replace(temp_filepath, filepath)
+            cls._server = ThreadingHTTPServer((host, int(port)), cls._Handler)
+            cls._server.daemon_threads = True
+            threading.Thread(target=cls._server.serve_forever, name="AutoSmm-metrics", daemon=True).start()
+            logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
             return True
         except Exception as e:
-            logger.error(f"Ошибка сохранения {filepath}: {e}")
-            # Удаляем временный файл при ошибке
-            if os.path.exists(temp_filepath):
-                try:
-                    os.remove(temp_filepath)
-                except:
-                    pass
+            cls._server = None
+            logger.error(f"Не удалось запустить сервер метрик: {e}")
             return False
 
 
-def load_orders() -> dict:
-    """Загрузка заказов"""
-    return load_json_safe(ORDERS_FILE, {}, 'orders')
+# ====================
+# ЛОГИРОВАНИЕ
+# ====================
 
+# Структурные поля записей, дописываются в конец строки лога
+LOG_FIELDS = ("action", "order_id", "provider", "latency_ms")
 
-def save_orders(orders: dict) -> bool:
-    """Сохранение заказов"""
-    return save_json_safe(ORDERS_FILE, orders, 'orders')
 
+def log_fields(action: str, order_id: Any = None, provider: Optional[str] = None,
+               latency: Optional[float] = None, sample: bool = False) -> Dict[str, Any]:
+    """Поля для extra= записи лога; sample - частая запись, которая прореживается"""
+    return {
+        "action": action,
+        "order_id": order_id,
+        "provider": provider,
+        "latency_ms": round(latency * 1000) if latency is not None else None,
+        "sample": sample,
+    }
 
-def load_payorders() -> List[Dict]:
-    """Загрузка оплаченных заказов"""
-    return load_json_safe(PAYORDERS_FILE, [], 'payorders')
 
+class LogLimiter(logging.Filter):
+    """Прореживание частых записей и ограничение потока ошибок с одного места в коде.
+    
+    Работает в потоке, который пишет в лог, поэтому только считает. Число
+    подавленных записей дописывается к следующей пропущенной с того же места.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._sites: Dict[Tuple[str, int], List] = {}  # место -> [начало окна, записей, подавлено]
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        storm = record.levelno >= logging.WARNING
+        if not storm and not getattr(record, "sample", False):
+            return True
+        key = (record.filename, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= LOG_WINDOW:
+                site = self._sites[key] = [now, 0, site[2] if site else 0]
+            site[1] += 1
+            if storm:
+                allowed = site[1] <= LOG_ERROR_BURST
+            else:
+                allowed = site[1] <= LOG_SAMPLE_BURST or site[1] % LOG_SAMPLE_EVERY == 0
+            if allowed:
+                record.suppressed, site[2] = site[2], 0
+            else:
+                site[2] += 1
+        if not allowed:
+            Metrics.inc("autosmm_log_suppressed_total", reason="storm" if storm else "sampled")
+        return allowed
 
-def save_payorders(orders: List[Dict]) -> bool:
-    """Сохранение оплаченных заказов"""
-    return save_json_safe(PAYORDERS_FILE, orders, 'payorders')
 
+class LogPipeline:
+    """Неблокирующий лог плагина.
+    
+    Записи логгера плагина уходят в ограниченную очередь, а в обработчики
+    FPC (файл, консоль) их передает отдельный поток, так что запись на диск
+    не задерживает чекер и обработку событий. При переполнении очереди
+    новые записи отбрасываются, а не ждут.
+    """
+    _listener: Optional[logging.handlers.QueueListener] = None
+    
+    class _QueueHandler(logging.handlers.QueueHandler):
+        def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+            # Сообщение собирается в потоке вызова, пока аргументы (заказ и т.п.) не изменились;
+            # запись на диск и форматирование обработчиками FPC остаются потоку лога
+            record.msg, record.args = record.getMessage(), None
+            return record
+        
+        def enqueue(self, record: logging.LogRecord) -> None:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                Metrics.inc("autosmm_log_suppressed_total", reason="overflow")
+    
+    class _ParentHandler(logging.Handler):
+        """Передача записи обработчикам родительского логгера FPC"""
+        
+        def emit(self, record: logging.LogRecord) -> None:
+            fields = " ".join(
+                f"{name}={value}" for name in LOG_FIELDS if (value := getattr(record, name, None)) is not None
+            )
+            suppressed = getattr(record, "suppressed", 0)
+            if suppressed:
+                fields += f"{' ' if fields else ''}+{suppressed} похожих записей подавлено"
+            if fields:
+                record.msg, record.args = f"{record.getMessage()} [{fields}]", None
+            logger.parent.handle(record)
+    
+    @classmethod
+    def start(cls) -> None:
+        """Перенаправление логгера плагина в очередь; повторный вызов заменяет прошлую очередь"""
+        for handler in list(logger.handlers):
+            listener = getattr(handler, "autosmm_listener", None)
+            if listener is not None:
+                logger.removeHandler(handler)
+                if listener._thread is not None:
+                    listener.stop()
+        handler = cls._QueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        handler.addFilter(LogLimiter())
+        cls._listener = logging.handlers.QueueListener(handler.queue, cls._ParentHandler())
+        handler.autosmm_listener = cls._listener
+        logger.addHandler(handler)
+        logger.propagate = False
+        cls._listener.start()
+    
+    @classmethod
+    def stop(cls) -> None:
+        """Запись оставшейся очереди и возврат к обычному логированию"""
+        listener, cls._listener = cls._listener, None
+        if listener is None:
+            return
+        for handler in list(logger.handlers):
+            if getattr(handler, "autosmm_listener", None) is listener:
+                logger.removeHandler(handler)
+        logger.propagate = True
+        if listener._thread is not None:
+            listener.stop()
+    
+    @classmethod
+    def qsize(cls) -> int:
+        return cls._listener.queue.qsize() if cls._listener else 0
 
-def load_cashlist() -> dict:
-    """Загрузка кэшлиста"""
-    return load_json_safe(CASHLIST_FILE, {}, 'cashlist')
 
 
-def save_cashlist(orders: dict) -> bool:
-    """Сохранение кэшлиста"""
-    return save_json_safe(CASHLIST_FILE, orders, 'cashlist')
+# ====================
+# ПРОФИЛИРОВАНИЕ
+# ====================
 
+class Profiler:
+    """Профилирование чекера и обработчиков событий в ограниченном окне.
+    
+    Пока окно открыто, каждый вызов обернутой функции выполняется под
+    cProfile, а tracemalloc собирает выделения памяти. По окончании окна
+    результаты сохраняются в PROFILES_PATH.
+    """
+    _until = 0.0
+    _started = 0.0
+    _stats: Dict[str, pstats.Stats] = {}
+    _calls: Dict[str, int] = {}
+    _own_tracemalloc = False
+    _timer = None
+    _on_finish = None
+    _lock = threading.Lock()
+    
+    @classmethod
+    def is_active(cls) -> bool:
+        return time.time() < cls._until
+    
+    @classmethod
+    def start(cls, seconds: int = PROFILE_DEFAULT_SECONDS, on_finish=None) -> bool:
+        """Открыть окно профилирования; False, если оно уже открыто"""
+        seconds = max(1, min(int(seconds), PROFILE_MAX_SECONDS))
+        with cls._lock:
+            if cls.is_active():
+                return False
+            cls._stats = {}
+            cls._calls = {}
+            cls._started = time.time()
+            cls._until = cls._started + seconds
+            cls._on_finish = on_finish
+            cls._own_tracemalloc = not tracemalloc.is_tracing()
+            if cls._own_tracemalloc:
+                tracemalloc.start(10)
+            cls._timer = threading.Timer(seconds, cls.finish)
+            cls._timer.daemon = True
+            cls._timer.start()
+        logger.info(f"Профилирование включено на {seconds} сек")
+        return True
+    
+    @classmethod
+    def run(cls, name: str, func, *args, **kwargs):
+        """Вызов функции под профилировщиком, если окно открыто"""
+        if not cls.is_active():
+            return func(*args, **kwargs)
+        
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Другой профилировщик уже активен (Python 3.12+)
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            with cls._lock:
+                if name in cls._stats:
+                    cls._stats[name].add(profile)
+                else:
+                    cls._stats[name] = pstats.Stats(profile)
+                cls._calls[name] = cls._calls.get(name, 0) + 1
+    
+    @classmethod
+    def wrap(cls, name: str):
+        """Декоратор для функций, которые нужно профилировать"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return cls.run(name, func, *args, **kwargs)
+            return wrapper
+        return decorator
+    
+    @classmethod
+    def finish(cls) -> List[str]:
+        """Закрыть окно и сохранить pstats и отчет по памяти"""
+        with cls._lock:
+            if cls._timer is not None:
+                cls._timer.cancel()
+                cls._timer = None
+            cls._until = 0.0
+            stats, calls = cls._stats, cls._calls
+            cls._stats, cls._calls = {}, {}
+            on_finish, cls._on_finish = cls._on_finish, None
+            own_tracemalloc, cls._own_tracemalloc = cls._own_tracemalloc, False
+        
+        files = []
+        try:
+            os.makedirs(PROFILES_PATH, exist_ok=True)
+            prefix = f"{PROFILES_PATH}/{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            
+            for name, stat in stats.items():
+                stat.dump_stats(f"{prefix}_{name}.pstats")
+                stream = io.StringIO()
+                stat.stream = stream
+                stream.write(f"{name}: {calls.get(name, 0)} вызовов\n\n")
+                stat.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+                with open(f"{prefix}_{name}.txt", "w", encoding='utf-8') as file:
+                    file.write(stream.getvalue())
+                files += [f"{prefix}_{name}.pstats", f"{prefix}_{name}.txt"]
+            
+            if tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                with open(f"{prefix}_memory.txt", "w", encoding='utf-8') as file:
+                    file.write(f"Текущая память: {current / 1024:.1f} КБ, пик: {peak / 1024:.1f} КБ\n\n")
+                    for stat in snapshot.statistics("lineno")[:PROFILE_TOP_N]:
+                        file.write(f"{stat}\n")
+                files.append(f"{prefix}_memory.txt")
+                if own_tracemalloc:
+                    tracemalloc.stop()
+            
+            logger.info(f"Профилирование завершено, отчеты: {len(files)} файлов в {PROFILES_PATH}")
+        except Exception as e:
+            logger.error(f"Ошибка сохранения результатов профилирования: {e}", exc_info=True)
+        
+        if on_finish:
+            try:
+                on_finish(files, calls)
+            except Exception as e:
+                logger.error(f"Ошибка уведомления о профилировании: {e}")
+        return files
 
-def load_refill() -> dict:
-    """Загрузка рефиллов"""
-    return load_json_safe(REFILL_FILE, {}, 'refill')
 
+# ====================
+# МОДЕЛИ ЗАКАЗОВ
+# ====================
 
-def save_refill(orders: dict) -> bool:
-    """Сохранение рефиллов"""
-    return save_json_safe(REFILL_FILE, orders, 'refill')
+def _to_int(value: Any, default: int = 0) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
 
 
-def load_settings() -> dict:
-    """Загрузка настроек"""
-    settings = load_json_safe(SETTINGS_FILE, None, 'settings')
-    if settings is None:
-        settings = DEFAULT_SETTINGS.copy()
-        save_settings(settings)
-    else:
-        # Добавляем новые настройки если их нет
-        updated = False
-        for key, value in DEFAULT_SETTINGS.items():
-            if key not in settings:
-                settings[key] = value
-                updated = True
-        if updated:
-            save_settings(settings)
+@dataclass(slots=True)
+class PaidOrder:
+    """Оплаченный заказ FunPay, ожидающий ссылку (payorders.json)"""
+    order_id: str
+    amount: int
+    price: float = 0.0
+    currency: str = "₽"
+    title: str = ""
+    service_id: int = 0
+    buyer: str = ""
+    url: str = ""
+    new_user: bool = True
+    chat_id: Any = ""
+    created_at: str = ""
+    api_type: str = "API_1"
     
-    return settings
+    @classmethod
+    def from_dict(cls, data: Dict) -> "PaidOrder":
+        return cls(
+            str(data.get('OrderID', '')),
+            _to_int(data.get('Amount')),
+            data.get('OrderPrice', 0.0),
+            data.get('OrderCurrency', '₽'),
+            data.get('Order', ''),
+            _to_int(data.get('service_id')),
+            data.get('buyer', ''),
+            data.get('url', ''),
+            data.get('NewUser', True),
+            data.get('chat_id', ''),
+            data.get('OrderDateTime', ''),
+            data.get('api_type', 'API_1'),
+        )
+    
+    def to_dict(self) -> Dict:
+        return {
+            'OrderID': self.order_id,
+            'Amount': self.amount,
+            'OrderPrice': self.price,
+            'OrderCurrency': self.currency,
+            'Order': self.title,
+            'service_id': self.service_id,
+            'buyer': self.buyer,
+            'url': self.url,
+            'NewUser': self.new_user,
+            'chat_id': self.chat_id,
+            'OrderDateTime': self.created_at,
+            'api_type': self.api_type,
+        }
+    
+    def to_active(self) -> "ActiveOrder":
+        """Заказ, переданный сайту SMM"""
+        return ActiveOrder(
+            self.service_id, self.chat_id, self.order_id, self.url, self.amount, 0, self.created_at, "pending", self.api_type
+        )
 
 
-def save_settings(settings: dict) -> bool:
-    """Сохранение настроек"""
-    result = save_json_safe(SETTINGS_FILE, settings, 'settings')
-    if result:
-        SettingsCache.invalidate()
-    return result
+@dataclass(slots=True)
+class ActiveOrder:
+    """Заказ на сайте SMM, который проверяет чекер (orders.json, ключ - ID на сайте)"""
+    service_id: int
+    chat_id: Any
+    order_id: str
+    url: str
+    amount: int
+    remains: int = 0
+    created_at: str = ""
+    status: str = "pending"
+    provider: str = ""  # пусто - заказ прошлых версий, создан на API_1 или API_2
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ActiveOrder":
+        return cls(
+            _to_int(data.get('service_id')),
+            data.get('chat_id', ''),
+            str(data.get('order_id', '')),
+            data.get('order_url', ''),
+            _to_int(data.get('order_amount')),
+            _to_int(data.get('partial_amount')),
+            data.get('orderdatetime', ''),
+            data.get('status', 'pending'),
+            data.get('api_type', ''),
+        )
+    
+    def to_dict(self) -> Dict:
+        return {
+            'service_id': self.service_id,
+            'chat_id': self.chat_id,
+            'order_id': self.order_id,
+            'order_url': self.url,
+            'order_amount': self.amount,
+            'partial_amount': self.remains,
+            'orderdatetime': self.created_at,
+            'status': self.status,
+            'api_type': self.provider,
+        }
+    
+    def apply_status(self, status: str, remains: int) -> None:
+        self.status = status
+        self.remains = remains
 
 
-def get_api_url(type_api=None) -> str:
-    """Получить API URL с валидацией"""
-    settings = SettingsCache.get_settings()
-    key = "api_url_2" if type_api else "api_url"
-    url = settings.get(key, "")
+@dataclass(slots=True)
+class DeferredOrder:
+    """Подтвержденный заказ, ожидающий доступности панели (deferred.json, ключ - ID FunPay)"""
+    order: PaidOrder
+    attempts: int = 1
+    next_at: float = 0.0
+    deadline: float = 0.0
+    deferred_at: float = 0.0
+    provider: str = ""  # панель, не ответившая последней
+    error: str = ""
+    unconfirmed: bool = False  # панель не ответила на создание: ждет проверки администратором
     
-    if url:
-        is_valid, error = Validator.validate_url(url)
-        if not is_valid:
-            logger.warning(f"Некорректный {key}: {error}")
-            return ""
+    @classmethod
+    def from_dict(cls, data: Dict) -> "DeferredOrder":
+        return cls(
+            PaidOrder.from_dict(data.get('order', {})),
+            _to_int(data.get('attempts'), 1),
+            float(data.get('next_at', 0)),
+            float(data.get('deadline', 0)),
+            float(data.get('deferred_at', 0)),
+            data.get('provider', ''),
+            data.get('error', ''),
+            bool(data.get('unconfirmed', False)),
+        )
     
-    return url
+    def to_dict(self) -> Dict:
+        return {
+            'order': self.order.to_dict(),
+            'attempts': self.attempts,
+            'next_at': self.next_at,
+            'deadline': self.deadline,
+            'deferred_at': self.deferred_at,
+            'provider': self.provider,
+            'error': self.error,
+            'unconfirmed': self.unconfirmed,
+        }
 
 
-def get_api_key(type_api=None) -> str:
-    """Получить API ключ с валидацией"""
-    settings = SettingsCache.get_settings()
-    key = "api_key_2" if type_api else "api_key"
-    api_key = settings.get(key, "")
+@dataclass(slots=True)
+class RefundRequest:
+    """Возврат средств в очереди (refund_queue.json, ключ - ID заказа FunPay)"""
+    reason: str
+    smm_order_id: str = ""
+    status: str = "pending"  # pending, done, dropped
+    attempts: int = 0
+    queued_at: float = 0.0
+    next_at: float = 0.0
+    finished_at: float = 0.0
+    error: str = ""
     
-    if api_key:
-        is_valid, error = Validator.validate_api_key(api_key)
-        if not is_valid:
-            logger.warning(f"Некорректный {key}: {error}")
-            return ""
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RefundRequest":
+        return cls(
+            data.get('reason', ''),
+            str(data.get('smm_order_id', '') or ''),
+            data.get('status', 'pending'),
+            _to_int(data.get('attempts'), 0),
+            float(data.get('queued_at', 0)),
+            float(data.get('next_at', 0)),
+            float(data.get('finished_at', 0)),
+            data.get('error', ''),
+        )
     
-    return api_key
+    def to_dict(self) -> Dict:
+        return {
+            'reason': self.reason,
+            'smm_order_id': self.smm_order_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'queued_at': self.queued_at,
+            'next_at': self.next_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+        }
+
+
+@dataclass(slots=True)
+class RefillRecord:
+    """Запрос рефилла заказа (refill.json, ключ - ID заказа на сайте)"""
+    refill_id: str
+    chat_id: Any = ""
+    requested_at: str = ""
+    count: int = 1
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RefillRecord":
+        return cls(
+            str(data.get('refill_id', '')),
+            data.get('chat_id', ''),
+            data.get('requested_at', ''),
+            _to_int(data.get('count'), 1),
+        )
+    
+    def to_dict(self) -> Dict:
+        return {
+            'refill_id': self.refill_id,
+            'chat_id': self.chat_id,
+            'requested_at': self.requested_at,
+            'count': self.count,
+        }
 
 
 # ====================
-# ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
+# РАБОТА С ФАЙЛАМИ (улучшенная)
 # ====================
 
-def extract_links(text: str) -> List[str]:
-    """Извлечение ссылок из текста"""
-    if not text:
-        return []
-    
-    link_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-    links = re.findall(link_pattern, text)
-    return links
+def ensure_storage_exists():
+    """Создание директории хранилища"""
+    try:
+        os.makedirs(STORAGE_PATH, exist_ok=True)
+    except Exception as e:
+        logger.error(f"Не удалось создать директорию хранилища: {e}")
 
 
-def find_order_by_buyer(orders: List[Dict], buyer: str) -> Optional[Dict]:
-    """Поиск заказа по имени покупателя"""
-    if not buyer or not orders:
+def file_version(filepath: str) -> Optional[Tuple[int, int, int]]:
+    """Версия файла на диске: меняется при каждой атомарной замене"""
+    try:
+        stat = os.stat(filepath)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    except OSError:
         return None
-    
-    for order in orders:
-        if order.get('buyer') == buyer:
-            return order
-    return None
 
 
-def validate_telegram_link(link: str, allow_private: bool = False) -> Tuple[bool, Optional[str]]:
-    """Валидация Telegram ссылки"""
-    if not link:
-        return False, "Ссылка не может быть пустой"
+def _read_json(filepath: str, lock_type: str) -> Any:
+    started = time.perf_counter()
+    for attempt in range(3):
+        try:
+            with open(filepath, "r", encoding='utf-8') as file:
+                data = json.load(file)
+            break
+        except PermissionError:
+            # Windows: файл заменяется другим процессом
+            if attempt == 2:
+                raise
+            time.sleep(LOCK_POLL_INTERVAL)
+    Metrics.observe("autosmm_storage_seconds", time.perf_counter() - started, op="load", file=lock_type)
+    return data
+
+
+def load_json_versioned(filepath: str, default: Any, lock_type: str) -> Tuple[Any, Optional[Tuple[int, int, int]]]:
+    """Загрузка JSON вместе с версией файла.
     
-    if "t.me" not in link.lower() and "telegram.me" not in link.lower():
-        return True, None  # Не Telegram ссылка
+    Запись всегда идет через атомарную замену, поэтому читатель видит
+    целый файл и не ждет писателя. Только поврежденный файл
+    перепроверяется под блокировкой, прежде чем уйти в бэкап.
+    """
+    version = file_version(filepath)
+    if version is None:
+        return default, None
     
-    if not allow_private and ("/c/" in link or "+" in link):
-        return False, "Закрытые каналы/группы не поддерживаются"
+    try:
+        data = _read_json(filepath, lock_type)
+        if file_version(filepath) == version:
+            return data, version
+    except json.JSONDecodeError:
+        pass
+    except FileNotFoundError:
+        return default, None
+    except Exception as e:
+        logger.error(f"Ошибка чтения {filepath}: {e}")
+        return default, None
     
-    return True, None
+    # Файл изменился во время чтения или не разобрался - повторяем под блокировкой
+    with FileLocker.get_lock(lock_type):
+        version = file_version(filepath)
+        if version is None:
+            return default, None
+        try:
+            return _read_json(filepath, lock_type), version
+        except json.JSONDecodeError as e:
+            logger.error(f"Ошибка декодирования JSON из {filepath}: {e}")
+            # Создаем бэкап поврежденного файла
+            try:
+                backup_path = f"{filepath}.corrupted_{int(time.time())}"
+                os.rename(filepath, backup_path)
+                logger.warning(f"Поврежденный файл сохранен как {backup_path}")
+            except:
+                pass
+            return default, None
+        except Exception as e:
+            logger.error(f"Ошибка чтения {filepath}: {e}")
+            return default, None
 
 
-# ====================
-# SMM API КЛИЕНТ (улучшенный)
-# ====================
+def load_json_safe(filepath: str, default: Any, lock_type: str) -> Any:
+    """Безопасная загрузка JSON без ожидания писателей"""
+    return load_json_versioned(filepath, default, lock_type)[0]
 
-class SocTypeAPI:
-    """Клиент для работы с SMM API с retry механизмом"""
-    
-    @staticmethod
-    def _make_request_with_retry(url: str, max_retries: int = 3, timeout: int = 30) -> Optional[Dict]:
-        """HTTP запрос с повторными попытками"""
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(url, timeout=timeout)
-                response.raise_for_status()
-                return response.json()
-            except requests.exceptions.Timeout:
-                logger.warning(f"Timeout при запросе (попытка {attempt + 1}/{max_retries})")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)  # Экспоненциальная задержка
-                continue
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Ошибка HTTP запроса: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)
-                continue
-            except json.JSONDecodeError as e:
-                logger.error(f"Ошибка декодирования JSON: {e}")
-                return None
-        
-        return None
+
+def _replace_file(source: str, target: str) -> None:
+    for attempt in range(5):
+        try:
+            os.replace(source, target)
+            return
+        except PermissionError:
+            # Windows: целевой файл в этот момент открыт читателем
+            if attempt == 4:
+                raise
+            time.sleep(LOCK_POLL_INTERVAL * (attempt + 1))
+
+
+def save_json_safe(filepath: str, data: Any, lock_type: str, compact: bool = False,
+                   expected_version: Any = False) -> bool:
+    """Безопасное сохранение JSON с блокировкой и атомарной записью.
     
-    @staticmethod
-    def create_order(service_id: int, link: str, quantity: int, api_url: str, api_key: str):
-        """Создание заказа с валидацией"""
-        # Валидация входных данных
-        is_valid, error = Validator.validate_service_id(service_id)
-        if not is_valid:
-            return f"Ошибка валидации service_id: {error}"
-        
-        is_valid, error = Validator.validate_quantity(quantity)
-        if not is_valid:
-            return f"Ошибка валидации quantity: {error}"
+    compact - запись без отступов быстрым C кодировщиком для служебных файлов.
+    expected_version - запись только если файл не менялся с этой версии
+    (None - файла не было); иначе возвращается False.
+    """
+    with FileLocker.get_lock(lock_type):
+        if expected_version is not False and file_version(filepath) != expected_version:
+            Metrics.inc("autosmm_storage_conflicts_total", file=lock_type)
+            return False
         
-        if not link:
-            return "Ошибка: ссылка не может быть пустой"
+        ensure_storage_exists()
+        temp_filepath = f"{filepath}.{os.getpid()}.tmp"
         
-        # Формирование URL
         try:
-            url = f"{api_url}?action=add&service={service_id}&link={link}&quantity={quantity}&key={api_key}"
-            logger.info(f"Создание заказа: service={service_id}, quantity={quantity}")
-            
-            response = SocTypeAPI._make_request_with_retry(url)
-            
-            if not response:
-                return "Ошибка подключения к API"
+            started = time.perf_counter()
+            # Запись во временный файл
+            with open(temp_filepath, "w", encoding='utf-8') as file:
+                if compact:
+                    file.write(json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+                else:
+                    json.dump(data, file, indent=4, ensure_ascii=False)
+                size = file.tell()
             
-            if "order" in response:
-                logger.info(f"Заказ создан успешно: {response['order']}")
-                return response["order"]
-            elif "error" in response:
-                logger.error(f"API вернул ошибку: {response['error']}")
-                return response["error"]
-            else:
-                logger.error(f"Неожиданный ответ API: {response}")
-                return "Неизвестная ошибка API"
-                
+            # Атомарная замена
+            _replace_file(temp_filepath, filepath)
+            Metrics.observe("autosmm_storage_seconds", time.perf_counter() - started, op="save", file=lock_type)
+            Metrics.set_gauge("autosmm_storage_file_bytes", size, file=lock_type)
+            return True
         except Exception as e:
-            logger.error(f"Исключение при создании заказа: {e}", exc_info=True)
-            return f"Ошибка: {str(e)}"
+            logger.error(f"Ошибка сохранения {filepath}: {e}")
+            # Удаляем временный файл при ошибке
+            if os.path.exists(temp_filepath):
+                try:
+                    os.remove(temp_filepath)
+                except:
+                    pass
+            return False
+
+
+def _copy_default(data: Any, default: Any) -> Any:
+    """Значение по умолчанию не должно меняться мутатором"""
+    if data is default and isinstance(default, (dict, list)):
+        return type(default)(default)
+    return data
+
+
+def update_json_safe(filepath: str, default: Any, lock_type: str, mutator, compact: bool = False) -> Any:
+    """Чтение, изменение и запись JSON без потерянных обновлений между процессами.
     
-    @staticmethod
-    def get_order_status(order_id: int, api_url: str, api_key: str) -> Optional[dict]:
-        """Получение статуса заказа"""
-        try:
-            url = f"{api_url}?action=status&order={order_id}&key={api_key}"
-            response = SocTypeAPI._make_request_with_retry(url)
-            
-            if response and "error" not in response:
-                return response
-            else:
-                logger.warning(f"Ошибка получения статуса заказа {order_id}")
-                return None
-                
-        except Exception as e:
-            logger.error(f"Исключение при получении статуса: {e}")
-            return None
+    mutator меняет данные на месте; вернув False, отменяет запись. Сначала
+    данные читаются без блокировки и записываются, только если файл за это
+    время не изменился; после STORAGE_OPTIMISTIC_RETRIES конфликтов чтение,
+    изменение и запись выполняются целиком под блокировкой. None - запись не удалась.
+    """
+    for _ in range(STORAGE_OPTIMISTIC_RETRIES):
+        data, version = load_json_versioned(filepath, default, lock_type)
+        data = _copy_default(data, default)
+        if mutator(data) is False:
+            return data
+        if save_json_safe(filepath, data, lock_type, compact, expected_version=version):
+            return data
     
-    @staticmethod
-    def refill_order(order_id: int, api_url: str, api_key: str) -> Optional[str]:
-        """Рефилл заказа"""
-        try:
-            url = f"{api_url}?action=refill&order={order_id}&key={api_key}"
-            response = SocTypeAPI._make_request_with_retry(url)
-            
-            if response and "refill" in response:
-                return response["refill"]
-            return None
-            
-        except Exception as e:
-            logger.error(f"Ошибка рефилла: {e}")
+    with FileLocker.get_lock(lock_type):
+        data = _copy_default(load_json_safe(filepath, default, lock_type), default)
+        if mutator(data) is not False and not save_json_safe(filepath, data, lock_type, compact):
             return None
-    
-    @staticmethod
-    def get_balance(api_url: str, api_key: str) -> Tuple[Optional[float], Optional[str]]:
-        """Получение баланса"""
-        try:
-            url = f"{api_url}?action=balance&key={api_key}"
-            response = SocTypeAPI._make_request_with_retry(url)
-            
-            if not response:
-                return None, None
-            
-            balance_str = response.get('balance', '')
-            pattern = r'\d+\.\d+'
-            match = re.search(pattern, str(balance_str))
-            
-            if match:
-                balance = float(match.group())
-                currency = response.get('currency', 'USD')
-                return balance, currency
-            
-            return None, None
-            
-        except Exception as e:
-            logger.error(f"Ошибка получения баланса: {e}")
-            return None, None
-    
-    @staticmethod
-    def cancel_order(order_id: int, api_url: str, api_key: str) -> Optional[str]:
-        """Отмена заказа"""
+        return data
+
+
+def append_jsonl_safe(filepath: str, row: Dict, lock_type: str) -> bool:
+    """Дозапись строки в JSONL файл с блокировкой"""
+    with FileLocker.get_lock(lock_type):
+        ensure_storage_exists()
         try:
-            url = f"{api_url}?action=cancel&order={order_id}&key={api_key}"
-            response = SocTypeAPI._make_request_with_retry(url)
-            
-            if response and "cancel" in response:
-                return response["cancel"]
-            return None
-            
+            with open(filepath, "a", encoding='utf-8') as file:
+                file.write(json.dumps(row, ensure_ascii=False) + "\n")
+            return True
         except Exception as e:
-            logger.error(f"Ошибка отмены: {e}")
-            return None
-
+            logger.error(f"Ошибка записи в {filepath}: {e}")
+            return False
 
-# ====================
-# ОБРАБОТЧИКИ СОБЫТИЙ
-# ====================
 
-def bind_to_new_order(c: Cardinal, e: NewOrderEvent) -> None:
-    """Обработка нового заказа"""
-    try:
-        _element_data = e.order
-        _order_id = _element_data.id
-        
-        logger.info(f"Получен новый заказ #{_order_id}")
-        
-        # Получаем полные данные заказа
-        try:
-            _element_full_data = c.account.get_order(_order_id)
-            _full_disc = _element_full_data.full_description
-            _buyer_uz = _element_full_data.buyer_username
-        except Exception as ex:
-            logger.error(f"Не удалось получить данные заказа #{_order_id}: {ex}")
-            return
-        
-        # Уведомление о балансе (если включено)
-        settings = SettingsCache.get_settings()
-        if settings.get("set_alert_smmbalance_new", False):
+def iter_jsonl(filepath: str) -> Iterator[Dict]:
+    """Построчное чтение JSONL файла без загрузки его целиком"""
+    if not os.path.exists(filepath):
+        return
+    
+    with open(filepath, "r", encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
             try:
-                send_smm_balance_info(c)
-            except Exception as ex:
-                logger.error(f"Ошибка отправки баланса: {ex}")
-        
-        # Извлечение параметров из описания
-        match_id = re.search(r'ID:\s*(\d+)', _full_disc)
-        match_oid = re.search(r'ID2:\s*(\d+)', _full_disc)
-        match_quan = re.search(r'#Quan:\s*(\d+)', _full_disc)
-        
-        if match_id:
-            id_value = match_id.group(1)
-            quan_value = int(match_quan.group(1)) if match_quan else 1
-            
-            # Валидация параметров
-            is_valid, error = Validator.validate_service_id(id_value)
-            if not is_valid:
-                logger.error(f"Некорректный service_id в заказе #{_order_id}: {error}")
-                return
-            
-            is_valid, error = Validator.validate_quantity(quan_value)
-            if not is_valid:
-                logger.error(f"Некорректный quantity в заказе #{_order_id}: {error}")
-                return
-            
-            order_handler(c, e, id_value, quan_value, _buyer_uz, 'API_1')
-            
-        elif match_oid:
-            id_value = match_oid.group(1)
-            quan_value = int(match_quan.group(1)) if match_quan else 1
-            
-            # Валидация параметров
-            is_valid, error = Validator.validate_service_id(id_value)
-            if not is_valid:
-                logger.error(f"Некорректный service_id в заказе #{_order_id}: {error}")
-                return
-            
-            order_handler(c, e, id_value, quan_value, _buyer_uz, 'API_2')
-        else:
-            logger.info(f"Заказ #{_order_id} не предназначен для автонакрутки")
-            
-    except Exception as ex:
-        logger.error(f"Критическая ошибка в bind_to_new_order: {ex}", exc_info=True)
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Пропущена поврежденная строка в {filepath}")
 
 
-def order_handler(c: Cardinal, e: NewOrderEvent, id_value: str, quan_value: int, buyer_uz: str, type_api: str = 'API_1') -> None:
-    """Обработчик заказа"""
-    try:
-        orders_data = load_payorders()
+class ActiveOrderStore:
+    """Активные заказы в памяти; orders.json перечитывается только после изменения на диске"""
+    _orders: Optional[Dict[str, ActiveOrder]] = None
+    _version: Optional[Tuple[int, int, int]] = None
+    
+    @classmethod
+    def current(cls) -> Dict[str, ActiveOrder]:
+        """Актуальный словарь заказов; для изменения - под блокировкой 'orders'"""
+        orders = cls._orders
+        if orders is None or file_version(ORDERS_FILE) != cls._version:
+            raw, version = load_json_versioned(ORDERS_FILE, {}, 'orders')
+            orders = {smm_id: ActiveOrder.from_dict(data) for smm_id, data in raw.items()}
+            cls._orders, cls._version = orders, version
+        return orders
+    
+    @classmethod
+    def write(cls, orders: Dict[str, ActiveOrder]) -> bool:
+        """Запись заказов (вызывать под блокировкой 'orders')"""
+        result = save_json_safe(ORDERS_FILE, {smm_id: order.to_dict() for smm_id, order in orders.items()}, 'orders')
+        if result:
+            cls._orders, cls._version = orders, file_version(ORDERS_FILE)
+        else:
+            cls._orders = None
+        return result
+    
+    @classmethod
+    def invalidate(cls) -> None:
+        cls._orders = None
+        cls._version = None
+
+
+def load_orders() -> Dict[str, ActiveOrder]:
+    """Загрузка заказов без ожидания писателей"""
+    return dict(ActiveOrderStore.current())
+
+
+def save_orders(orders: Dict[str, ActiveOrder]) -> bool:
+    """Сохранение заказов"""
+    with FileLocker.get_lock('orders'):
+        return ActiveOrderStore.write(dict(orders))
+
+
+def update_orders(mutator) -> Dict[str, ActiveOrder]:
+    """Атомарное изменение заказов: mutator меняет словарь на месте.
+    
+    Блокировка общая для процессов, а словарь перечитывается, если
+    orders.json успел изменить другой процесс.
+    """
+    with FileLocker.get_lock('orders'):
+        orders = dict(ActiveOrderStore.current())
+        mutator(orders)
+        ActiveOrderStore.write(orders)
+        return dict(orders)
+
+
+# Покупатели с оплаченными заказами и версия payorders.json, по которой построен индекс:
+# фильтр сообщений без чтения файла, пока его не изменил другой процесс
+_open_buyers: Optional[Tuple[frozenset, Optional[Tuple[int, int, int]]]] = None
+
+
+def _index_payorders(orders: List[PaidOrder], version: Optional[Tuple[int, int, int]]) -> None:
+    global _open_buyers
+    _open_buyers = (frozenset(order.buyer for order in orders), version)
+    Metrics.set_gauge("autosmm_paid_orders", len(orders))
+
+
+def load_payorders() -> List[PaidOrder]:
+    """Загрузка оплаченных заказов"""
+    raw, version = load_json_versioned(PAYORDERS_FILE, [], 'payorders')
+    orders = [PaidOrder.from_dict(data) for data in raw]
+    _index_payorders(orders, version)
+    return orders
+
+
+def save_payorders(orders: List[PaidOrder]) -> bool:
+    """Сохранение оплаченных заказов"""
+    result = save_json_safe(PAYORDERS_FILE, [order.to_dict() for order in orders], 'payorders')
+    _index_payorders(orders, file_version(PAYORDERS_FILE) if result else None)
+    return result
+
+
+def has_open_order(buyer: str) -> bool:
+    """Есть ли у покупателя оплаченный заказ, ожидающий ссылку"""
+    index = _open_buyers
+    if index is None or file_version(PAYORDERS_FILE) != index[1]:
+        load_payorders()
+        index = _open_buyers
+    return buyer in index[0]
+
+
+def find_open_order(buyer: str) -> Optional[PaidOrder]:
+    """Оплаченный заказ покупателя; файл читается только при наличии заказа"""
+    if not has_open_order(buyer):
+        return None
+    return find_order_by_buyer(load_payorders(), buyer)
+
+
+def update_payorders(mutator) -> Optional[List[PaidOrder]]:
+    """Атомарное изменение оплаченных заказов: mutator меняет список на месте.
+    
+    Может вызываться повторно при конфликте с другим процессом, поэтому
+    mutator не должен иметь внешних эффектов; вернув False, он отменяет запись.
+    None - сохранить не удалось.
+    """
+    def apply(raw: List[Dict]):
+        orders = [PaidOrder.from_dict(data) for data in raw]
+        if mutator(orders) is False:
+            return False
+        raw[:] = [order.to_dict() for order in orders]
+    
+    raw = update_json_safe(PAYORDERS_FILE, [], 'payorders', apply)
+    if raw is None:
+        return None
+    orders = [PaidOrder.from_dict(data) for data in raw]
+    _index_payorders(orders, file_version(PAYORDERS_FILE))
+    return orders
+
+
+def _remove_payorder_where(predicate) -> Optional[PaidOrder]:
+    removed: List[PaidOrder] = []
+    
+    def mutate(orders: List[PaidOrder]):
+        removed.clear()
+        order = next((o for o in orders if predicate(o)), None)
+        if order is None:
+            return False
+        orders.remove(order)
+        removed.append(order)
+    
+    if update_payorders(mutate) is None:
+        return None
+    return removed[0] if removed else None
+
+
+def remove_payorder_by_buyer(buyer: str, status: str) -> Optional[PaidOrder]:
+    """Удаление оплаченного заказа покупателя с переносом в архив"""
+    order = _remove_payorder_where(lambda o: o.buyer == buyer)
+    if order is not None:
+        archive_payorder(order, status)
+    return order
+
+
+def remove_payorder(order_id: Any, status: str, smm_order_id: Any = None,
+                    buyer: Optional[str] = None) -> Optional[PaidOrder]:
+    """Удаление оплаченного заказа из списка с переносом в архив; buyer - только заказ этого покупателя"""
+    order = _remove_payorder_where(
+        lambda o: o.order_id == str(order_id) and (buyer is None or o.buyer == buyer)
+    )
+    if order is not None:
+        archive_payorder(order, status, smm_order_id)
+    return order
+
+
+def archive_payorder(order: PaidOrder, status: str, smm_order_id: Any = None) -> bool:
+    """Перенос оплаченного заказа в архив"""
+    row = order.to_dict()
+    row['ArchiveStatus'] = status
+    row['ArchiveDateTime'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if smm_order_id is not None:
+        row['smm_order_id'] = str(smm_order_id)
+    return append_jsonl_safe(PAYORDERS_ARCHIVE_FILE, row, 'payorders_archive')
+
+
+class ProcessedOrders:
+    """Индекс заказов FunPay, событие NewOrderEvent которых уже обработано.
+    
+    ID дописываются по строке в файлы поколений processed/<начало>.txt;
+    поколение живет WINDOW секунд, хранятся GENERATIONS последних, поэтому
+    заказ помнится не меньше WINDOW, а память ограничена заказами за это
+    время. В памяти - множество ID, файлы дочитываются с последней позиции,
+    поэтому записи других процессов видны без полного перечитывания.
+    """
+    WINDOW = 7 * 86400  # секунды
+    GENERATIONS = 2
+    
+    _ids: set = set()
+    _offsets: Dict[str, int] = {}
+    _lock = FileLocker.get_lock('processed')
+    
+    @staticmethod
+    def _generations() -> List[str]:
+        try:
+            names = [name for name in os.listdir(PROCESSED_PATH) if name[:-4].isdigit() and name.endswith(".txt")]
+        except FileNotFoundError:
+            return []
+        return sorted(names, key=lambda name: int(name[:-4]))
+    
+    @classmethod
+    def _refresh(cls) -> List[str]:
+        """Дочитывание новых строк всех поколений (под блокировкой)"""
+        names = cls._generations()
+        if not set(cls._offsets) <= set(names):
+            # Другой процесс удалил старое поколение
+            cls._ids, cls._offsets = set(), {}
+        for name in names:
+            path = f"{PROCESSED_PATH}/{name}"
+            offset = cls._offsets.get(name, 0)
+            try:
+                if os.path.getsize(path) <= offset:
+                    continue
+                with open(path, "rb") as file:
+                    file.seek(offset)
+                    chunk = file.read()
+            except OSError:
+                continue
+            end = chunk.rfind(b"\n") + 1
+            for line in chunk[:end].decode("utf-8", "ignore").split():
+                if line[0] == "-":
+                    cls._ids.discard(line[1:])
+                else:
+                    cls._ids.add(line)
+            cls._offsets[name] = offset + end
+        return names
+    
+    @classmethod
+    def _append(cls, name: str, line: str) -> None:
+        data = (line + "\n").encode("utf-8")
+        with open(f"{PROCESSED_PATH}/{name}", "ab") as file:
+            file.write(data)
+        # Файл дочитан до конца в _refresh, своя строка не читается повторно
+        cls._offsets[name] = cls._offsets.get(name, 0) + len(data)
+    
+    @classmethod
+    def _current(cls, names: List[str]) -> str:
+        """Текущее поколение; при истечении окна - новое, старые удаляются"""
+        now = int(time.time())
+        if names and now - int(names[-1][:-4]) < cls.WINDOW:
+            return names[-1]
+        
+        os.makedirs(PROCESSED_PATH, exist_ok=True)
+        name = f"{now}.txt"
+        seed = [] if names else (
+            [order.order_id for order in load_payorders()] + [order.order_id for order in load_orders().values()]
+        )
+        with open(f"{PROCESSED_PATH}/{name}", "ab") as file:
+            # Первое поколение получает заказы, уже известные хранилищу
+            file.write("".join(f"{order_id}\n" for order_id in seed).encode("utf-8"))
+        for old in names[:len(names) + 1 - cls.GENERATIONS]:
+            try:
+                os.remove(f"{PROCESSED_PATH}/{old}")
+            except OSError:
+                pass
+        cls._refresh()
+        return name
+    
+    @classmethod
+    def claim(cls, order_id: Any) -> bool:
+        """Отметить заказ обработанным; False - событие этого заказа уже было"""
+        order_id = str(order_id)
+        with cls._lock:
+            names = cls._refresh()
+            if order_id in cls._ids:
+                return False
+            current = cls._current(names)
+            if order_id in cls._ids:
+                return False
+            cls._append(current, order_id)
+            cls._ids.add(order_id)
+            return True
+    
+    @classmethod
+    def forget(cls, order_id: Any) -> None:
+        """Снять отметку, чтобы повторное событие обработалось (обработка не удалась)"""
+        order_id = str(order_id)
+        with cls._lock:
+            names = cls._refresh()
+            if order_id in cls._ids:
+                cls._append(cls._current(names), f"-{order_id}")
+                cls._ids.discard(order_id)
+
+
+def load_cashlist() -> dict:
+    """Загрузка кэшлиста (пересозданные заказы прошлых версий)"""
+    return load_json_safe(CASHLIST_FILE, {}, 'cashlist')
+
+
+def load_refill() -> Dict[str, RefillRecord]:
+    """Загрузка рефиллов"""
+    return {smm_id: RefillRecord.from_dict(data) for smm_id, data in load_json_safe(REFILL_FILE, {}, 'refill').items()}
+
+
+def save_refill(refills: Dict[str, RefillRecord]) -> bool:
+    """Сохранение рефиллов"""
+    return save_json_safe(REFILL_FILE, {smm_id: record.to_dict() for smm_id, record in refills.items()}, 'refill')
+
+
+def record_refill(smm_order_id: Any, refill_id: Any, chat_id: Any) -> None:
+    """Учет запроса рефилла"""
+    with FileLocker.get_lock('refill'):
+        refills = load_refill()
+        record = refills.get(str(smm_order_id))
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if record:
+            record.refill_id, record.requested_at, record.count = str(refill_id), now, record.count + 1
+        else:
+            refills[str(smm_order_id)] = RefillRecord(str(refill_id), chat_id, now)
+        save_refill(refills)
+
+
+def load_settings() -> dict:
+    """Загрузка настроек (файл при чтении не перезаписывается)"""
+    settings = load_json_safe(SETTINGS_FILE, None, 'settings')
+    if settings is None:
+        return DEFAULT_SETTINGS.copy()
+    
+    # Добавляем новые настройки если их нет
+    for key, value in DEFAULT_SETTINGS.items():
+        settings.setdefault(key, value)
+    return settings
+
+
+def persist_settings_defaults() -> None:
+    """Сохранение отсутствующих настроек по умолчанию в файл"""
+    stored = load_json_safe(SETTINGS_FILE, None, 'settings')
+    if stored is None or any(key not in stored for key in DEFAULT_SETTINGS):
+        save_settings(load_settings())
+
+
+def save_settings(settings: dict) -> bool:
+    """Сохранение настроек"""
+    settings = dict(settings)
+    result = save_json_safe(SETTINGS_FILE, settings, 'settings')
+    if result:
+        for key, value in DEFAULT_SETTINGS.items():
+            settings.setdefault(key, value)
+        SettingsCache.update(settings)
+    return result
+
+
+def get_api_url(type_api: Optional[str] = None) -> str:
+    """Получить API URL (проверен при загрузке настроек)"""
+    return SettingsCache.credentials(type_api)[0]
+
+
+def get_api_key(type_api: Optional[str] = None) -> str:
+    """Получить API ключ (проверен при загрузке настроек)"""
+    return SettingsCache.credentials(type_api)[1]
+
+
+# ====================
+# ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
+# ====================
+
+def find_order_by_buyer(orders: List[PaidOrder], buyer: str) -> Optional[PaidOrder]:
+    """Поиск заказа по имени покупателя"""
+    if not buyer or not orders:
+        return None
+    
+    for order in orders:
+        if order.buyer == buyer:
+            return order
+    return None
+
+
+_rates_cache: Dict[Tuple[str, str], Tuple[float, float]] = {}
+RATES_CACHE_TTL = 3600  # секунды
+
+
+def get_currency_rate(from_currency: str = 'USD', to_currency: str = 'RUB') -> float:
+    """Курс валют с кэшированием"""
+    cache_key = (from_currency, to_currency)
+    cached = _rates_cache.get(cache_key)
+    if cached and time.time() - cached[1] < RATES_CACHE_TTL:
+        return cached[0]
+    
+    try:
+        url = f'https://api.coingate.com/v2/rates/merchant/{from_currency}/{to_currency}'
+        response = requests.get(url, timeout=10)
+        response.raise_for_status()
+        rate = float(response.text)
+        _rates_cache[cache_key] = (rate, time.time())
+        return rate
+    except Exception as e:
+        logger.error(f"Ошибка получения курса валют: {e}")
+        return cached[0] if cached else 1.0
+
+
+def convert_charge(charge: float, currency: str, fp_currency: str) -> float:
+    """Перевод стоимости заказа SMM в валюту FunPay"""
+    if fp_currency == '₽' and currency == 'USD':
+        return charge * get_currency_rate('USD', 'RUB')
+    if fp_currency == '$' and currency == 'RUB':
+        return charge * get_currency_rate('RUB', 'USD')
+    return charge
+
+
+# ====================
+# ССЫЛКИ
+# ====================
+
+class ParsedLink(NamedTuple):
+    platform: str          # telegram, instagram, tiktok, youtube, vk, other
+    kind: str              # channel, post, invite, profile, video, ... или invalid
+    url: str               # каноническая ссылка
+    private: bool = False
+
+
+class LinkParser:
+    """Разбор ссылок покупателя с определением площадки.
+    
+    Кандидаты ищутся одним проходом finditer по тексту, поэтому находятся и
+    ссылки, приклеенные к словам и скобкам ("ссылка:https://...", "(t.me/x)").
+    Шаблоны без вложенных неограниченных повторов: время разбора линейно по
+    длине текста. Ссылки без схемы принимаются только для известных площадок.
+    """
+    MAX_TOKEN = 2048
+    
+    PLATFORM_NAMES = {
+        "telegram": "Telegram",
+        "instagram": "Instagram",
+        "tiktok": "TikTok",
+        "youtube": "YouTube",
+        "vk": "VK",
+        "other": "другой сайт",
+    }
+    
+    _HOSTS = {
+        "t.me": "telegram",
+        "telegram.me": "telegram",
+        "telegram.dog": "telegram",
+        "instagram.com": "instagram",
+        "instagr.am": "instagram",
+        "tiktok.com": "tiktok",
+        "vm.tiktok.com": "tiktok",
+        "vt.tiktok.com": "tiktok",
+        "youtube.com": "youtube",
+        "youtu.be": "youtube",
+        "vk.com": "vk",
+        "vk.ru": "vk",
+    }
+    _HOST_PREFIXES = ("www.", "m.", "mobile.")
+    
+    # Хост: метки из букв любого алфавита (кириллические домены) и зона, в том числе punycode
+    _HOST = r'(?:[\w-]{1,63}\.){1,8}(?:xn--[a-z0-9-]{1,59}|[^\W\d_]{2,24})'
+    _URL = re.compile(r'(?:(https?)://)?(' + _HOST + r')(?::\d{1,5})?([/?#]\S*)?', re.I)
+    _MENTION = re.compile(r'@([A-Za-z][A-Za-z0-9_]{3,31})')
+    # Кандидат в ссылку или упоминание, не начинающийся посреди слова, хоста или адреса почты
+    _SCAN = re.compile(
+        r'(?<![\w@.-])(?:@[A-Za-z][A-Za-z0-9_]{3,31}(?![\w@])'
+        r'|(?:https?://)?' + _HOST + r'(?::\d{1,5})?(?:[/?#][^\s<>«»"]*)?)',
+        re.I,
+    )
+    _TRAILING = ".,;:!?)]}>»\"'"
+    
+    _TG_USER = re.compile(r'[A-Za-z][A-Za-z0-9_]{3,31}')
+    _TG_HASH = re.compile(r'[A-Za-z0-9_-]{8,64}')
+    _IG_USER = re.compile(r'[A-Za-z0-9._]{1,30}')
+    _IG_CODE = re.compile(r'[A-Za-z0-9_-]{5,64}')
+    _IG_RESERVED = frozenset({"explore", "accounts", "direct", "about", "developer", "legal"})
+    _TT_USER = re.compile(r'@[A-Za-z0-9._]{2,24}')
+    _TT_CODE = re.compile(r'[A-Za-z0-9]{5,16}')
+    _YT_ID = re.compile(r'[A-Za-z0-9_-]{11}')
+    _YT_HANDLE = re.compile(r'@[A-Za-z0-9._-]{3,30}')
+    _YT_CHANNEL = re.compile(r'UC[A-Za-z0-9_-]{22}')
+    _YT_LIST = re.compile(r'[A-Za-z0-9_-]{10,64}')
+    _YT_NAME = re.compile(r'[A-Za-z0-9._-]{1,100}')
+    _VK_OBJECT = re.compile(r'(wall|video|clip|photo)(-?\d{1,12}_\d{1,12})')
+    _VK_NAME = re.compile(r'[A-Za-z0-9_.]{2,64}')
+    
+    # Слова в категории услуги или названии лота, указывающие на площадку
+    _PLATFORM_WORDS = {
+        "telegram": re.compile(r'telegram|телеграм|\btg\b|\bтг\b', re.I),
+        "instagram": re.compile(r'instagram|инстаграм|\binsta\b|\bинста\b', re.I),
+        "tiktok": re.compile(r'tik\s?tok|тик\s?ток', re.I),
+        "youtube": re.compile(r'youtube|ютуб', re.I),
+        "vk": re.compile(r'\bvk\b|вконтакте|\bвк\b', re.I),
+    }
+    
+    @classmethod
+    def find_all(cls, text: str, expected: Optional[str] = None) -> List[ParsedLink]:
+        """Все ссылки из текста; @упоминание относится к ожидаемой площадке"""
+        if not text:
+            return []
+        
+        links = []
+        for match in cls._SCAN.finditer(text):
+            token = match.group().rstrip(cls._TRAILING)
+            if len(token) < 4 or len(token) > cls.MAX_TOKEN:
+                continue
+            link = cls.parse(token, expected)
+            if link is not None:
+                links.append(link)
+        return links
+    
+    @classmethod
+    def parse(cls, token: str, expected: Optional[str] = None) -> Optional[ParsedLink]:
+        """Разбор одного слова, None если это не ссылка"""
+        if token[0] == "@":
+            match = cls._MENTION.fullmatch(token)
+            if not match:
+                return None
+            username = match.group(1)
+            if expected == "tiktok":
+                return ParsedLink("tiktok", "profile", f"https://www.tiktok.com/@{username.lower()}")
+            if expected == "instagram":
+                return ParsedLink("instagram", "profile", f"https://www.instagram.com/{username.lower()}/")
+            return ParsedLink("telegram", "channel", f"https://t.me/{username.lower()}")
+        
+        match = cls._URL.fullmatch(token)
+        if not match:
+            return None
+        scheme, host, rest = match.group(1), match.group(2).lower(), match.group(3) or ""
+        
+        platform = cls._HOSTS.get(host)
+        if platform is None:
+            for prefix in cls._HOST_PREFIXES:
+                if host.startswith(prefix) and host[len(prefix):] in cls._HOSTS:
+                    host = host[len(prefix):]
+                    platform = cls._HOSTS[host]
+                    break
+        
+        if platform is None:
+            # Произвольный сайт принимается только со схемой
+            if not scheme:
+                return None
+            return ParsedLink("other", "link", f"{scheme.lower()}://{host}{rest}")
+        
+        rest = rest.split("#", 1)[0]
+        path, _, query = rest.partition("?")
+        segments = [segment for segment in path.split("/") if segment]
+        return getattr(cls, f"_parse_{platform}")(host, segments, query) or ParsedLink(
+            platform, "invalid", f"https://{host}{path}"
+        )
+    
+    @staticmethod
+    def _query_param(query: str, name: str) -> Optional[str]:
+        for pair in query.split("&"):
+            key, _, value = pair.partition("=")
+            if key == name:
+                return value
+        return None
+    
+    @classmethod
+    def _parse_telegram(cls, host: str, segments: List[str], query: str) -> Optional[ParsedLink]:
+        if not segments:
+            return None
+        first = segments[0]
+        
+        if first[0] == "+" and cls._TG_HASH.fullmatch(first[1:]):
+            return ParsedLink("telegram", "invite", f"https://t.me/+{first[1:]}", True)
+        if first == "joinchat" and len(segments) > 1 and cls._TG_HASH.fullmatch(segments[1]):
+            return ParsedLink("telegram", "invite", f"https://t.me/+{segments[1]}", True)
+        if first == "c" and len(segments) > 1 and segments[1].isdigit():
+            tail = "/" + segments[2] if len(segments) > 2 and segments[2].isdigit() else ""
+            return ParsedLink("telegram", "post" if tail else "channel", f"https://t.me/c/{segments[1]}{tail}", True)
+        
+        if first == "s" and len(segments) > 1:
+            segments = segments[1:]
+            first = segments[0]
+        if not cls._TG_USER.fullmatch(first):
+            return None
+        if len(segments) > 1 and segments[1].isdigit():
+            return ParsedLink("telegram", "post", f"https://t.me/{first.lower()}/{segments[1]}")
+        return ParsedLink("telegram", "channel", f"https://t.me/{first.lower()}")
+    
+    @classmethod
+    def _parse_instagram(cls, host: str, segments: List[str], query: str) -> Optional[ParsedLink]:
+        if not segments:
+            return None
+        first = segments[0].lower()
+        
+        if first in ("p", "reel", "reels", "tv") and len(segments) > 1 and cls._IG_CODE.fullmatch(segments[1]):
+            kind = "reel" if first.startswith("reel") else first
+            return ParsedLink("instagram", "post", f"https://www.instagram.com/{kind}/{segments[1]}/")
+        if first == "stories" and len(segments) > 1 and cls._IG_USER.fullmatch(segments[1]):
+            tail = "/" + segments[2] if len(segments) > 2 and segments[2].isdigit() else ""
+            return ParsedLink("instagram", "story", f"https://www.instagram.com/stories/{segments[1].lower()}{tail}/")
+        if first in cls._IG_RESERVED or not cls._IG_USER.fullmatch(first):
+            return None
+        return ParsedLink("instagram", "profile", f"https://www.instagram.com/{first}/")
+    
+    @classmethod
+    def _parse_tiktok(cls, host: str, segments: List[str], query: str) -> Optional[ParsedLink]:
+        if not segments:
+            return None
+        first = segments[0]
+        
+        if host != "tiktok.com":
+            if cls._TT_CODE.fullmatch(first):
+                return ParsedLink("tiktok", "short", f"https://{host}/{first}/")
+            return None
+        if first == "t" and len(segments) > 1 and cls._TT_CODE.fullmatch(segments[1]):
+            return ParsedLink("tiktok", "short", f"https://www.tiktok.com/t/{segments[1]}/")
+        if not cls._TT_USER.fullmatch(first):
+            return None
+        
+        user = first.lower()
+        if len(segments) > 2 and segments[1] in ("video", "photo") and segments[2].isdigit():
+            return ParsedLink("tiktok", "video", f"https://www.tiktok.com/{user}/{segments[1]}/{segments[2]}")
+        return ParsedLink("tiktok", "profile", f"https://www.tiktok.com/{user}")
+    
+    @classmethod
+    def _parse_youtube(cls, host: str, segments: List[str], query: str) -> Optional[ParsedLink]:
+        if host == "youtu.be":
+            if segments and cls._YT_ID.fullmatch(segments[0]):
+                return ParsedLink("youtube", "video", f"https://www.youtube.com/watch?v={segments[0]}")
+            return None
+        if not segments:
+            return None
+        first = segments[0]
+        
+        if first == "watch":
+            video_id = cls._query_param(query, "v")
+            if video_id and cls._YT_ID.fullmatch(video_id):
+                return ParsedLink("youtube", "video", f"https://www.youtube.com/watch?v={video_id}")
+            return None
+        if first in ("shorts", "live", "embed") and len(segments) > 1 and cls._YT_ID.fullmatch(segments[1]):
+            if first == "shorts":
+                return ParsedLink("youtube", "shorts", f"https://www.youtube.com/shorts/{segments[1]}")
+            return ParsedLink("youtube", "video", f"https://www.youtube.com/watch?v={segments[1]}")
+        if first == "playlist":
+            playlist = cls._query_param(query, "list")
+            if playlist and cls._YT_LIST.fullmatch(playlist):
+                return ParsedLink("youtube", "playlist", f"https://www.youtube.com/playlist?list={playlist}")
+            return None
+        if first == "channel" and len(segments) > 1 and cls._YT_CHANNEL.fullmatch(segments[1]):
+            return ParsedLink("youtube", "channel", f"https://www.youtube.com/channel/{segments[1]}")
+        if first in ("c", "user") and len(segments) > 1 and cls._YT_NAME.fullmatch(segments[1]):
+            return ParsedLink("youtube", "channel", f"https://www.youtube.com/{first}/{segments[1]}")
+        if cls._YT_HANDLE.fullmatch(first):
+            return ParsedLink("youtube", "channel", f"https://www.youtube.com/{first.lower()}")
+        return None
+    
+    @classmethod
+    def _parse_vk(cls, host: str, segments: List[str], query: str) -> Optional[ParsedLink]:
+        wall = cls._query_param(query, "w") or cls._query_param(query, "z")
+        for candidate in ([wall] if wall else []) + segments[:1]:
+            match = cls._VK_OBJECT.fullmatch(candidate)
+            if match:
+                kind = "post" if match.group(1) == "wall" else match.group(1)
+                return ParsedLink("vk", kind, f"https://vk.com/{match.group(1)}{match.group(2)}")
+        if segments and cls._VK_NAME.fullmatch(segments[0]):
+            return ParsedLink("vk", "profile", f"https://vk.com/{segments[0].lower()}")
+        return None
+    
+    @classmethod
+    def detect_platform(cls, text: str) -> Optional[str]:
+        """Площадка по тексту категории или лота, None если не ясна"""
+        if not text:
+            return None
+        found = [platform for platform, pattern in cls._PLATFORM_WORDS.items() if pattern.search(text)]
+        return found[0] if len(found) == 1 else None
+    
+    @classmethod
+    def expected_platform(cls, order: PaidOrder, api_url: str = "") -> Optional[str]:
+        """Площадка, которую ждет услуга: сначала каталог провайдера, затем лот"""
+        service = ProviderCache.get_service(api_url, order.service_id) if api_url else None
+        if service:
+            platform = cls.detect_platform(f"{service.get('category', '')} {service.get('name', '')}")
+            if platform:
+                return platform
+        return cls.detect_platform(order.title)
+    
+    @classmethod
+    def validate(cls, link: ParsedLink, expected: Optional[str], allow_private: bool = False) -> Tuple[bool, Optional[str]]:
+        """Проверка ссылки до отправки заказа провайдеру"""
+        if link.kind == "invalid":
+            return False, f"Некорректная ссылка {cls.PLATFORM_NAMES[link.platform]}"
+        if expected and link.platform != expected:
+            return False, (
+                f"Ссылка ведет на {cls.PLATFORM_NAMES[link.platform]}, "
+                f"а услуга для {cls.PLATFORM_NAMES[expected]}"
+            )
+        if link.private and not allow_private:
+            return False, "Закрытые каналы/группы не поддерживаются"
+        return True, None
+
+
+# ====================
+# SMM API КЛИЕНТ (улучшенный)
+# ====================
+
+# Ответ create_order, когда панель не ответила: заказ мог быть создан
+API_CONNECTION_ERROR = "Ошибка подключения к API"
+# Запрос создания ушел на панель, но ответа нет: заказ мог быть создан, повторять нельзя
+API_UNKNOWN_RESULT = "Панель не ответила, заказ мог быть создан"
+
+# Идемпотентные действия API, которые можно дублировать при медленном ответе
+HEDGED_ACTIONS = frozenset({"status", "balance", "services"})
+HEDGE_WORKERS = 4  # потоков для дублируемых чтений на одну панель
+
+
+class HedgePool:
+    """Потоки для чтений с дублированием, отдельно по панелям.
+    
+    Проигравший запрос держит поток до своего таймаута, поэтому медленная
+    панель занимает только свои потоки. Если свободных потоков у панели
+    нет, чтение выполняется без дублирования в вызывающем потоке.
+    """
+    _pools: Dict[str, Tuple[ThreadPoolExecutor, threading.BoundedSemaphore]] = {}
+    _guard = threading.Lock()
+    
+    @classmethod
+    def submit(cls, provider: str, fn, *args) -> Optional[Future]:
+        """Запуск в потоке панели; None - все ее потоки заняты"""
+        with cls._guard:
+            if provider not in cls._pools:
+                cls._pools[provider] = (
+                    ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="AutoSmm-hedge"),
+                    threading.BoundedSemaphore(HEDGE_WORKERS),
+                )
+            pool, slots = cls._pools[provider]
+        if not slots.acquire(blocking=False):
+            return None
+        future = pool.submit(fn, *args)
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+
+class AmbiguousRequestError(Exception):
+    """Неповторяемый запрос дошел до панели, но результат неизвестен"""
+
+
+class SocTypeAPI:
+    """Клиент для работы с SMM API с retry механизмом"""
+    _timeout = 30
+    _max_retries = 3
+    
+    @staticmethod
+    def _new_session() -> requests.Session:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        return session
+    
+    @classmethod
+    def on_settings_changed(cls, old: Optional[MappingProxyType], new: MappingProxyType) -> None:
+        """Таймаут и повторы из настроек, новая сессия при смене провайдеров"""
+        cls._timeout = new.get("api_timeout", 30)
+        cls._max_retries = new.get("max_retries", 3)
+        
+        providers = ("api_url", "api_url_2", "providers")
+        if old is not None and any(old.get(key) != new.get(key) for key in providers):
+            previous, cls._session = cls._session, cls._new_session()
+            previous.close()
+            logger.info("Адрес провайдера изменен, HTTP соединения пересозданы")
+    
+    @staticmethod
+    def _request_labels(url: str) -> Tuple[str, str]:
+        """Действие API и провайдер (хост) для метрик"""
+        parsed = urlparse(url)
+        action = parse_qs(parsed.query).get("action", ["unknown"])[0]
+        return action, parsed.netloc or "unknown"
+    
+    @staticmethod
+    def _get_json(url: str, timeout: float, provider: str) -> Any:
+        """Один GET запрос; задержка успешного ответа попадает в статистику панели"""
+        started = time.perf_counter()
+        response = SocTypeAPI._session.get(url, timeout=timeout)
+        response.raise_for_status()
+        result = response.json()
+        ProviderHealth.record(provider, time.perf_counter() - started, True)
+        return result
+    
+    @staticmethod
+    def _hedged_get(url: str, timeout: float, budget: float, action: str, provider: str) -> Any:
+        """Чтение с дублированием: если ответа нет за budget, уходит второй такой же
+        запрос, и берется первый успешный ответ. Всего ожидание не дольше timeout."""
+        deadline = time.monotonic() + timeout
+        primary = HedgePool.submit(provider, SocTypeAPI._get_json, url, timeout, provider)
+        if primary is None:
+            return SocTypeAPI._get_json(url, timeout, provider)
+        done, _ = wait([primary], timeout=budget)
+        if done:
+            return primary.result()
+        
+        remaining = deadline - time.monotonic()
+        hedge = HedgePool.submit(provider, SocTypeAPI._get_json, url, remaining, provider) if remaining > 0 else None
+        pending = {primary} if hedge is None else {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    winner = "hedge" if future is hedge else "primary"
+                    Metrics.inc("autosmm_api_hedged_total", action=action, provider=provider, winner=winner)
+                    return future.result()
+                error = future.exception()
+        Metrics.inc("autosmm_api_hedged_total", action=action, provider=provider, winner="none")
+        raise error or requests.exceptions.Timeout(f"Нет ответа за {timeout:.1f} с")
+    
+    @staticmethod
+    def _not_sent(error: Exception) -> bool:
+        """Панель точно не выполнила запрос: соединение не установлено или запрос отклонен (4xx)"""
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(error, requests.exceptions.HTTPError):
+            return error.response is not None and error.response.status_code < 500
+        if isinstance(error, requests.exceptions.ConnectionError):
+            reason = getattr(error.args[0], "reason", None) if error.args else None
+            return isinstance(reason, NewConnectionError)
+        return False
+    
+    @staticmethod
+    def _make_request_with_retry(url: str, max_retries: int = None, timeout: int = None,
+                                 unsafe: bool = False) -> Optional[Dict]:
+        """HTTP запрос с повторными попытками.
+        
+        Идемпотентные чтения (HEDGED_ACTIONS) дублируются, если ответ задерживается
+        дольше обычного для панели, и ограничены таймаутом по ее наблюдаемой задержке.
+        Создание заказа никогда не дублируется.
+        
+        unsafe - неповторяемый запрос (создание заказа): повтор только если
+        запрос не дошел до панели, иначе AmbiguousRequestError. None - панель
+        недоступна и запрос точно не выполнен.
+        """
+        max_retries = max_retries or SocTypeAPI._max_retries
+        timeout = timeout or SocTypeAPI._timeout
+        action, provider = SocTypeAPI._request_labels(url)
+        budget = None
+        if action in HEDGED_ACTIONS and SettingsCache.get_settings().get("set_hedged_reads", True):
+            timeout = ProviderHealth.read_timeout(provider, timeout)
+            budget = ProviderHealth.hedge_budget(provider)
+        for attempt in range(max_retries):
+            started = time.perf_counter()
+            try:
+                if budget is not None and budget < timeout:
+                    result = SocTypeAPI._hedged_get(url, timeout, budget, action, provider)
+                else:
+                    result = SocTypeAPI._get_json(url, timeout, provider)
+                elapsed = time.perf_counter() - started
+                Metrics.observe("autosmm_api_request_seconds", elapsed, action=action, provider=provider)
+                return result
+            except requests.exceptions.Timeout as e:
+                Metrics.inc("autosmm_api_errors_total", action=action, provider=provider, kind="timeout")
+                ProviderHealth.record(provider, timeout, False, sample=True)
+                logger.warning(f"Timeout при запросе (попытка {attempt + 1}/{max_retries})",
+                               extra=log_fields(action, provider=provider, latency=time.perf_counter() - started))
+                if unsafe and not SocTypeAPI._not_sent(e):
+                    raise AmbiguousRequestError(str(e)) from e
+                if attempt < max_retries - 1:
+                    time.sleep(2 ** attempt)  # Экспоненциальная задержка
+                continue
+            except requests.exceptions.RequestException as e:
+                Metrics.inc("autosmm_api_errors_total", action=action, provider=provider, kind="http")
+                ProviderHealth.record(provider, time.perf_counter() - started, False)
+                logger.error(f"Ошибка HTTP запроса: {e}",
+                             extra=log_fields(action, provider=provider, latency=time.perf_counter() - started))
+                if unsafe and not SocTypeAPI._not_sent(e):
+                    raise AmbiguousRequestError(str(e)) from e
+                if attempt < max_retries - 1:
+                    time.sleep(2 ** attempt)
+                continue
+            except json.JSONDecodeError as e:
+                Metrics.inc("autosmm_api_errors_total", action=action, provider=provider, kind="json")
+                logger.error(f"Ошибка декодирования JSON: {e}", extra=log_fields(action, provider=provider))
+                if unsafe:
+                    raise AmbiguousRequestError(str(e)) from e
+                return None
+        
+        return None
+    
+    @staticmethod
+    def create_order(service_id: int, link: str, quantity: int, api_url: str, api_key: str):
+        """Создание заказа с валидацией"""
+        # Валидация входных данных
+        is_valid, error = Validator.validate_service_id(service_id)
+        if not is_valid:
+            return f"Ошибка валидации service_id: {error}"
+        
+        is_valid, error = Validator.validate_quantity(quantity)
+        if not is_valid:
+            return f"Ошибка валидации quantity: {error}"
+        
+        if not link:
+            return "Ошибка: ссылка не может быть пустой"
+        
+        # Формирование URL
+        try:
+            url = f"{api_url}?action=add&service={service_id}&link={link}&quantity={quantity}&key={api_key}"
+            logger.info("Создание заказа: service=%s, quantity=%s", service_id, quantity,
+                        extra=log_fields("add", provider=urlparse(api_url).netloc, sample=True))
+            
+            response = SocTypeAPI._make_request_with_retry(url, unsafe=True)
+            
+            if not response:
+                return API_CONNECTION_ERROR
+            
+            if "order" in response:
+                logger.info(f"Заказ создан успешно: {response['order']}",
+                            extra=log_fields("add", response['order'], urlparse(api_url).netloc))
+                return response["order"]
+            # Отказ панели (нет средств, услуга отключена) понижает ее в выборе маршрута;
+            # ошибки проверки до запроса панель не касаются
+            ProviderHealth.record(urlparse(api_url).netloc, 0.0, False)
+            if "error" in response:
+                logger.error(f"API вернул ошибку: {response['error']}",
+                             extra=log_fields("add", provider=urlparse(api_url).netloc))
+                return response["error"]
+            else:
+                logger.error(f"Неожиданный ответ API: {response}")
+                return "Неизвестная ошибка API"
+        
+        except AmbiguousRequestError as e:
+            logger.error(f"Панель не ответила на создание заказа, результат неизвестен: {e}",
+                         extra=log_fields("add", provider=urlparse(api_url).netloc))
+            return API_UNKNOWN_RESULT
+        except Exception as e:
+            logger.error(f"Исключение при создании заказа: {e}", exc_info=True)
+            return f"Ошибка: {str(e)}"
+    
+    @staticmethod
+    def get_order_status(order_id: int, api_url: str, api_key: str) -> Optional[dict]:
+        """Получение статуса заказа"""
+        try:
+            url = f"{api_url}?action=status&order={order_id}&key={api_key}"
+            response = SocTypeAPI._make_request_with_retry(url)
+            
+            if response and "error" not in response:
+                return response
+            else:
+                logger.warning(f"Ошибка получения статуса заказа {order_id}",
+                               extra=log_fields("status", order_id, urlparse(api_url).netloc))
+                return None
+                
+        except Exception as e:
+            logger.error(f"Исключение при получении статуса: {e}")
+            return None
+    
+    @staticmethod
+    def get_orders_status(order_ids: List[Any], api_url: str, api_key: str) -> Optional[Dict[str, dict]]:
+        """Статусы до STATUS_BATCH заказов одним запросом; неизвестные панели ID - с ключом error"""
+        try:
+            url = f"{api_url}?action=status&orders={','.join(str(oid) for oid in order_ids)}&key={api_key}"
+            response = SocTypeAPI._make_request_with_retry(url)
+            
+            if isinstance(response, dict) and "error" not in response:
+                return {str(oid): data for oid, data in response.items() if isinstance(data, dict)}
+            logger.warning(f"Ошибка массового получения статусов: {response}")
+            return None
+                
+        except Exception as e:
+            logger.error(f"Исключение при массовом получении статусов: {e}")
+            return None
+    
+    @staticmethod
+    def refill_order(order_id: int, api_url: str, api_key: str) -> Optional[str]:
+        """Рефилл заказа"""
+        try:
+            url = f"{api_url}?action=refill&order={order_id}&key={api_key}"
+            response = SocTypeAPI._make_request_with_retry(url)
+            
+            if response and "refill" in response:
+                return response["refill"]
+            return None
+            
+        except Exception as e:
+            logger.error(f"Ошибка рефилла: {e}")
+            return None
+    
+    @staticmethod
+    def get_balance(api_url: str, api_key: str) -> Tuple[Optional[float], Optional[str]]:
+        """Получение баланса"""
+        try:
+            url = f"{api_url}?action=balance&key={api_key}"
+            response = SocTypeAPI._make_request_with_retry(url)
+            
+            if not response:
+                return None, None
+            
+            balance_str = response.get('balance', '')
+            pattern = r'\d+\.\d+'
+            match = re.search(pattern, str(balance_str))
+            
+            if match:
+                balance = float(match.group())
+                currency = response.get('currency', 'USD')
+                return balance, currency
+            
+            return None, None
+            
+        except Exception as e:
+            logger.error(f"Ошибка получения баланса: {e}")
+            return None, None
+    
+    @staticmethod
+    def get_services(api_url: str, api_key: str) -> Optional[List[Dict]]:
+        """Получение каталога услуг"""
+        try:
+            url = f"{api_url}?action=services&key={api_key}"
+            response = SocTypeAPI._make_request_with_retry(url)
+            
+            if isinstance(response, list):
+                return response
+            return None
+            
+        except Exception as e:
+            logger.error(f"Ошибка получения каталога услуг: {e}")
+            return None
+    
+    @staticmethod
+    def cancel_order(order_id: int, api_url: str, api_key: str) -> Optional[str]:
+        """Отмена заказа"""
+        try:
+            url = f"{api_url}?action=cancel&order={order_id}&key={api_key}"
+            response = SocTypeAPI._make_request_with_retry(url)
+            
+            if response and "cancel" in response:
+                return response["cancel"]
+            return None
+            
+        except Exception as e:
+            logger.error(f"Ошибка отмены: {e}")
+            return None
+    
+    @staticmethod
+    def _batch_action(action: str, order_ids: List[Any], api_url: str, api_key: str) -> Optional[Dict[str, Tuple[bool, Any]]]:
+        """Пакетный refill/cancel (action=...&orders=): ID -> (успех, ответ или ошибка).
+        
+        None - панель не поддерживает пакетный запрос или недоступна.
+        """
+        try:
+            url = f"{api_url}?action={action}&orders={','.join(str(oid) for oid in order_ids)}&key={api_key}"
+            response = SocTypeAPI._make_request_with_retry(url)
+            if not isinstance(response, list):
+                return None
+            
+            results = {}
+            for item in response:
+                if not isinstance(item, dict) or "order" not in item or item.get(action) is None:
+                    continue
+                value = item[action]
+                if isinstance(value, dict):
+                    results[str(item["order"])] = (False, value.get("error", "ошибка панели"))
+                else:
+                    results[str(item["order"])] = (True, value)
+            return results
+            
+        except Exception as e:
+            logger.error(f"Исключение при пакетном {action}: {e}")
+            return None
+    
+    @staticmethod
+    def refill_orders(order_ids: List[Any], api_url: str, api_key: str) -> Optional[Dict[str, Tuple[bool, Any]]]:
+        """Рефилл до STATUS_BATCH заказов одним запросом"""
+        return SocTypeAPI._batch_action("refill", order_ids, api_url, api_key)
+    
+    @staticmethod
+    def cancel_orders(order_ids: List[Any], api_url: str, api_key: str) -> Optional[Dict[str, Tuple[bool, Any]]]:
+        """Отмена до STATUS_BATCH заказов одним запросом"""
+        return SocTypeAPI._batch_action("cancel", order_ids, api_url, api_key)
+
+
+class ProviderCache:
+    """Кэш баланса и каталога услуг провайдеров"""
+    CATALOG_TTL = 3600  # секунды
+    BALANCE_TTL = 300  # секунды
+    
+    _balances: Dict[str, Tuple[Optional[float], Optional[str], float]] = {}
+    _catalogs: Dict[str, Tuple[Dict[str, Dict], float]] = {}
+    _refreshing: set = set()
+    _lock = threading.Lock()
+    
+    @classmethod
+    def prefetch(cls, api_url: str, api_key: str) -> None:
+        """Загрузка баланса и каталога (заодно прогревает HTTP соединение)"""
+        cls.refresh_balance(api_url, api_key)
+        
+        services = SocTypeAPI.get_services(api_url, api_key)
+        if services is not None:
+            catalog = {str(item.get("service")): item for item in services if isinstance(item, dict)}
+            cls._catalogs[api_url] = (catalog, time.time())
+            logger.info(f"Каталог {urlparse(api_url).netloc}: {len(catalog)} услуг")
+    
+    @classmethod
+    def refresh_balance(cls, api_url: str, api_key: str) -> None:
+        balance, currency = SocTypeAPI.get_balance(api_url, api_key)
+        cls._balances[api_url] = (balance, currency, time.time())
+    
+    @classmethod
+    def refresh_if_stale(cls, api_url: str, api_key: str) -> None:
+        """Фоновое обновление устаревших баланса и каталога, не более одного на провайдера"""
+        if not api_url or not api_key:
+            return
+        now = time.time()
+        balance = cls._balances.get(api_url)
+        catalog = cls._catalogs.get(api_url)
+        catalog_stale = not catalog or now - catalog[1] > cls.CATALOG_TTL
+        if not catalog_stale and balance and now - balance[2] <= cls.BALANCE_TTL:
+            return
+        
+        with cls._lock:
+            if api_url in cls._refreshing:
+                return
+            cls._refreshing.add(api_url)
+        
+        def refresh():
+            try:
+                if catalog_stale:
+                    cls.prefetch(api_url, api_key)
+                else:
+                    cls.refresh_balance(api_url, api_key)
+            finally:
+                with cls._lock:
+                    cls._refreshing.discard(api_url)
+        
+        provider_worker.submit(refresh)
+    
+    @classmethod
+    def spend(cls, api_url: str, amount: float) -> None:
+        """Списание стоимости заказа с кэшированного баланса до следующего обновления"""
+        cached = cls._balances.get(api_url)
+        if cached and cached[0] is not None:
+            cls._balances[api_url] = (cached[0] - amount, cached[1], cached[2])
+    
+    @classmethod
+    def get_balance(cls, api_url: str) -> Optional[Tuple[Optional[float], Optional[str], float]]:
+        return cls._balances.get(api_url)
+    
+    @classmethod
+    def get_service(cls, api_url: str, service_id: Any) -> Optional[Dict]:
+        """Услуга из каталога, если каталог загружен и не устарел"""
+        cached = cls._catalogs.get(api_url)
+        if not cached or time.time() - cached[1] > cls.CATALOG_TTL:
+            return None
+        return cached[0].get(str(service_id))
+
+
+SocTypeAPI._session = SocTypeAPI._new_session()
+SettingsCache.subscribe(SocTypeAPI.on_settings_changed)
+provider_worker = TaskWorker("providers")
+
+
+# ====================
+# ПРОВАЙДЕРЫ И МАРШРУТИЗАЦИЯ
+# ====================
+
+class ProviderHealth:
+    """Скользящие задержка и доля ошибок запросов по хостам панелей.
+    
+    Доля ошибок затухает со временем, чтобы панель, которую перестали
+    выбирать после сбоя, снова получила заказы.
+    """
+    ALPHA = 0.2
+    ERROR_HALF_LIFE = 600  # секунды
+    SAMPLES = 200  # последних успешных ответов для квантилей
+    MIN_SAMPLES = 20
+    HEDGE_QUANTILE = 0.95
+    HEDGE_MIN_DELAY = 0.25  # секунды
+    TIMEOUT_FACTOR = 4  # таймаут чтения - во столько раз больше p99
+    TIMEOUT_MIN = 5.0  # секунды
+    
+    # хост -> [задержка, доля ошибок, время обновления]
+    _hosts: Dict[str, List] = {}
+    _samples: Dict[str, deque] = {}
+    _lock = threading.Lock()
+    
+    @classmethod
+    def record(cls, host: str, seconds: float, ok: bool, sample: Optional[bool] = None) -> None:
+        """Исход запроса; sample - учитывать ли время в квантилях (по умолчанию только успех).
+        Таймауты учитываются, чтобы адаптивный таймаут рос вместе с замедлением панели."""
+        now = time.time()
+        with cls._lock:
+            if ok if sample is None else sample:
+                samples = cls._samples.get(host)
+                if samples is None:
+                    samples = cls._samples[host] = deque(maxlen=cls.SAMPLES)
+                samples.append(seconds)
+            state = cls._hosts.get(host)
+            if state is None:
+                cls._hosts[host] = [seconds if ok else None, 0.0 if ok else 1.0, now]
+                return
+            error_rate = cls._decayed(state[1], now - state[2])
+            state[1] = error_rate + cls.ALPHA * ((0.0 if ok else 1.0) - error_rate)
+            if ok:
+                state[0] = seconds if state[0] is None else state[0] + cls.ALPHA * (seconds - state[0])
+            state[2] = now
+    
+    @classmethod
+    def _decayed(cls, error_rate: float, age: float) -> float:
+        return error_rate * 0.5 ** (max(0.0, age) / cls.ERROR_HALF_LIFE)
+    
+    @classmethod
+    def quantile(cls, host: str, q: float) -> Optional[float]:
+        """Квантиль задержки последних ответов, None пока ответов мало"""
+        with cls._lock:
+            samples = cls._samples.get(host)
+            if not samples or len(samples) < cls.MIN_SAMPLES:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    
+    @classmethod
+    def hedge_budget(cls, host: str) -> Optional[float]:
+        """Сколько ждать ответа на чтение до отправки дубля"""
+        value = cls.quantile(host, cls.HEDGE_QUANTILE)
+        return None if value is None else max(cls.HEDGE_MIN_DELAY, value)
+    
+    @classmethod
+    def read_timeout(cls, host: str, default: float) -> float:
+        """Таймаут чтения по наблюдаемой задержке панели, не больше настройки"""
+        p99 = cls.quantile(host, 0.99)
+        timeout = default if p99 is None else min(default, max(cls.TIMEOUT_MIN, p99 * cls.TIMEOUT_FACTOR))
+        Metrics.set_gauge("autosmm_api_read_timeout_seconds", timeout, provider=host)
+        return timeout
+    
+    @classmethod
+    def get(cls, host: str) -> Tuple[Optional[float], float]:
+        """(средняя задержка или None, доля ошибок)"""
+        with cls._lock:
+            state = cls._hosts.get(host)
+            if state is None:
+                return None, 0.0
+            return state[0], cls._decayed(state[1], time.time() - state[2])
+
+
+class Route(NamedTuple):
+    """Вариант исполнения заказа на одной панели"""
+    provider: str
+    service_id: int
+    unit_price: Optional[float]  # цена за единицу в валюте заказа FunPay
+    unit_cost: Optional[float]  # она же в валюте баланса панели
+    latency: Optional[float]
+    error_rate: float
+    funded: bool
+
+
+class ProviderRouter:
+    """Выбор панели для заказа среди равнозначных услуг из service_map.
+    
+    Исправные панели с достаточным балансом сортируются по цене за единицу
+    из кэша каталогов; панели, чья цена отличается от лучшей не больше
+    router_price_tolerance, упорядочиваются по задержке, поэтому объем
+    распределяется между одинаково дешевыми панелями.
+    """
+    MAX_ERROR_RATE = 0.5
+    
+    @staticmethod
+    def equivalents(provider: str, service_id: Any) -> Dict[str, int]:
+        """Равнозначные услуги на всех панелях, начиная с исходной"""
+        result = {provider: _to_int(service_id)}
+        for mapping in (SettingsCache.get_settings().get("service_map") or {}).values():
+            if isinstance(mapping, dict) and str(mapping.get(provider)) == str(service_id):
+                for name, mapped_id in mapping.items():
+                    result.setdefault(name, _to_int(mapped_id))
+        return result
+    
+    @staticmethod
+    def resolve(service_key: str) -> Optional[Tuple[str, int]]:
+        """Первая настроенная панель логической услуги (лоты с SVC:)"""
+        mapping = (SettingsCache.get_settings().get("service_map") or {}).get(service_key)
+        if not isinstance(mapping, dict):
+            return None
+        providers = SettingsCache.providers()
+        for name, service_id in mapping.items():
+            if name in providers and _to_int(service_id) > 0:
+                return name, _to_int(service_id)
+        return None
+    
+    @staticmethod
+    def _route(provider: str, service_id: int, order: PaidOrder) -> Route:
+        api_url, api_key = SettingsCache.credentials(provider)
+        ProviderCache.refresh_if_stale(api_url, api_key)
+        latency, error_rate = ProviderHealth.get(urlparse(api_url).netloc)
+        
+        unit_price, funded = None, True
+        service = ProviderCache.get_service(api_url, service_id)
+        balance = ProviderCache.get_balance(api_url)
+        currency = balance[1] if balance and balance[1] else 'USD'
+        try:
+            rate = float(service["rate"]) / 1000 if service else None
+        except (KeyError, ValueError, TypeError):
+            rate = None
+        if rate is not None:
+            unit_price = convert_charge(rate, currency, order.currency)
+            if balance and balance[0] is not None:
+                funded = balance[0] >= rate * order.amount
+        return Route(provider, service_id, unit_price, rate, latency, error_rate, funded)
+    
+    @classmethod
+    def rank(cls, order: PaidOrder) -> List[Route]:
+        """Панели для заказа от лучшей к худшей; исходная панель всегда в списке"""
+        providers = SettingsCache.providers()
+        candidates = {
+            name: service_id
+            for name, service_id in cls.equivalents(order.api_type, order.service_id).items()
+            if name in providers and service_id > 0
+        }
+        if order.api_type not in candidates or not SettingsCache.get_settings().get("set_provider_routing", True):
+            candidates = {order.api_type: order.service_id}
+        routes = [cls._route(name, service_id, order) for name, service_id in candidates.items()]
+        
+        def degraded(route: Route) -> bool:
+            return route.error_rate > cls.MAX_ERROR_RATE or not route.funded
+        
+        inf = float("inf")
+        routes.sort(key=lambda r: (degraded(r), r.unit_price if r.unit_price is not None else inf))
+        best = routes[0]
+        if best.unit_price is None or degraded(best):
+            return routes
+        
+        limit = best.unit_price * (1 + SettingsCache.get_settings().get("router_price_tolerance", 0.05))
+        near = [r for r in routes if not degraded(r) and r.unit_price is not None and r.unit_price <= limit]
+        # Панель без замеров задержки не обгоняет измеренные здоровые панели
+        near.sort(key=lambda r: (r.latency if r.latency is not None else inf, r.unit_price))
+        return near + [r for r in routes if r not in near]
+
+
+class ProviderGate:
+    """Ограничение одновременных созданий заказов на каждой панели.
+
+    Не больше create_concurrency запросов add к одной панели одновременно
+    и, если задан create_rate_per_minute, не чаще этого темпа. Ожидающие
+    слот проходят строго в порядке очереди. Лимиты отдельной панели -
+    в provider_limits: {"имя": {"concurrency": 2, "rate_per_minute": 30}}.
+    """
+    _active: Dict[str, int] = {}
+    _next_start: Dict[str, float] = {}
+    _waiting: Dict[str, deque] = {}
+    _cond = threading.Condition()
+
+    @staticmethod
+    def limits(provider: str) -> Tuple[int, float]:
+        """(одновременных запросов, минимальный интервал между стартами в секундах)"""
+        settings = SettingsCache.get_settings()
+        override = (settings.get("provider_limits") or {}).get(provider) or {}
+        try:
+            concurrency = max(1, int(override.get("concurrency", settings.get("create_concurrency", 3))))
+            rate = float(override.get("rate_per_minute", settings.get("create_rate_per_minute", 0)) or 0)
+        except (TypeError, ValueError):
+            concurrency, rate = 1, 0.0
+        return concurrency, 60.0 / rate if rate > 0 else 0.0
+
+    @classmethod
+    def acquire(cls, provider: str) -> None:
+        concurrency, interval = cls.limits(provider)
+        ticket = object()
+        started = time.monotonic()
+        with cls._cond:
+            waiting = cls._waiting.setdefault(provider, deque())
+            waiting.append(ticket)
+            while True:
+                now = time.monotonic()
+                free = cls._active.get(provider, 0) < concurrency
+                delay = cls._next_start.get(provider, 0.0) - now
+                if waiting[0] is ticket and free and delay <= 0:
+                    break
+                cls._cond.wait(timeout=delay if waiting[0] is ticket and free else None)
+            waiting.popleft()
+            cls._active[provider] = cls._active.get(provider, 0) + 1
+            cls._next_start[provider] = now + interval
+            cls._cond.notify_all()
+        Metrics.observe("autosmm_create_slot_wait_seconds", time.monotonic() - started, provider=provider)
+
+    @classmethod
+    def release(cls, provider: str) -> None:
+        with cls._cond:
+            cls._active[provider] = max(0, cls._active.get(provider, 0) - 1)
+            cls._cond.notify_all()
+
+    @classmethod
+    def create_order(cls, provider: str, service_id: int, url: str, amount: int,
+                     api_url: str, api_key: str) -> Any:
+        """SocTypeAPI.create_order в пределах лимитов панели"""
+        cls.acquire(provider)
+        try:
+            return SocTypeAPI.create_order(service_id, url, amount, api_url, api_key)
+        finally:
+            cls.release(provider)
+
+    @classmethod
+    def busy(cls) -> Dict[str, Tuple[int, int]]:
+        """панель -> (занято слотов, ожидают слот)"""
+        with cls._cond:
+            return {
+                provider: (cls._active.get(provider, 0), len(cls._waiting.get(provider, ())))
+                for provider in set(cls._active) | set(cls._waiting)
+            }
+
+
+def format_providers() -> str:
+    """Провайдеры, их состояние и карта услуг для Telegram"""
+    settings = SettingsCache.get_settings()
+    text = "🔀 Провайдеры\n\n"
+    providers = SettingsCache.providers()
+    if not providers:
+        text += "Провайдеры не настроены.\n"
+    for name in providers:
+        api_url, _ = SettingsCache.credentials(name)
+        latency, error_rate = ProviderHealth.get(urlparse(api_url).netloc)
+        balance = ProviderCache.get_balance(api_url)
+        text += f"• {name}: {urlparse(api_url).netloc}\n"
+        text += f"⠀∟ задержка: {f'{latency * 1000:.0f} мс' if latency is not None else '—'}, ошибки: {error_rate:.0%}\n"
+        if balance and balance[0] is not None:
+            text += f"⠀∟ баланс: {balance[0]:.2f} {balance[1]}\n"
+    
+    service_map = settings.get("service_map") or {}
+    if service_map:
+        text += "\n🗺 Карта услуг:\n"
+        for service_key, mapping in list(service_map.items())[:PROVIDERS_MAP_SHOWN]:
+            text += f"• {service_key}: " + ", ".join(f"{name}:{sid}" for name, sid in mapping.items()) + "\n"
+        if len(service_map) > PROVIDERS_MAP_SHOWN:
+            text += f"… и еще {len(service_map) - PROVIDERS_MAP_SHOWN}\n"
+    
+    text += f"\nМаршрутизация: {'🟢 вкл' if settings.get('set_provider_routing', True) else '🔴 выкл'}\n"
+    text += (
+        "Управление:\n"
+        "/autosmm_providers add имя url ключ\n"
+        "/autosmm_providers remove имя\n"
+        "/autosmm_providers map услуга провайдер:ID [...]\n"
+        "/autosmm_providers unmap услуга"
+    )
+    return text
+
+
+# ====================
+# СТАТИСТИКА ПРОДАЖ
+# ====================
+
+class SalesStats:
+    """Журнал продаж и инкрементальные агрегаты прибыли.
+    
+    Каждое событие дописывается в ledger.jsonl, а готовые суммы по дням,
+    услугам, провайдерам и лотам хранятся в stats.json и обновляются
+    на месте, поэтому чтение статистики не зависит от объема истории.
+    Заказы в работе ведутся отдельным журналом stats_open.jsonl: событие
+    дописывает в него одну строку, а не перезаписывает весь список.
+    Суммы агрегатов - в CURRENCY: выручка и затраты в других валютах
+    пересчитываются по курсу на момент продажи, курс хранится в заказе.
+    """
+    CURRENCY = '₽'
+    CURRENCY_CODES = {'₽': 'RUB', '$': 'USD', '€': 'EUR'}
+    OPEN_COMPACT_ROWS = 5000  # строк журнала заказов в работе, после которых он сжимается
+    
+    _data = None
+    _version = None
+    _open = None
+    _open_version = None
+    _open_rows = 0
+    # Общая с другими процессами: агрегаты меняются чтением-изменением-записью
+    _lock = FileLocker.get_lock('stats')
+    
+    @staticmethod
+    def _empty_bucket() -> Dict:
+        return {"orders": 0, "completed": 0, "refunded": 0, "revenue": 0.0, "cost": 0.0, "profit": 0.0}
+    
+    @classmethod
+    def _rate(cls, currency: str) -> float:
+        """Курс валюты заказа к CURRENCY (кэшируется get_currency_rate)"""
+        code = cls.CURRENCY_CODES.get(currency)
+        if currency == cls.CURRENCY or code is None:
+            return 1.0
+        return get_currency_rate(code, cls.CURRENCY_CODES[cls.CURRENCY])
+    
+    @classmethod
+    def _load(cls) -> Dict:
+        """Агрегаты из кэша; перечитываются, если stats.json записал другой процесс"""
+        if cls._data is None or file_version(STATS_FILE) != cls._version:
+            data, cls._version = load_json_versioned(STATS_FILE, {}, 'stats')
+            for key in ("days", "services", "providers", "lots"):
+                data.setdefault(key, {})
+            data.setdefault("totals", cls._empty_bucket())
+            cls._data = data
+            
+            # Заказы в работе прошлых версий хранились в stats.json
+            legacy = data.pop("open", None)
+            if legacy:
+                opened = cls._load_open()
+                for smm_order_id, entry in legacy.items():
+                    opened.setdefault(smm_order_id, entry)
+                if cls._compact(opened) and save_json_safe(STATS_FILE, data, 'stats'):
+                    cls._version = file_version(STATS_FILE)
+        return cls._data
+    
+    @classmethod
+    def _load_open(cls) -> Dict[str, Dict]:
+        """Заказы в работе из журнала; перечитываются, если его дописал другой процесс"""
+        if cls._open is None or file_version(STATS_OPEN_FILE) != cls._open_version:
+            opened, rows = {}, 0
+            for row in iter_jsonl(STATS_OPEN_FILE):
+                rows += 1
+                if row.get("entry") is None:
+                    opened.pop(row.get("id"), None)
+                else:
+                    opened[row.get("id")] = row["entry"]
+            cls._open, cls._open_rows, cls._open_version = opened, rows, file_version(STATS_OPEN_FILE)
+        return cls._open
+    
+    @classmethod
+    def _compact(cls, opened: Dict[str, Dict]) -> bool:
+        """Перезапись журнала заказов в работе: по строке на заказ"""
+        temp_filepath = f"{STATS_OPEN_FILE}.{os.getpid()}.tmp"
+        try:
+            ensure_storage_exists()
+            with open(temp_filepath, "w", encoding='utf-8') as file:
+                for smm_order_id, entry in opened.items():
+                    file.write(json.dumps({"id": smm_order_id, "entry": entry}, ensure_ascii=False) + "\n")
+            _replace_file(temp_filepath, STATS_OPEN_FILE)
+        except Exception as e:
+            logger.error(f"Ошибка сжатия {STATS_OPEN_FILE}: {e}")
+            cls._open = None
+            return False
+        cls._open_rows, cls._open_version = len(opened), file_version(STATS_OPEN_FILE)
+        return True
+    
+    @classmethod
+    def _set_open(cls, smm_order_id: str, entry: Optional[Dict]) -> None:
+        """Добавление (entry) или закрытие (None) заказа в работе"""
+        opened = cls._load_open()
+        if entry is None:
+            opened.pop(smm_order_id, None)
+        else:
+            opened[smm_order_id] = entry
+        
+        cls._open_rows += 1
+        if cls._open_rows > max(cls.OPEN_COMPACT_ROWS, 2 * len(opened)):
+            cls._compact(opened)
+        elif append_jsonl_safe(STATS_OPEN_FILE, {"id": smm_order_id, "entry": entry}, 'stats'):
+            cls._open_version = file_version(STATS_OPEN_FILE)
+        else:
+            cls._open = None
+    
+    @classmethod
+    def _apply(cls, data: Dict, entry: Dict, **delta) -> None:
+        """Применение изменения ко всем срезам статистики"""
+        buckets = [
+            data["totals"],
+            data["days"].setdefault(entry["day"], cls._empty_bucket()),
+            data["services"].setdefault(str(entry["service"]), cls._empty_bucket()),
+            data["providers"].setdefault(entry["provider"], cls._empty_bucket()),
+            data["lots"].setdefault(entry["lot"], cls._empty_bucket()),
+        ]
+        for bucket in buckets:
+            for key, value in delta.items():
+                bucket[key] = round(bucket.get(key, 0) + value, 4)
+            bucket["profit"] = round(bucket["revenue"] - bucket["cost"], 4)
+        
+        # Ограничиваем историю по дням
+        if len(data["days"]) > STATS_DAYS_KEEP:
+            for day in sorted(data["days"])[:len(data["days"]) - STATS_DAYS_KEEP]:
+                del data["days"][day]
+    
+    @classmethod
+    def _write(cls, event: str, smm_order_id: str, entry: Dict, aggregates: bool = True) -> None:
+        row = {"ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "event": event, "smm_order_id": smm_order_id}
+        row.update(entry)
+        append_jsonl_safe(LEDGER_FILE, row, 'ledger')
+        if not aggregates:
+            return
+        if save_json_safe(STATS_FILE, cls._data, 'stats'):
+            cls._version = file_version(STATS_FILE)
+        else:
+            cls._data = None
+    
+    @classmethod
+    def record_created(cls, order: PaidOrder, smm_order_id: Any, cost: float, revenue: Optional[float] = None) -> None:
+        """Учет созданного заказа"""
+        try:
+            if revenue is None:
+                revenue = float(order.price or 0)
+            entry = {
+                "fp_order_id": order.order_id,
+                "day": str(order.created_at or datetime.now().strftime("%Y-%m-%d"))[:10],
+                "service": str(order.service_id),
+                "provider": order.api_type,
+                "lot": str(order.title or 'N/A')[:64],
+                "currency": order.currency,
+                "rate": cls._rate(order.currency),
+                "revenue": round(float(revenue), 4),
+                "cost": round(float(cost), 4),
+            }
+            rate = entry["rate"]
+            with cls._lock:
+                data = cls._load()
+                cls._set_open(str(smm_order_id), entry)
+                cls._apply(data, entry, orders=1, revenue=entry["revenue"] * rate, cost=entry["cost"] * rate)
+                cls._write("created", str(smm_order_id), entry)
+        except Exception as e:
+            logger.error(f"Ошибка учета заказа {smm_order_id} в статистике: {e}")
+    
+    @classmethod
+    def record_recreated(cls, parent_smm_order_id: Any, smm_order_id: Any) -> None:
+        """Учет пересозданного остатка: та же продажа, новая выручка не появляется"""
+        try:
+            with cls._lock:
+                parent = cls._load_open().get(str(parent_smm_order_id))
+                if not parent:
+                    return
+                
+                entry = dict(parent, revenue=0.0, cost=0.0, recreated=True)
+                cls._set_open(str(smm_order_id), entry)
+                cls._write("recreated", str(smm_order_id), entry, aggregates=False)
+        except Exception as e:
+            logger.error(f"Ошибка учета пересозданного заказа {smm_order_id}: {e}")
+    
+    @classmethod
+    def record_completed(cls, smm_order_id: Any, charge: Optional[float] = None, currency: str = 'USD') -> None:
+        """Учет выполненного заказа с уточнением фактической стоимости"""
+        try:
+            with cls._lock:
+                data = cls._load()
+                entry = cls._load_open().get(str(smm_order_id))
+                if not entry:
+                    return
+                
+                cost_delta = 0.0
+                if charge is not None:
+                    new_cost = round(convert_charge(float(charge), currency, entry["currency"]), 4)
+                    cost_delta = new_cost - entry["cost"]
+                    entry = dict(entry, cost=new_cost)
+                cls._set_open(str(smm_order_id), None)
+                cls._apply(data, entry, completed=0 if entry.get("recreated") else 1,
+                           cost=cost_delta * entry.get("rate", 1.0))
+                cls._write("completed", str(smm_order_id), entry)
+        except Exception as e:
+            logger.error(f"Ошибка учета выполнения заказа {smm_order_id}: {e}")
+    
+    @classmethod
+    def record_refunded(cls, smm_order_id: Any = None, fp_order_id: Any = None) -> None:
+        """Учет возврата: выручка и затраты заказа исключаются из агрегатов"""
+        try:
+            with cls._lock:
+                data = cls._load()
+                opened = cls._load_open()
+                if smm_order_id is None and fp_order_id is not None:
+                    smm_order_id = next(
+                        (sid for sid, e in opened.items() if e.get("fp_order_id") == str(fp_order_id)),
+                        None
+                    )
+                entry = opened.get(str(smm_order_id)) if smm_order_id is not None else None
+                if not entry:
+                    return
+                
+                rate = entry.get("rate", 1.0)
+                cls._set_open(str(smm_order_id), None)
+                cls._apply(data, entry, refunded=1, revenue=-entry["revenue"] * rate, cost=-entry["cost"] * rate)
+                cls._write("refunded", str(smm_order_id), entry)
+        except Exception as e:
+            logger.error(f"Ошибка учета возврата заказа {smm_order_id or fp_order_id}: {e}")
+    
+    @classmethod
+    def get_summary(cls) -> Dict:
+        """Снимок агрегатов для отображения"""
+        with cls._lock:
+            data = cls._load()
+            today = datetime.now().strftime("%Y-%m-%d")
+            week = cls._empty_bucket()
+            for offset in range(7):
+                day = datetime.fromtimestamp(time.time() - offset * 86400).strftime("%Y-%m-%d")
+                for key, value in data["days"].get(day, {}).items():
+                    week[key] = round(week.get(key, 0) + value, 4)
+            
+            return {
+                "today": dict(data["days"].get(today, cls._empty_bucket())),
+                "week": week,
+                "totals": dict(data["totals"]),
+                "providers": {k: dict(v) for k, v in data["providers"].items()},
+                "services": {k: dict(v) for k, v in data["services"].items()},
+                "lots": {k: dict(v) for k, v in data["lots"].items()},
+                "open": len(cls._load_open()),
+            }
+
+
+def log_refund(fp_order_id: Any, reason: str, ok: bool, error: Optional[str] = None, smm_order_id: Any = None) -> None:
+    """Запись результата возврата в журнал"""
+    append_jsonl_safe(REFUNDS_FILE, {
+        "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "fp_order_id": str(fp_order_id),
+        "smm_order_id": str(smm_order_id) if smm_order_id is not None else "",
+        "reason": reason,
+        "ok": ok,
+        "error": error or "",
+    }, 'refunds')
+
+
+def try_refund(c: Cardinal, fp_order_id: Any, reason: str, smm_order_id: Any = None) -> Optional[str]:
+    """Возврат средств покупателю с записью в журнал; текст ошибки или None"""
+    try:
+        c.account.refund(fp_order_id)
+        Metrics.inc("autosmm_orders_refunded_total", reason=reason)
+        OrderTrace.mark(fp_order_id, "refunded")
+        logger.info(f"Выполнен возврат средств для заказа #{fp_order_id} ({reason})")
+        log_refund(fp_order_id, reason, True, smm_order_id=smm_order_id)
+        return None
+    except Exception as e:
+        logger.error(f"Ошибка возврата средств для заказа #{fp_order_id}: {e}")
+        log_refund(fp_order_id, reason, False, str(e), smm_order_id)
+        return str(e) or type(e).__name__
+
+
+def refund_order(c: Cardinal, fp_order_id: Any, reason: str, smm_order_id: Any = None) -> bool:
+    """Возврат средств покупателю с записью в журнал"""
+    return try_refund(c, fp_order_id, reason, smm_order_id) is None
+
+
+class RefundQueue:
+    """Очередь возвратов средств в refund_queue.json.
+    
+    Возврат ставится в очередь один раз на заказ FunPay и выполняется
+    фоновым потоком с паузой между вызовами FunPay и экспоненциальным
+    повтором после ошибки, поэтому переживает сбои и перезапуски и не
+    задерживает чекер. Выполненные записи хранятся DONE_KEEP секунд, чтобы
+    повторный возврат того же заказа был отброшен. При общем хранилище
+    очередь разбирает один процесс - владелец refund_worker.lock.
+    """
+    PACE = 1.0  # секунды между вызовами возврата
+    RETRY_BASE = 30  # секунды
+    RETRY_MAX = 3600  # секунды
+    STUCK_ATTEMPTS = 5
+    DONE_KEEP = 7 * 86400  # секунды
+    IDLE_WAIT = 60  # секунды
+    
+    _cardinal = None
+    _thread = None
+    _guard = threading.Lock()
+    _wake = threading.Event()
+    _owner = InterProcessLock(f"{LOCKS_PATH}/refund_worker.lock")
+    
+    @staticmethod
+    def load() -> Dict[str, RefundRequest]:
+        return {
+            fp_order_id: RefundRequest.from_dict(data)
+            for fp_order_id, data in load_json_safe(REFUND_QUEUE_FILE, {}, 'refund_queue').items()
+        }
+    
+    @classmethod
+    def _delay(cls, attempts: int) -> float:
+        return min(cls.RETRY_MAX, cls.RETRY_BASE * 2 ** max(0, attempts - 1))
+    
+    @classmethod
+    def start(cls, c: Cardinal) -> None:
+        """Запуск фонового потока возвратов, если он еще не работает"""
+        with cls._guard:
+            cls._cardinal = c
+            if cls._thread is None or not cls._thread.is_alive():
+                cls._thread = threading.Thread(target=cls._run, name="AutoSmm-refunds", daemon=True)
+                cls._thread.start()
+        cls._wake.set()
+    
+    @classmethod
+    def enqueue(cls, c: Cardinal, fp_order_id: Any, reason: str, smm_order_id: Any = None) -> bool:
+        """Поставить возврат в очередь; повтор для того же заказа отбрасывается.
+        False - если возврат не удалось ни сохранить, ни выполнить сразу."""
+        fp_order_id = str(fp_order_id)
+        duplicate = False
+        
+        def add(data: Dict):
+            nonlocal duplicate
+            duplicate = fp_order_id in data
+            if duplicate:
+                return False
+            now = time.time()
+            data[fp_order_id] = RefundRequest(
+                reason, str(smm_order_id or ""), queued_at=now, next_at=now
+            ).to_dict()
+        
+        if update_json_safe(REFUND_QUEUE_FILE, {}, 'refund_queue', add) is None:
+            # Очередь недоступна: возврат нельзя потерять, выполняем сразу
+            logger.error(f"Не удалось поставить возврат #{fp_order_id} в очередь, выполняется сразу")
+            if not refund_order(c, fp_order_id, reason, smm_order_id):
+                return False
+            if smm_order_id is not None:
+                SalesStats.record_refunded(smm_order_id)
+            return True
+        
+        if duplicate:
+            logger.info(f"Возврат для заказа #{fp_order_id} уже в очереди или выполнен ({reason})")
+        else:
+            logger.info(f"Возврат для заказа #{fp_order_id} поставлен в очередь ({reason})")
+        cls.start(c)
+        return True
+    
+    @classmethod
+    def _run(cls) -> None:
+        while True:
+            try:
+                wait = cls.process()
+            except Exception as e:
+                logger.error(f"Ошибка обработки очереди возвратов: {e}", exc_info=True)
+                wait = cls.IDLE_WAIT
+            cls._wake.wait(timeout=max(0.0, min(wait, cls.IDLE_WAIT)))
+            cls._wake.clear()
+    
+    @classmethod
+    def process(cls) -> float:
+        """Выполнение возвратов, срок которых наступил; возвращает паузу до следующего"""
+        if not os.path.exists(REFUND_QUEUE_FILE) or cls._cardinal is None:
+            return cls.IDLE_WAIT
+        if not cls._owner.acquire(blocking=False):
+            return cls.IDLE_WAIT
+        
+        entries = cls.load()
+        now = time.time()
+        due = sorted(
+            (item for item in entries.items() if item[1].status == "pending" and item[1].next_at <= now),
+            key=lambda item: item[1].queued_at
+        )
+        for index, (fp_order_id, entry) in enumerate(due):
+            if index:
+                time.sleep(cls.PACE)
+            cls._attempt(fp_order_id, entry)
+        
+        # Выполненные записи старше DONE_KEEP больше не нужны для защиты от повтора
+        expired = now - cls.DONE_KEEP
+        
+        def prune(data: Dict):
+            stale = [key for key, value in data.items()
+                     if value.get('status') != "pending" and value.get('finished_at', 0) < expired]
+            for key in stale:
+                del data[key]
+            return bool(stale)
+        
+        if any(e.status != "pending" and e.finished_at < expired for e in entries.values()):
+            update_json_safe(REFUND_QUEUE_FILE, {}, 'refund_queue', prune)
+        
+        pending = [e for e in cls.load().values() if e.status == "pending"]
+        Metrics.set_gauge("autosmm_refund_queue", sum(e.attempts < cls.STUCK_ATTEMPTS for e in pending), state="pending")
+        Metrics.set_gauge("autosmm_refund_queue", sum(e.attempts >= cls.STUCK_ATTEMPTS for e in pending), state="stuck")
+        if not pending:
+            return cls.IDLE_WAIT
+        return min(e.next_at for e in pending) - time.time()
+    
+    @classmethod
+    def _attempt(cls, fp_order_id: str, entry: RefundRequest) -> None:
+        smm_order_id = entry.smm_order_id or None
+        error = try_refund(cls._cardinal, fp_order_id, entry.reason, smm_order_id)
+        ok = error is None
+        Metrics.inc("autosmm_refund_attempts_total", outcome="ok" if ok else "failed")
+        
+        if ok and smm_order_id is not None:
+            SalesStats.record_refunded(smm_order_id)
+        
+        attempts = entry.attempts + 1
+        
+        def record(data: Dict):
+            if fp_order_id not in data:
+                return False
+            now = time.time()
+            if ok:
+                data[fp_order_id].update(status="done", attempts=attempts, finished_at=now, error="")
+            else:
+                data[fp_order_id].update(attempts=attempts, next_at=now + cls._delay(attempts), error=error[:300])
+        
+        update_json_safe(REFUND_QUEUE_FILE, {}, 'refund_queue', record)
+        if not ok and attempts == cls.STUCK_ATTEMPTS:
+            logger.warning(f"Возврат для заказа #{fp_order_id} не выполнен после {attempts} попыток")
+    
+    @classmethod
+    def retry(cls, fp_order_id: str) -> bool:
+        """Повторить возврат сейчас, не дожидаясь паузы"""
+        found = False
+        
+        def reset(data: Dict):
+            nonlocal found
+            entry = data.get(fp_order_id)
+            found = bool(entry) and entry.get('status') == "pending"
+            if not found:
+                return False
+            entry['next_at'] = 0.0
+        
+        update_json_safe(REFUND_QUEUE_FILE, {}, 'refund_queue', reset)
+        if found:
+            cls._wake.set()
+        return found
+    
+    @classmethod
+    def settle(cls, fp_order_id: str) -> bool:
+        """Отметить ожидающий возврат выполненным вне плагина"""
+        found = False
+        
+        def mark(data: Dict):
+            nonlocal found
+            entry = data.get(fp_order_id)
+            found = bool(entry) and entry.get('status') == "pending"
+            if not found:
+                return False
+            entry.update(status="done", finished_at=time.time(), error="выполнен вне плагина")
+        
+        update_json_safe(REFUND_QUEUE_FILE, {}, 'refund_queue', mark)
+        if found:
+            log_refund(fp_order_id, "external", True)
+        return found
+    
+    @classmethod
+    def drop(cls, fp_order_id: str) -> bool:
+        """Снять возврат с очереди (например, деньги вернули вручную)"""
+        found = False
+        
+        def mark(data: Dict):
+            nonlocal found
+            entry = data.get(fp_order_id)
+            found = bool(entry) and entry.get('status') == "pending"
+            if not found:
+                return False
+            entry.update(status="dropped", finished_at=time.time())
+        
+        update_json_safe(REFUND_QUEUE_FILE, {}, 'refund_queue', mark)
+        if found:
+            log_refund(fp_order_id, "dropped", True)
+        return found
+
+
+def format_refunds() -> str:
+    """Ожидающие и зависшие возвраты для Telegram"""
+    pending = sorted(
+        ((fp_order_id, entry) for fp_order_id, entry in RefundQueue.load().items() if entry.status == "pending"),
+        key=lambda item: item[1].queued_at
+    )
+    stuck = [item for item in pending if item[1].attempts >= RefundQueue.STUCK_ATTEMPTS]
+    text = "↩️ Очередь возвратов\n\n"
+    text += f"Ожидают: {len(pending)}, из них зависли: {len(stuck)}\n\n"
+    
+    # Зависшие - первыми: они требуют внимания
+    shown = (stuck + [item for item in pending if item not in stuck])[:REFUNDS_SHOWN]
+    for fp_order_id, entry in shown:
+        queued = datetime.fromtimestamp(entry.queued_at).strftime("%d.%m %H:%M")
+        mark = "⚠️" if entry.attempts >= RefundQueue.STUCK_ATTEMPTS else "•"
+        text += f"{mark} #{fp_order_id}: {entry.reason}, с {queued}, попыток {entry.attempts}\n"
+        if entry.error:
+            text += f"⠀∟ {entry.error[:100]}\n"
+    if len(pending) > REFUNDS_SHOWN:
+        text += f"… и еще {len(pending) - REFUNDS_SHOWN}\n"
+    text += (
+        "\nУправление:\n"
+        "/autosmm_refunds retry ID - повторить сейчас\n"
+        "/autosmm_refunds drop ID - снять с очереди"
+    )
+    return text
+
+
+def format_stats_bucket(title: str, bucket: Dict) -> str:
+    """Форматирование одного среза статистики"""
+    revenue = bucket.get("revenue", 0)
+    profit = bucket.get("profit", 0)
+    margin = (profit / revenue * 100) if revenue else 0
+    return (
+        f"{title}\n"
+        f"⠀∟🛒 Заказов: {bucket.get('orders', 0)} (✅ {bucket.get('completed', 0)} / ↩️ {bucket.get('refunded', 0)})\n"
+        f"⠀∟💵 Выручка: {revenue:.2f} {SalesStats.CURRENCY}\n"
+        f"⠀∟💸 Затраты: {bucket.get('cost', 0):.2f} {SalesStats.CURRENCY}\n"
+        f"⠀∟💰 Прибыль: {profit:.2f} {SalesStats.CURRENCY} ({margin:.1f}%)\n"
+    )
+
+
+# ====================
+# ТРАССИРОВКА ЗАКАЗОВ
+# ====================
+
+class OrderTrace:
+    """Временные отметки этапов жизненного цикла заказа.
+    
+    Заказ хранится компактно: время события и список пар
+    [этап, смещение в мс], не более TRACES_KEEP последних заказов.
+    """
+    STAGES = {
+        "event": "Событие NewOrderEvent",
+        "fetched": "Получены данные заказа",
+        "queued": "Заказ принят в обработку",
+        "link": "Получена ссылка",
+        "confirmed": "Получено «+»",
+        "deferred": "Панель недоступна, создание отложено",
+        "unconfirmed": "Панель не ответила, нужна проверка",
+        "created": "Заказ создан на сайте",
+        "create_failed": "Ошибка создания заказа",
+        "first_status": "Первый статус от сайта",
+        "completed": "Сайт выполнил заказ",
+        "notified": "Покупатель уведомлен",
+        "canceled": "Заказ отменен",
+        "refunded": "Средства возвращены",
+    }
+    FLUSH_INTERVAL = 10  # секунды
+    
+    _traces = None
+    _version = None
+    _dirty = False
+    _last_flush = 0.0
+    _lock = threading.Lock()
+    
+    @classmethod
+    def _load(cls) -> Dict:
+        if cls._traces is None:
+            cls._traces, cls._version = load_json_versioned(TRACES_FILE, {}, 'traces')
+        return cls._traces
+    
+    @classmethod
+    def mark(cls, order_id: Any, stage: str, ts: Optional[float] = None) -> None:
+        """Отметка этапа; повторные отметки того же этапа игнорируются"""
+        if not order_id:
+            return
+        ts = ts or time.time()
+        order_id = str(order_id)
+        try:
+            with cls._lock:
+                traces = cls._load()
+                trace = traces.get(order_id)
+                if trace is None:
+                    trace = traces[order_id] = {"t0": round(ts, 3), "s": []}
+                    while len(traces) > TRACES_KEEP:
+                        del traces[next(iter(traces))]
+                if any(span[0] == stage for span in trace["s"]):
+                    return
+                trace["s"].append([stage, int((ts - trace["t0"]) * 1000)])
+                cls._dirty = True
+            cls.flush()
+        except Exception as e:
+            logger.debug(f"Ошибка трассировки заказа {order_id}: {e}")
+    
+    @classmethod
+    def discard(cls, order_id: Any) -> None:
+        """Удаление трассы заказа, не относящегося к плагину"""
+        with cls._lock:
+            if cls._load().pop(str(order_id), None) is not None:
+                cls._dirty = True
+    
+    @classmethod
+    def flush(cls, force: bool = False) -> None:
+        """Сохранение трасс на диск не чаще FLUSH_INTERVAL"""
+        with cls._lock:
+            if not cls._dirty or (not force and time.time() - cls._last_flush < cls.FLUSH_INTERVAL):
+                return
+            snapshot = dict(cls._traces)
+            cls._dirty = False
+            cls._last_flush = time.time()
+        
+        with FileLocker.get_lock('traces'):
+            # Трассы, записанные другим процессом, сохраняются; свои заказы важнее
+            if file_version(TRACES_FILE) != cls._version:
+                merged = load_json_safe(TRACES_FILE, {}, 'traces')
+                merged.update(snapshot)
+                while len(merged) > TRACES_KEEP:
+                    del merged[next(iter(merged))]
+                snapshot = merged
+            if save_json_safe(TRACES_FILE, snapshot, 'traces', compact=True):
+                cls._version = file_version(TRACES_FILE)
+    
+    @classmethod
+    def get(cls, order_id: Any) -> Optional[Dict]:
+        with cls._lock:
+            trace = cls._load().get(str(order_id))
+            return {"t0": trace["t0"], "s": [list(span) for span in trace["s"]]} if trace else None
+    
+    @classmethod
+    def stage_percentiles(cls) -> Dict[str, Dict]:
+        """Перцентили длительности переходов между соседними этапами"""
+        durations: Dict[str, List[int]] = {}
+        with cls._lock:
+            for trace in cls._load().values():
+                spans = trace["s"]
+                for prev, cur in zip(spans, spans[1:]):
+                    durations.setdefault(f"{prev[0]}→{cur[0]}", []).append(cur[1] - prev[1])
+        
+        result = {}
+        for transition, values in durations.items():
+            values.sort()
+            pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+            result[transition] = {"count": len(values), "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99)}
+        return result
+
+
+def format_duration_ms(ms: float) -> str:
+    """Человекочитаемая длительность"""
+    seconds = ms / 1000
+    if seconds < 60:
+        return f"{seconds:.1f} с"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f} мин"
+    return f"{seconds / 3600:.1f} ч"
+
+
+def format_order_trace(order_id: str) -> str:
+    """Таймлайн одного заказа"""
+    trace = OrderTrace.get(order_id)
+    if not trace:
+        return f"🔍 Трасса заказа #{order_id} не найдена."
+    
+    text = f"🧭 Заказ #{order_id}\n"
+    text += f"📅 Начало: {datetime.fromtimestamp(trace['t0']).strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+    prev_offset = 0
+    for stage, offset in trace["s"]:
+        label = OrderTrace.STAGES.get(stage, stage)
+        text += f"⠀∟+{format_duration_ms(offset)} {label} (шаг {format_duration_ms(offset - prev_offset)})\n"
+        prev_offset = offset
+    return text
+
+
+def format_trace_percentiles() -> str:
+    """Перцентили по этапам для всех сохраненных заказов"""
+    stats = OrderTrace.stage_percentiles()
+    if not stats:
+        return "🧭 Данных трассировки пока нет."
+    
+    order = list(OrderTrace.STAGES)
+    rank = lambda name: tuple(order.index(part) if part in order else len(order) for part in name.split("→"))
+    text = "🧭 Длительность этапов (p50 / p90 / p99):\n\n"
+    for transition in sorted(stats, key=rank):
+        data = stats[transition]
+        text += (
+            f"{transition} ({data['count']} шт)\n"
+            f"⠀∟{format_duration_ms(data['p50'])} / {format_duration_ms(data['p90'])} / {format_duration_ms(data['p99'])}\n"
+        )
+    return text
+
+
+# ====================
+# ЭКСПОРТ ИСТОРИИ
+# ====================
+
+EXPORT_FIELDS = [
+    "source", "date", "fp_order_id", "smm_order_id", "event", "service_id", "provider",
+    "buyer", "amount", "revenue", "cost", "currency", "status", "url", "details"
+]
+export_worker = TaskWorker("export")
+
+
+def _iter_export_rows(date_from: str, date_to: str) -> Iterator[Dict]:
+    """Построчный обход всех источников истории в заданном диапазоне дат"""
+    def in_range(value: Any) -> bool:
+        day = str(value or "")[:10]
+        return date_from <= day <= date_to
+    
+    for smm_order_id, order in load_orders().items():
+        if in_range(order.created_at):
+            yield {
+                "source": "orders", "date": order.created_at, "fp_order_id": order.order_id,
+                "smm_order_id": smm_order_id, "service_id": order.service_id,
+                "amount": order.amount, "status": order.status, "url": order.url,
+                "details": f"remains={order.remains}"
+            }
+    
+    for row in iter_jsonl(PAYORDERS_ARCHIVE_FILE):
+        if in_range(row.get('OrderDateTime')):
+            yield {
+                "source": "payorders", "date": row.get('OrderDateTime'), "fp_order_id": row.get('OrderID'),
+                "smm_order_id": row.get('smm_order_id', ''), "service_id": row.get('service_id'),
+                "provider": row.get('api_type'), "buyer": row.get('buyer'), "amount": row.get('Amount'),
+                "revenue": row.get('OrderPrice'), "currency": row.get('OrderCurrency'),
+                "status": row.get('ArchiveStatus'), "url": row.get('url'), "details": row.get('Order')
+            }
+    
+    for row in iter_jsonl(REFUNDS_FILE):
+        if in_range(row.get('ts')):
+            yield {
+                "source": "refunds", "date": row.get('ts'), "fp_order_id": row.get('fp_order_id'),
+                "smm_order_id": row.get('smm_order_id'), "event": row.get('reason'),
+                "status": "ok" if row.get('ok') else "failed", "details": row.get('error')
+            }
+    
+    for row in iter_jsonl(LEDGER_FILE):
+        if in_range(row.get('ts')):
+            yield {
+                "source": "ledger", "date": row.get('ts'), "fp_order_id": row.get('fp_order_id'),
+                "smm_order_id": row.get('smm_order_id'), "event": row.get('event'),
+                "service_id": row.get('service'), "provider": row.get('provider'),
+                "revenue": row.get('revenue'), "cost": row.get('cost'), "currency": row.get('currency'),
+                "details": row.get('lot')
+            }
+
+
+def export_history(date_from: str, date_to: str, fmt: str = "csv") -> Tuple[str, int]:
+    """Потоковая выгрузка истории в сжатый CSV/JSONL файл"""
+    os.makedirs(EXPORTS_PATH, exist_ok=True)
+    filepath = f"{EXPORTS_PATH}/autosmm_{date_from}_{date_to}.{fmt}.gz"
+    count = 0
+    
+    with gzip.open(filepath, "wt", encoding='utf-8', newline='') as file:
+        if fmt == "csv":
+            writer = csv.DictWriter(file, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            for row in _iter_export_rows(date_from, date_to):
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in _iter_export_rows(date_from, date_to):
+                file.write(json.dumps(row, ensure_ascii=False) + "\n")
+                count += 1
+    
+    return filepath, count
+
+
+def parse_export_args(text: str) -> Tuple[str, str, str]:
+    """Разбор аргументов /autosmm_export [с] [по] [csv|jsonl]"""
+    args = text.split()[1:]
+    fmt = "csv"
+    if args and args[-1].lower() in ("csv", "jsonl"):
+        fmt = args.pop().lower()
+    
+    dates = [datetime.strptime(arg, "%Y-%m-%d").strftime("%Y-%m-%d") for arg in args[:2]]
+    date_to = dates[1] if len(dates) > 1 else datetime.now().strftime("%Y-%m-%d")
+    date_from = dates[0] if dates else (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+    return date_from, date_to, fmt
+
+
+def run_export(c: Cardinal, chat_id: int, date_from: str, date_to: str, fmt: str) -> None:
+    """Фоновая выгрузка и отправка документа в Telegram"""
+    filepath = None
+    try:
+        started = time.time()
+        filepath, count = export_history(date_from, date_to, fmt)
+        size_mb = os.path.getsize(filepath) / 1024 / 1024
+        if size_mb > 49:
+            c.telegram.bot.send_message(chat_id, f"❌ Файл выгрузки слишком большой ({size_mb:.1f} МБ), сократите период.")
+            return
+        
+        with open(filepath, "rb") as file:
+            c.telegram.bot.send_document(
+                chat_id, file,
+                caption=f"📦 Выгрузка {date_from} — {date_to}: {count} строк ({time.time() - started:.1f} сек)"
+            )
+        logger.info(f"Выгрузка {date_from} — {date_to} отправлена: {count} строк")
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки истории: {e}", exc_info=True)
+        try:
+            c.telegram.bot.send_message(chat_id, "❌ Ошибка при выгрузке истории")
+        except Exception:
+            pass
+    finally:
+        if filepath and os.path.exists(filepath):
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
+
+
+def _collect_runtime_metrics() -> None:
+    """Датчики очередей, считываемые в момент запроса метрик"""
+    Metrics.set_gauge("autosmm_pending_confirmations", len(pending_confirmations))
+    Metrics.set_gauge("autosmm_worker_queue", export_worker.qsize(), worker="export")
+    Metrics.set_gauge("autosmm_worker_queue", provider_worker.qsize(), worker="providers")
+    Metrics.set_gauge("autosmm_worker_queue", reconcile_worker.qsize(), worker="reconcile")
+    Metrics.set_gauge("autosmm_worker_queue", bulk_worker.qsize(), worker="bulk")
+    Metrics.set_gauge("autosmm_create_queue", CreationQueue.qsize())
+    Metrics.set_gauge("autosmm_log_queue", LogPipeline.qsize())
+    for provider, (active, waiting) in ProviderGate.busy().items():
+        Metrics.set_gauge("autosmm_create_slots_busy", active, provider=provider)
+        Metrics.set_gauge("autosmm_create_slots_waiting", waiting, provider=provider)
+
+
+Metrics.add_collector(_collect_runtime_metrics)
+
+
+def format_metrics_summary() -> str:
+    """Краткая сводка метрик для Telegram"""
+    counters, gauges, histograms = Metrics.snapshot()
+    
+    def total(name: str) -> int:
+        return int(sum(v for k, v in counters.items() if k[0] == name))
+    
+    def gauge(name: str) -> float:
+        return sum(v for k, v in gauges.items() if k[0] == name)
+    
+    text = "📡 Метрики AutoSmm\n\n"
+    text += (
+        f"🛒 Создано: {total('autosmm_orders_created_total')}, ошибок: {total('autosmm_orders_failed_total')}\n"
+        f"✅ Выполнено: {total('autosmm_orders_completed_total')}, ↩️ возвратов: {total('autosmm_orders_refunded_total')}\n"
+        f"📋 Активных: {int(gauge('autosmm_active_orders'))}, оплаченных: {int(gauge('autosmm_paid_orders'))}, "
+        f"ждут «+»: {int(gauge('autosmm_pending_confirmations'))}\n\n"
+    )
+    
+    cycle = histograms.get(("autosmm_checker_cycle_seconds",))
+    if cycle and cycle[2]:
+        text += (
+            f"⏱ Цикл чекера: среднее {cycle[1] / cycle[2]:.2f} с, p95 ≤ {Metrics.quantile(cycle, 0.95)} с\n"
+            f"⏱ Опоздание цикла: {gauge('autosmm_checker_lag_seconds'):.1f} с\n\n"
+        )
+    
+    api_lines = []
+    for key, hist in sorted(histograms.items()):
+        if key[0] != "autosmm_api_request_seconds" or not hist[2]:
+            continue
+        labels = dict(key[1:])
+        api_lines.append(
+            f"⠀∟{labels.get('provider')} {labels.get('action')}: {hist[2]} шт, "
+            f"p50 ≤ {Metrics.quantile(hist, 0.5)} с, p95 ≤ {Metrics.quantile(hist, 0.95)} с"
+        )
+    if api_lines:
+        text += "🌐 Запросы к API:\n" + "\n".join(api_lines) + "\n"
+    errors = total('autosmm_api_errors_total')
+    if errors:
+        text += f"⚠️ Ошибок API: {errors}\n"
+    
+    storage_lines = []
+    for key, hist in sorted(histograms.items()):
+        if key[0] != "autosmm_storage_seconds" or not hist[2]:
+            continue
+        labels = dict(key[1:])
+        size = gauges.get(("autosmm_storage_file_bytes", ("file", labels.get("file"))), 0)
+        storage_lines.append(
+            f"⠀∟{labels.get('file')} {labels.get('op')}: среднее {hist[1] / hist[2] * 1000:.1f} мс"
+            + (f", {size / 1024:.1f} КБ" if size and labels.get('op') == "save" else "")
+        )
+    if storage_lines:
+        text += "\n💾 Хранилище:\n" + "\n".join(storage_lines) + "\n"
+    
+    return text
+
+
+# ====================
+# ОБРАБОТЧИКИ СОБЫТИЙ
+# ====================
+
+@Profiler.wrap("bind_to_new_order")
+def bind_to_new_order(c: Cardinal, e: NewOrderEvent) -> None:
+    """Обработка нового заказа"""
+    try:
+        _element_data = e.order
+        _order_id = _element_data.id
+        
+        # Повторная доставка события (перезапуск, сбой раннера) отбрасывается до любой работы
+        if not ProcessedOrders.claim(_order_id):
+            Metrics.inc("autosmm_events_duplicate_total")
+            logger.info("Повторное событие заказа #%s пропущено", _order_id,
+                        extra=log_fields("event", _order_id, sample=True))
+            return
+        
+        logger.info("Получен новый заказ #%s", _order_id,
+                    extra=log_fields("event", _order_id, sample=True))
+        OrderTrace.mark(_order_id, "event")
+        
+        # Получаем полные данные заказа
+        try:
+            _element_full_data = c.account.get_order(_order_id)
+            _full_disc = _element_full_data.full_description
+            _buyer_uz = _element_full_data.buyer_username
+        except Exception as ex:
+            logger.error(f"Не удалось получить данные заказа #{_order_id}: {ex}", extra=log_fields("event", _order_id))
+            OrderTrace.discard(_order_id)
+            ProcessedOrders.forget(_order_id)
+            return
+        OrderTrace.mark(_order_id, "fetched")
+        
+        # Уведомление о балансе (если включено)
+        settings = SettingsCache.get_settings()
+        if settings.get("set_alert_smmbalance_new", False):
+            try:
+                send_smm_balance_info(c)
+            except Exception as ex:
+                logger.error(f"Ошибка отправки баланса: {ex}")
+        
+        # Извлечение параметров из описания
+        match_id = re.search(r'ID:\s*(\d+)', _full_disc)
+        match_oid = re.search(r'ID2:\s*(\d+)', _full_disc)
+        match_svc = re.search(r'SVC:\s*([\w-]+)', _full_disc)
+        match_quan = re.search(r'#Quan:\s*(\d+)', _full_disc)
+        
+        if match_svc and not match_id and not match_oid:
+            # Логическая услуга из service_map: панель выберет маршрутизатор
+            resolved = ProviderRouter.resolve(match_svc.group(1))
+            if resolved is None:
+                logger.error(f"Услуга {match_svc.group(1)} заказа #{_order_id} не найдена в карте услуг")
+                OrderTrace.discard(_order_id)
+                return
+            quan_value = int(match_quan.group(1)) if match_quan else 1
+            
+            is_valid, error = Validator.validate_quantity(quan_value)
+            if not is_valid:
+                logger.error(f"Некорректный quantity в заказе #{_order_id}: {error}")
+                return
+            
+            provider, service_id = resolved
+            order_handler(c, e, str(service_id), quan_value, _buyer_uz, provider)
+        
+        elif match_id:
+            id_value = match_id.group(1)
+            quan_value = int(match_quan.group(1)) if match_quan else 1
+            
+            # Валидация параметров
+            is_valid, error = Validator.validate_service_id(id_value)
+            if not is_valid:
+                logger.error(f"Некорректный service_id в заказе #{_order_id}: {error}")
+                return
+            
+            is_valid, error = Validator.validate_quantity(quan_value)
+            if not is_valid:
+                logger.error(f"Некорректный quantity в заказе #{_order_id}: {error}")
+                return
+            
+            order_handler(c, e, id_value, quan_value, _buyer_uz, 'API_1')
+            
+        elif match_oid:
+            id_value = match_oid.group(1)
+            quan_value = int(match_quan.group(1)) if match_quan else 1
+            
+            # Валидация параметров
+            is_valid, error = Validator.validate_service_id(id_value)
+            if not is_valid:
+                logger.error(f"Некорректный service_id в заказе #{_order_id}: {error}")
+                return
+            
+            order_handler(c, e, id_value, quan_value, _buyer_uz, 'API_2')
+        else:
+            OrderTrace.discard(_order_id)
+            logger.info("Заказ #%s не предназначен для автонакрутки", _order_id,
+                        extra=log_fields("event", _order_id, sample=True))
+            
+    except Exception as ex:
+        logger.error(f"Критическая ошибка в bind_to_new_order: {ex}", exc_info=True)
+
+
+def order_handler(c: Cardinal, e: NewOrderEvent, id_value: str, quan_value: int, buyer_uz: str, type_api: str = 'API_1') -> None:
+    """Обработчик заказа"""
+    try:
         order_ = e.order
         orderID = order_.id
         orderAmount = order_.amount * quan_value
@@ -613,734 +3818,2287 @@ def order_handler(c: Cardinal, e: NewOrderEvent, id_value: str, quan_value: int,
         
         current_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        current_order_data = {
-            'OrderID': str(orderID),
-            'Amount': int(orderAmount),
-            'OrderPrice': orderPrice,
-            'OrderCurrency': f"{orderCurrency}",
-            'Order': f"{str(order_)}",
-            'service_id': int(id_value),
-            'buyer': str(buyer_uz),
-            'url': str(url),
-            'NewUser': True,
-            'chat_id': "",
-            'OrderDateTime': current_datetime,
-            'api_type': type_api
-        }
+        current_order_data = PaidOrder(
+            order_id=str(orderID),
+            amount=int(orderAmount),
+            price=orderPrice,
+            currency=f"{orderCurrency}",
+            title=f"{str(order_)}",
+            service_id=int(id_value),
+            buyer=str(buyer_uz),
+            url=str(url),
+            created_at=current_datetime,
+            api_type=type_api
+        )
+        
+        duplicate = False
+        
+        def add_order(orders: List[PaidOrder]):
+            nonlocal duplicate
+            duplicate = any(order.order_id == current_order_data.order_id for order in orders)
+            if duplicate:
+                return False
+            orders.append(current_order_data)
+        
+        saved = update_payorders(add_order) is not None
+        if saved and duplicate:
+            logger.info(f"Заказ #{orderID} уже в списке обработки", extra=log_fields("event", orderID))
+        elif saved:
+            OrderTrace.mark(orderID, "queued")
+            logger.info("Заказ #%s добавлен в список обработки", orderID,
+                        extra=log_fields("event", orderID, type_api, sample=True))
+            handle_order(c, current_order_data, "")
+        else:
+            logger.error(f"Не удалось сохранить заказ #{orderID}")
+            ProcessedOrders.forget(orderID)
+            
+    except Exception as ex:
+        logger.error(f"Ошибка в order_handler: {ex}", exc_info=True)
+
+
+FP_ORDER_ID = re.compile(r'#([A-Z0-9]{8})\b')
+
+
+def order_api_credentials(order: Optional[PaidOrder]) -> Tuple[str, str]:
+    """API провайдера, выбранного для заказа"""
+    return SettingsCache.credentials(order.api_type if order else None)
+
+
+def smm_order_credentials(smm_order_id: str, fallback: Optional[str] = None) -> Tuple[str, str]:
+    """API панели, на которой создан заказ; для неизвестного заказа - fallback"""
+    active = load_orders().get(str(smm_order_id))
+    return SettingsCache.credentials(active.provider if active and active.provider else fallback)
+
+
+def send_smm_status(c: Cardinal, chat_id: Any, smm_order_id: str, api_url: str, api_key: str) -> None:
+    """Ответ на #статус / #инфо"""
+    status = SocTypeAPI.get_order_status(int(smm_order_id), api_url, api_key)
+    if status:
+        start_count = status.get('start_count', 0)
+        display_start_count = "*" if start_count == 0 else str(start_count)
+        
+        status_text = f"📈 Статус заказа: {smm_order_id}\n"
+        status_text += f"⠀∟📊 Статус: {status.get('status', 'Unknown')}\n"
+        status_text += f"⠀∟🔢 Было: {display_start_count}\n"
+        status_text += f"⠀∟👀 Остаток выполнения: {status.get('remains', 'N/A')}"
+        
+        order = load_orders().get(str(smm_order_id))
+        if order and status.get('status') in ("Pending", "In progress", "Processing"):
+            seen = CheckerSchedule.entry(str(smm_order_id)).get("seen")
+            eta = ServiceTiming.format(
+                order.provider, order.service_id, order.amount, status=status.get('status'),
+                remains=_to_int(status.get('remains'), order.amount), elapsed=time.time() - seen if seen else 0.0
+            )
+            if eta:
+                status_text += f"\n⠀∟⏳ До завершения: {eta}"
+        c.send_message(chat_id, status_text)
+    else:
+        c.send_message(chat_id, "🔴 Не удалось получить статус заказа.")
+
+
+def command_status(c: Cardinal, msg, smm_order_id: str) -> None:
+    try:
+        api_url, api_key = smm_order_credentials(smm_order_id)
+        send_smm_status(c, msg.chat_id, smm_order_id, api_url, api_key)
+    except Exception as e:
+        logger.error(f"Ошибка получения статуса: {e}")
+        c.send_message(msg.chat_id, "🔴 Ошибка при получении статуса.")
+
+
+def command_info(c: Cardinal, msg, smm_order_id: str) -> None:
+    try:
+        api_url, api_key = smm_order_credentials(smm_order_id, 'API_2')
+        send_smm_status(c, msg.chat_id, smm_order_id, api_url, api_key)
+    except Exception as e:
+        logger.error(f"Ошибка получения статуса (API 2): {e}")
+        c.send_message(msg.chat_id, "🔴 Ошибка при получении статуса.")
+
+
+def command_refill(c: Cardinal, msg, smm_order_id: str) -> None:
+    try:
+        api_url, api_key = smm_order_credentials(smm_order_id)
+        refill_result = SocTypeAPI.refill_order(int(smm_order_id), api_url, api_key)
+        if refill_result is not None:
+            record_refill(smm_order_id, refill_result, msg.chat_id)
+            c.send_message(msg.chat_id, f"✅ Запрос на рефилл отправлен!")
+        else:
+            c.send_message(msg.chat_id, f"🔴 Ошибка при выполнении рефилла.\n⚠️ Возможно, рефилл еще недоступен!")
+    except Exception as e:
+        logger.error(f"Ошибка рефилла: {e}")
+        c.send_message(msg.chat_id, "🔴 Ошибка при выполнении рефилла.")
+
+
+# Команды покупателя в чате: первое слово -> обработчик(c, msg, аргумент)
+MESSAGE_COMMANDS = {
+    "#статус": command_status,
+    "#инфо": command_info,
+    "#рефилл": command_refill,
+}
+
+
+def route_command(c: Cardinal, msg, text: str) -> None:
+    command, argument = text.split(None, 2)[:2]
+    MESSAGE_COMMANDS[command](c, msg, argument)
+
+
+def route_confirmation(c: Cardinal, msg, text: str) -> None:
+    """Ответ покупателя на запрос подтверждения ссылки"""
+    order = pending_confirmations.get(msg.chat_id)
+    if not order:
+        return
+    
+    if text in ("+", "-"):
+        api_url, api_key = order_api_credentials(order)
+        confirm_order(c, msg.chat_id, text, api_url, api_key)
+    elif LinkParser.find_all(text):
+        order.chat_id = msg.chat_id
+        handle_order(c, order, text)
+    else:
+        c.send_message(msg.chat_id, "⚪️ Пожалуйста, отправьте +, если всё верно, или -, для возврата средств.")
+
+
+def refund_created_order(fp_order_id: str, chat_id: Any) -> bool:
+    """Ручной возврат заказа, уже созданного в SMM: он снимается с проверки статуса.
+    Учитываются только заказы из чата chat_id."""
+    smm_order_ids = [
+        smm_id for smm_id, active in load_orders().items()
+        if active.order_id == fp_order_id and str(active.chat_id) == str(chat_id)
+    ]
+    if not smm_order_ids:
+        return False
+    
+    def drop(orders: Dict[str, ActiveOrder]) -> None:
+        for smm_id in smm_order_ids:
+            orders.pop(smm_id, None)
+    
+    update_orders(drop)
+    CheckerSchedule.forget(smm_order_ids)
+    for smm_id in smm_order_ids:
+        log_refund(fp_order_id, "manual", True, smm_order_id=smm_id)
+        SalesStats.record_refunded(smm_id)
+    logger.info(f"Заказ #{fp_order_id} возвращен вручную и снят с проверки (SMM: {', '.join(smm_order_ids)})")
+    return True
+
+
+def route_manual_refund(c: Cardinal, msg, text: str) -> None:
+    """Уведомление FunPay о возврате (системное сообщение): заказ больше не ждет ссылку.
+    
+    Номер заказа берется из уведомления, и заказ должен принадлежать покупателю
+    этого чата: оплаченный - по имени, созданный в SMM (orders.json) - по чату.
+    Без номера - первый оплаченный заказ покупателя.
+    """
+    match = FP_ORDER_ID.search(text)
+    if match:
+        fp_order_id = match.group(1)
+        order = remove_payorder(fp_order_id, 'refunded', buyer=msg.chat_name)
+        if order is None and not refund_created_order(fp_order_id, msg.chat_id):
+            logger.warning(f"Уведомление о возврате заказа #{fp_order_id} не относится к заказам {msg.chat_name}")
+            return
+        RefundQueue.settle(fp_order_id)
+    else:
+        order = remove_payorder_by_buyer(msg.chat_name, 'refunded')
+    if order:
+        log_refund(order.order_id, "manual", True)
+        SalesStats.record_refunded(fp_order_id=order.order_id)
+        logger.info(f"Заказ отменен: {order.order_id}")
+
+
+def route_buyer(c: Cardinal, msg, text: str) -> None:
+    """Сообщение покупателя с оплаченным заказом, ожидающим ссылку"""
+    order = find_open_order(msg.chat_name)
+    if not order:
+        return
+    logger.info("Обработка сообщения от %s для заказа #%s", msg.chat_name, order.order_id,
+                extra=log_fields("message", order.order_id, sample=True))
+    order.chat_id = msg.chat_id
+    handle_order(c, order, text)
+
+
+def route_message(msg, text: str):
+    """Выбор обработчика без чтения файлов; None - сообщение не относится к плагину"""
+    if msg.chat_id in pending_confirmations:
+        return route_confirmation
+    
+    if text[:1] == "#":
+        parts = text.split(None, 2)
+        if len(parts) >= 2 and parts[0] in MESSAGE_COMMANDS:
+            return route_command
+    
+    if not has_open_order(msg.chat_name):
+        return None
+    return route_buyer
+
+
+@Profiler.wrap("msg_hook")
+def msg_hook(c: Cardinal, e: NewMessageEvent) -> None:
+    """Обработка сообщений"""
+    try:
+        msg = e.message
+        
+        text = msg.text.strip() if msg.text else ""
+        
+        # Системные и свои сообщения отбрасываются до любой работы, кроме уведомления о возврате:
+        # созданных заказов уже нет среди оплаченных, принадлежность проверяет route_manual_refund
+        if msg.type == MessageTypes.REFUND:
+            route = route_manual_refund
+        elif msg.type != MessageTypes.NON_SYSTEM or msg.author_id == c.account.id:
+            return
+        else:
+            route = route_message(msg, text)
+        if route is None:
+            Metrics.inc("autosmm_messages_total", route="ignored")
+            return
+        
+        Metrics.inc("autosmm_messages_total", route=route.__name__[len("route_"):])
+        route(c, msg, text)
+        
+    except Exception as ex:
+        logger.error(f"Критическая ошибка в msg_hook: {ex}", exc_info=True)
+
+
+def handle_order(c: Cardinal, order: PaidOrder, text: str) -> None:
+    """Обработка заказа с ссылкой"""
+    try:
+        settings = SettingsCache.get_settings()
+        
+        api_url, _ = order_api_credentials(order)
+        expected = LinkParser.expected_platform(order, api_url)
+        links = LinkParser.find_all(text, expected)
+        
+        if links:
+            link = links[0]
+            
+            # Проверка площадки и закрытых ссылок до запроса к провайдеру
+            allow_private = settings.get("set_tg_private", False)
+            is_valid, error = LinkParser.validate(link, expected, allow_private)
+            
+            if not is_valid:
+                Metrics.inc("autosmm_links_rejected_total", platform=link.platform, expected=expected or "any")
+                c.send_message(order.chat_id, f"❌ {error}")
+                return
+            
+            order.url = link.url
+            link_display = link.url.replace("https://", "").replace("http://", "")
+            
+            confirmation_text = f"""📋 Пожалуйста, проверьте детали вашего заказа:
+🛒 Лот: {order.title or 'N/A'}
+🔢 Количество: {order.amount} шт
+🔗 Ссылка: {link_display}
+
+✅ Если всё верно, отправьте: +
+❌ Для возврата средств, отправьте: -
+🔄 Или отправьте новую ссылку для обновления."""
+            
+            c.send_message(order.chat_id, confirmation_text)
+            pending_confirmations[order.chat_id] = order
+            OrderTrace.mark(order.order_id, "link")
+            
+            # Обновляем заказ в списке
+            def replace_order(orders_data: List[PaidOrder]):
+                index = next((i for i, o in enumerate(orders_data) if o.order_id == order.order_id), None)
+                if index is not None:
+                    orders_data[index] = order
+                else:
+                    orders_data.append(order)
+            
+            update_payorders(replace_order)
+            logger.info("Заказ #%s обновлен с URL", order.order_id,
+                        extra=log_fields("link", order.order_id, sample=True))
+            
+    except Exception as ex:
+        logger.error(f"Ошибка в handle_order: {ex}", exc_info=True)
+
+
+def create_routed_order(order: PaidOrder, api_url: str, api_key: str,
+                        avoid: Optional[str] = None) -> Tuple[Any, str, str]:
+    """Создание заказа на лучшей панели; при отказе панели - на следующей.
+    
+    На другую панель заказ уходит только после явной ошибки или если
+    соединение с панелью не установлено. Если запрос дошел, но ответа нет
+    (API_UNKNOWN_RESULT), заказ мог быть создан: он остается за этой
+    панелью, и повтор купил бы его дважды.
+    avoid - панель, которая не отвечала: пробуется последней.
+    Выбранные панель и услуга записываются в order.
+    """
+    routes = ProviderRouter.rank(order)
+    if avoid:
+        routes.sort(key=lambda route: route.provider == avoid)
+    smm_order_id, unreachable = None, False
+    for route in routes:
+        route_url, route_key = SettingsCache.credentials(route.provider)
+        smm_order_id = ProviderGate.create_order(
+            route.provider, route.service_id, order.url, order.amount, route_url, route_key
+        )
+        
+        if str(smm_order_id).isdigit():
+            if route.provider != order.api_type:
+                logger.info("Заказ #%s направлен на %s (услуга %s)",
+                            order.order_id, route.provider, route.service_id,
+                            extra=log_fields("route", order.order_id, route.provider, sample=True))
+            Metrics.inc("autosmm_orders_routed_total", provider=route.provider, requested=order.api_type)
+            if route.unit_cost is not None:
+                ProviderCache.spend(route_url, route.unit_cost * order.amount)
+            order.api_type, order.service_id = route.provider, route.service_id
+            return smm_order_id, route_url, route_key
+        
+        logger.warning(f"Панель {route.provider} не создала заказ #{order.order_id}: {smm_order_id}")
+        if smm_order_id == API_UNKNOWN_RESULT:
+            order.api_type, order.service_id = route.provider, route.service_id
+            return smm_order_id, route_url, route_key
+        if smm_order_id == API_CONNECTION_ERROR:
+            # Запрос не дошел до панели: можно пробовать следующую
+            unreachable = True
+    if unreachable:
+        # Хотя бы одна панель была недоступна: заказ стоит повторить позже, а не возвращать
+        return API_CONNECTION_ERROR, api_url, api_key
+    return smm_order_id, api_url, api_key
+
+
+def complete_created_order(c: Cardinal, order: PaidOrder, smm_order_id: Any, api_url: str, api_key: str) -> None:
+    """Учет заказа, созданного на сайте SMM, и сообщение покупателю"""
+    settings = SettingsCache.get_settings()
+    try:
+        new_order = order.to_active()
+        update_orders(lambda orders: orders.update({str(smm_order_id): new_order}))
+        
+        Metrics.inc("autosmm_orders_created_total", provider=order.api_type)
+        OrderTrace.mark(order.order_id, "created")
+        
+        # Заказ передан сайту, в списке оплаченных он больше не нужен
+        remove_payorder(order.order_id, 'created', smm_order_id)
+        
+        # Учет в статистике продаж
+        charge = get_order_charge(order, int(smm_order_id), api_url, api_key)
+        SalesStats.record_created(order, smm_order_id, charge[0] if charge else 0.0)
+        
+        # Уведомление об успехе
+        if settings.get("set_alert_neworder", False):
+            try:
+                send_order_info(c, order, int(smm_order_id), api_url, api_key, charge)
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления: {e}")
+        
+        status_cmd = 'статус' if order.api_type == 'API_1' else 'инфо'
+        success_message = f"""📊 Ваш заказ СОЗДАН и отправлен SMM сервису!
+🆔 ID заказа: {smm_order_id}
+
+📋 Доступные команды:
+⠀∟📗 Узнать статус заказа: #{status_cmd} {smm_order_id}
+⠀∟📙 Рефилл (если доступно): #рефилл {smm_order_id}
+
+"""
+        eta = ServiceTiming.format(order.api_type, order.service_id, order.amount)
+        if eta:
+            success_message += f"⌛ Ожидаемое время выполнения: {eta}. В редких случаях возможны задержки."
+        else:
+            success_message += "⌛ Время выполнения: от нескольких минут до 48 часов. В редких случаях возможны задержки."
+        
+        c.send_message(order.chat_id, success_message)
+        logger.info(f"Заказ #{order.order_id} успешно создан в SMM: {smm_order_id}",
+                    extra=log_fields("created", order.order_id, order.api_type))
+        
+    except Exception as e:
+        logger.error(f"Ошибка сохранения заказа: {e}", exc_info=True)
+
+
+def fail_created_order(c: Cardinal, order: PaidOrder, error: Any, reason: str = "create_failed") -> None:
+    """Заказ не удалось создать: сообщение покупателю, уведомления и автовозврат"""
+    settings = SettingsCache.get_settings()
+    Metrics.inc("autosmm_orders_failed_total", provider=order.api_type)
+    OrderTrace.mark(order.order_id, "create_failed")
+    error_message = f"❌ Ошибка при создании заказа: {error}"
+    c.send_message(order.chat_id, error_message)
+    logger.error(f"Не удалось создать заказ #{order.order_id}: {error}")
+    
+    # Уведомление об ошибке
+    if settings.get("set_alert_errororder", False):
+        try:
+            send_order_error_info(c, error, order)
+        except Exception as e:
+            logger.error(f"Ошибка отправки уведомления об ошибке: {e}")
+    
+    # Уведомление о балансе
+    if settings.get("set_alert_smmbalance", False):
+        try:
+            send_smm_balance_info(c)
+        except Exception as e:
+            logger.error(f"Ошибка отправки баланса: {e}")
+    
+    # Автовозврат
+    if settings.get("set_refund_smm", False):
+        if RefundQueue.enqueue(c, order.order_id, reason):
+            remove_payorder(order.order_id, 'refunded')
+        else:
+            send_admin_alert(c, f"⚠️ Не удалось вернуть средства за несозданный заказ #{order.order_id}. "
+                                f"Верните их вручную.")
+
+
+class DeferredSubmissions:
+    """Отложенное создание заказов, панель которых не отвечала.
+    
+    Подтвержденный заказ сохраняется в deferred.json и повторяется с
+    экспоненциальной паузой, в том числе на равнозначной панели из карты
+    услуг. Возврат средств - только если заказ не создан за
+    deferred_deadline секунд. Очередь обрабатывает лидер чекера.
+    
+    Заказ, на создание которого панель не ответила (API_UNKNOWN_RESULT),
+    мог быть создан: он не повторяется автоматически, а ждет, пока
+    администратор проверит панель (/autosmm_deferred).
+    """
+    RETRY_BASE = 15  # секунды
+    RETRY_MAX = 300  # секунды
+    
+    @staticmethod
+    def enabled() -> bool:
+        return SettingsCache.get_settings().get("deferred_deadline", 1800) > 0
+    
+    @staticmethod
+    def load() -> Dict[str, DeferredOrder]:
+        return {
+            order_id: DeferredOrder.from_dict(data)
+            for order_id, data in load_json_safe(DEFERRED_FILE, {}, 'deferred').items()
+        }
+    
+    @classmethod
+    def _delay(cls, attempts: int) -> float:
+        return min(cls.RETRY_MAX, cls.RETRY_BASE * 2 ** max(0, attempts - 1))
+    
+    @classmethod
+    def defer(cls, c: Cardinal, order: PaidOrder, error: str) -> bool:
+        """Постановка заказа в очередь и сообщение покупателю о задержке"""
+        now = time.time()
+        deadline = SettingsCache.get_settings().get("deferred_deadline", 1800)
+        entry = DeferredOrder(order, 1, now + cls._delay(1), now + deadline, now, order.api_type, str(error))
+        saved = update_json_safe(
+            DEFERRED_FILE, {}, 'deferred', lambda data: data.__setitem__(order.order_id, entry.to_dict())
+        )
+        if saved is None:
+            return False
+        
+        # В списке оплаченных заказ больше не ждет ссылку
+        remove_payorder(order.order_id, 'deferred')
+        Metrics.inc("autosmm_deferred_total", outcome="deferred", provider=order.api_type)
+        OrderTrace.mark(order.order_id, "deferred")
+        logger.warning(f"Панель {order.api_type} недоступна, заказ #{order.order_id} отложен")
+        c.send_message(
+            order.chat_id,
+            f"⏳ SMM сервис временно недоступен. Ваш заказ принят и будет создан автоматически, "
+            f"как только сервис ответит (не дольше {max(1, round(deadline / 60))} мин). "
+            f"Если этого не произойдет, средства вернутся автоматически."
+        )
+        return True
+    
+    @classmethod
+    def hold(cls, c: Cardinal, order: PaidOrder, error: str) -> bool:
+        """Заказ с неизвестным результатом создания - до проверки администратором"""
+        now = time.time()
+        entry = DeferredOrder(order, 1, now, 0.0, now, order.api_type, str(error), True)
+        saved = update_json_safe(
+            DEFERRED_FILE, {}, 'deferred', lambda data: data.__setitem__(order.order_id, entry.to_dict())
+        )
+        if saved is None:
+            return False
+        
+        remove_payorder(order.order_id, 'deferred')
+        cls._announce_unconfirmed(c, order)
+        c.send_message(
+            order.chat_id,
+            "⏳ SMM сервис ответил с задержкой. Проверяем, создан ли ваш заказ, и сообщим результат."
+        )
+        return True
+    
+    @staticmethod
+    def _announce_unconfirmed(c: Cardinal, order: PaidOrder) -> None:
+        Metrics.inc("autosmm_deferred_total", outcome="unconfirmed", provider=order.api_type)
+        OrderTrace.mark(order.order_id, "unconfirmed")
+        logger.error(f"Панель {order.api_type} не ответила на создание заказа #{order.order_id}, нужна проверка")
+        send_admin_alert(
+            c,
+            f"⚠️ Панель {order.api_type} не ответила на создание заказа #{order.order_id} "
+            f"(услуга {order.service_id}, {order.amount} шт, {order.url}). Заказ мог быть создан.\n\n"
+            f"Проверьте панель и выберите:\n"
+            f"/autosmm_deferred created {order.order_id} ID_НА_ПАНЕЛИ\n"
+            f"/autosmm_deferred resend {order.order_id}\n"
+            f"/autosmm_deferred refund {order.order_id}"
+        )
+    
+    @classmethod
+    def _finish(cls, order_id: str) -> None:
+        update_json_safe(DEFERRED_FILE, {}, 'deferred', lambda data: data.pop(order_id, None) is not None)
+    
+    @classmethod
+    def resolve(cls, c: Cardinal, order_id: str, action: str, smm_order_id: Optional[str] = None) -> str:
+        """Решение администратора по заказу без подтверждения; возвращает ответ для Telegram"""
+        entry = cls.load().get(order_id)
+        if entry is None or not entry.unconfirmed:
+            return f"❌ Заказ #{order_id} не ждет проверки"
+        order = entry.order
+        
+        if action == "created":
+            api_url, api_key = SettingsCache.credentials(order.api_type)
+            if not SocTypeAPI.get_order_status(int(smm_order_id), api_url, api_key):
+                return f"❌ Панель {order.api_type} не знает заказ {smm_order_id}"
+            cls._finish(order_id)
+            Metrics.inc("autosmm_deferred_total", outcome="created", provider=order.api_type)
+            complete_created_order(c, order, smm_order_id, api_url, api_key)
+            return f"✅ Заказ #{order_id} привязан к {smm_order_id} на {order.api_type}"
+        
+        if action == "resend":
+            deadline = SettingsCache.get_settings().get("deferred_deadline", 1800)
+            
+            def release(data: Dict):
+                if order_id not in data:
+                    return False
+                now = time.time()
+                data[order_id].update(unconfirmed=False, next_at=now, deadline=now + max(deadline, 60), provider="")
+            
+            if update_json_safe(DEFERRED_FILE, {}, 'deferred', release) is None:
+                return "❌ Не удалось сохранить очередь"
+            return f"✅ Заказ #{order_id} будет создан заново в ближайшем цикле"
+        
+        if not RefundQueue.enqueue(c, order_id, "deferred_unconfirmed"):
+            return f"❌ Не удалось поставить возврат #{order_id} в очередь, заказ остался в списке"
+        cls._finish(order_id)
+        Metrics.inc("autosmm_deferred_total", outcome="failed", provider=order.api_type)
+        c.send_message(order.chat_id, "❌ Заказ не удалось создать, средства будут возвращены.")
+        return f"✅ Возврат #{order_id} поставлен в очередь"
+    
+    @classmethod
+    def process(cls, c: Cardinal, generation: Optional[int] = None) -> None:
+        """Повтор заказов, срок которых наступил; просроченные возвращаются"""
+        if not os.path.exists(DEFERRED_FILE):
+            return
+        
+        entries = cls.load()
+        Metrics.set_gauge("autosmm_deferred_orders", len(entries))
+        now = time.time()
+        for order_id, entry in entries.items():
+            if not CheckerSupervisor.is_current(generation):
+                return
+            if entry.unconfirmed or entry.next_at > now:
+                continue
+            order = entry.order
+            
+            if now >= entry.deadline:
+                cls._finish(order_id)
+                Metrics.inc("autosmm_deferred_total", outcome="expired", provider=order.api_type)
+                waited = max(1, round((now - entry.deferred_at) / 60))
+                fail_created_order(c, order, f"сервис не отвечал {waited} мин", "deferred_expired")
+                continue
+            
+            try:
+                smm_order_id, api_url, api_key = create_routed_order(order, "", "", avoid=entry.provider)
+            except Exception as e:
+                logger.error(f"Исключение при повторе заказа #{order_id}: {e}", exc_info=True)
+                smm_order_id = f"Ошибка: {str(e)}"
+            
+            if str(smm_order_id).isdigit():
+                cls._finish(order_id)
+                Metrics.inc("autosmm_deferred_total", outcome="created", provider=order.api_type)
+                logger.info(f"Отложенный заказ #{order_id} создан с попытки {entry.attempts + 1}")
+                complete_created_order(c, order, smm_order_id, api_url, api_key)
+            elif smm_order_id == API_CONNECTION_ERROR:
+                attempts = entry.attempts + 1
+                
+                def reschedule(data: Dict):
+                    if order_id not in data:
+                        return False
+                    data[order_id].update(attempts=attempts, next_at=time.time() + cls._delay(attempts),
+                                          provider=order.api_type, error=str(smm_order_id))
+                
+                update_json_safe(DEFERRED_FILE, {}, 'deferred', reschedule)
+            elif smm_order_id == API_UNKNOWN_RESULT:
+                def mark_unconfirmed(data: Dict):
+                    if order_id not in data:
+                        return False
+                    data[order_id].update(order=order.to_dict(), unconfirmed=True,
+                                          provider=order.api_type, error=str(smm_order_id))
+                
+                if update_json_safe(DEFERRED_FILE, {}, 'deferred', mark_unconfirmed) is not None:
+                    cls._announce_unconfirmed(c, order)
+            else:
+                # Панель ответила отказом: ждать бесполезно
+                cls._finish(order_id)
+                Metrics.inc("autosmm_deferred_total", outcome="failed", provider=order.api_type)
+                fail_created_order(c, order, smm_order_id)
+
+
+def format_deferred() -> str:
+    """Отложенные заказы для Telegram; ждущие проверки - первыми"""
+    entries = sorted(DeferredSubmissions.load().items(), key=lambda item: (not item[1].unconfirmed, item[1].deferred_at))
+    unconfirmed = sum(entry.unconfirmed for _, entry in entries)
+    text = "⏳ Отложенные заказы\n\n"
+    text += f"Всего: {len(entries)}, ждут проверки панели: {unconfirmed}\n\n"
+    for order_id, entry in entries[:REFUNDS_SHOWN]:
+        since = datetime.fromtimestamp(entry.deferred_at).strftime("%d.%m %H:%M")
+        mark = "⚠️" if entry.unconfirmed else "•"
+        text += (f"{mark} #{order_id}: {entry.provider or entry.order.api_type}, услуга {entry.order.service_id}, "
+                 f"{entry.order.amount} шт, с {since}\n")
+        if entry.unconfirmed:
+            text += f"⠀∟ {entry.order.url}\n"
+    if len(entries) > REFUNDS_SHOWN:
+        text += f"… и еще {len(entries) - REFUNDS_SHOWN}\n"
+    text += (
+        "\nЗаказы с ⚠️ могли быть созданы. Проверьте панель и выберите:\n"
+        "/autosmm_deferred created ID ID_НА_ПАНЕЛИ - заказ есть на панели\n"
+        "/autosmm_deferred resend ID - заказа нет, создать заново\n"
+        "/autosmm_deferred refund ID - вернуть средства"
+    )
+    return text
+
+
+def create_confirmed_order(c: Cardinal, order: PaidOrder, api_url: str, api_key: str) -> None:
+    """Создание подтвержденного заказа в SMM"""
+    logger.info("Создание заказа в SMM для #%s", order.order_id,
+                extra=log_fields("create", order.order_id, order.api_type, sample=True))
+    
+    try:
+        smm_order_id, api_url, api_key = create_routed_order(order, api_url, api_key)
+    except Exception as e:
+        logger.error(f"Исключение при создании заказа в SMM: {e}", exc_info=True)
+        smm_order_id = f"Ошибка: {str(e)}"
+    
+    # Проверка успешности создания
+    if isinstance(smm_order_id, (int, str)) and str(smm_order_id).isdigit():
+        complete_created_order(c, order, smm_order_id, api_url, api_key)
+    elif smm_order_id == API_CONNECTION_ERROR and DeferredSubmissions.enabled():
+        # Панель недоступна: заказ создается позже, возврат только после срока
+        if not DeferredSubmissions.defer(c, order, smm_order_id):
+            fail_created_order(c, order, smm_order_id)
+    elif smm_order_id == API_UNKNOWN_RESULT:
+        # Заказ мог быть создан: ни повтора, ни возврата до проверки панели
+        if not DeferredSubmissions.hold(c, order, smm_order_id):
+            logger.error(f"Не удалось сохранить заказ #{order.order_id} с неизвестным результатом")
+            send_admin_alert(
+                c, f"⚠️ Панель {order.api_type} не ответила на создание заказа #{order.order_id}, "
+                   f"и его не удалось сохранить. Проверьте панель вручную; заказ остался в списке оплаченных."
+            )
+    else:
+        fail_created_order(c, order, smm_order_id)
+
+
+class CreationQueue:
+    """Очередь подтвержденных заказов на создание в SMM.
+    
+    Подтверждение покупателя не создает заказ в потоке обработки сообщений:
+    заказ встает в общую очередь FIFO, которую разбирают create_workers
+    потоков, а одновременные запросы к каждой панели ограничивает
+    ProviderGate. При всплеске заказы создаются с предельной для панели
+    скоростью, а покупатель видит свое место в очереди.
+    
+    Очередь дублируется в CREATE_QUEUE_FILE с меткой процесса-владельца:
+    после перезапуска recover() снова ставит в очередь заказы завершившихся
+    процессов, а заказы, запрос создания которых уже был отправлен, передает
+    на проверку администратору, чтобы не купить их дважды.
+    """
+    _queue: deque = deque()
+    _busy: Dict[str, int] = {}
+    _order_ids: Set[str] = set()  # в очереди или создаются сейчас
+    _threads: List[threading.Thread] = []
+    _cond = threading.Condition()
+    _boot = time.time()
+    _owner = InterProcessLock(f"{LOCKS_PATH}/create_{os.getpid()}.lock")
+    
+    @staticmethod
+    def workers() -> int:
+        try:
+            return max(1, int(SettingsCache.get_settings().get("create_workers", 8)))
+        except (TypeError, ValueError):
+            return 1
+    
+    @classmethod
+    def qsize(cls) -> int:
+        with cls._cond:
+            return len(cls._queue)
+    
+    @classmethod
+    def submit(cls, c: Cardinal, order: PaidOrder, api_url: str, api_key: str) -> Optional[int]:
+        """Поставить заказ в очередь; возвращает число заказов, которые будут созданы раньше него
+        (0 - создание начнется сразу), None - заказ уже в очереди или создается"""
+        workers = cls.workers()
+        concurrency, _ = ProviderGate.limits(order.api_type)
+        with cls._cond:
+            if order.order_id in cls._order_ids:
+                return None
+            cls._order_ids.add(order.order_id)
+            cls._threads = [thread for thread in cls._threads if thread.is_alive()]
+            while len(cls._threads) < workers:
+                thread = threading.Thread(target=cls._run, name="AutoSmm-create", daemon=True)
+                thread.start()
+                cls._threads.append(thread)
+            
+            # Место считается только среди заказов той же панели: у других панелей свои слоты
+            ahead = cls._busy.get(order.api_type, 0) + sum(
+                1 for queued in cls._queue if queued[1].api_type == order.api_type
+            )
+            cls._queue.append((c, order, api_url, api_key, time.monotonic()))
+            cls._cond.notify()
+        cls._persist(order, "queued")
+        return max(0, ahead - min(workers, concurrency) + 1)
+    
+    @classmethod
+    def _persist(cls, order: PaidOrder, stage: Optional[str]) -> None:
+        """Запись стадии заказа в файл очереди; None - заказ обработан"""
+        order_id = str(order.order_id)
+        cls._owner.acquire(blocking=False)
+        
+        def mark(data: Dict):
+            if stage is None:
+                return data.pop(order_id, None) is not None
+            data[order_id] = {
+                "order": order.to_dict(), "stage": stage, "owner": os.getpid(), "boot": cls._boot,
+            }
+        
+        if update_json_safe(CREATE_QUEUE_FILE, {}, 'create_queue', mark) is None:
+            logger.error(f"Не удалось сохранить заказ #{order_id} в очереди создания ({stage})")
+    
+    @classmethod
+    def _stale(cls, entry: Dict) -> bool:
+        """Запись оставлена процессом, который уже не работает"""
+        if entry.get("owner") == os.getpid():
+            return entry.get("boot") != cls._boot
+        lock = InterProcessLock(f"{LOCKS_PATH}/create_{entry.get('owner')}.lock")
+        if not lock.acquire(blocking=False):
+            return False
+        lock.release()
+        return True
+    
+    @classmethod
+    def recover(cls, c: Cardinal) -> None:
+        """Заказы из очереди создания, прерванной перезапуском"""
+        if not os.path.exists(CREATE_QUEUE_FILE):
+            return
+        cls._owner.acquire(blocking=False)
+        claimed: Dict[str, Dict] = {}
+        
+        def claim(data: Dict):
+            for order_id, entry in data.items():
+                if cls._stale(entry):
+                    claimed[order_id] = entry
+                    entry.update(owner=os.getpid(), boot=cls._boot)
+            return bool(claimed)
+        
+        if not update_json_safe(CREATE_QUEUE_FILE, {}, 'create_queue', claim) or not claimed:
+            return
+        
+        open_ids = {order.order_id for order in load_payorders()}
+        created_ids = {active.order_id for active in load_orders().values()}
+        for order_id, entry in claimed.items():
+            order = PaidOrder.from_dict(entry.get("order", {}))
+            if order_id not in open_ids or order_id in created_ids:
+                # Заказ уже создан, отложен или возвращен до перезапуска
+                cls._persist(order, None)
+            elif entry.get("stage") == "creating":
+                # Запрос создания мог дойти до панели: повторять его нельзя
+                if DeferredSubmissions.hold(c, order, API_UNKNOWN_RESULT):
+                    cls._persist(order, None)
+                else:
+                    send_admin_alert(
+                        c, f"⚠️ Заказ #{order_id} мог быть создан до перезапуска, и его не удалось "
+                           f"сохранить для проверки. Проверьте панель {order.api_type} вручную."
+                    )
+            else:
+                logger.info(f"Заказ #{order_id} снова поставлен в очередь создания после перезапуска")
+                cls.submit(c, order, *order_api_credentials(order))
+    
+    @classmethod
+    def _run(cls) -> None:
+        while True:
+            with cls._cond:
+                while not cls._queue:
+                    cls._cond.wait()
+                c, order, api_url, api_key, queued_at = cls._queue.popleft()
+                # Панель запоминается: при создании заказ может уйти на другую
+                provider = order.api_type
+                cls._busy[provider] = cls._busy.get(provider, 0) + 1
+            Metrics.observe("autosmm_create_queue_wait_seconds", time.monotonic() - queued_at)
+            try:
+                cls._persist(order, "creating")
+                create_confirmed_order(c, order, api_url, api_key)
+            except Exception as e:
+                logger.error(f"Ошибка создания заказа #{order.order_id}: {e}", exc_info=True)
+            finally:
+                cls._persist(order, None)
+                with cls._cond:
+                    cls._busy[provider] -= 1
+                    cls._order_ids.discard(order.order_id)
+
+
+def confirm_order(c: Cardinal, chat_id: int, text: str, api_url: str, api_key: str) -> None:
+    """Подтверждение заказа"""
+    try:
+        if chat_id not in pending_confirmations:
+            logger.warning(f"Подтверждение для несуществующего заказа (chat_id: {chat_id})")
+            return
+        
+        order = pending_confirmations.pop(chat_id)
         
-        orders_data.append(current_order_data)
+        if text.strip() == "+":
+            OrderTrace.mark(order.order_id, "confirmed")
+            position = CreationQueue.submit(c, order, api_url, api_key)
+            if position is None:
+                # Повторное подтверждение: второй запрос создания купил бы заказ дважды
+                logger.info(f"Заказ #{order.order_id} уже в очереди на создание, повтор пропущен")
+                c.send_message(chat_id, "⏳ Этот заказ уже создается. Мы сообщим, как только он будет создан.")
+            elif position:
+                c.send_message(
+                    chat_id,
+                    f"⏳ Заказ подтвержден и стоит в очереди на создание: перед вами {position}. "
+                    f"Мы сообщим, как только он будет создан."
+                )
         
-        if save_payorders(orders_data):
-            logger.info(f"Заказ #{orderID} добавлен в список обработки")
-            handle_order(c, current_order_data, [])
-        else:
-            logger.error(f"Не удалось сохранить заказ #{orderID}")
+        elif text.strip() == "-":
+            c.send_message(chat_id, "❌ Заказ отменен.\n")
+            logger.info(f"Заказ #{order.order_id} отменен пользователем")
             
+            if RefundQueue.enqueue(c, order.order_id, "buyer_declined"):
+                remove_payorder(order.order_id, 'refunded')
+            else:
+                # Возврат не записан и не выполнен: заказ остается в списке оплаченных
+                send_admin_alert(c, f"⚠️ Не удалось вернуть средства за заказ #{order.order_id}, "
+                                    f"от которого отказался покупатель. Верните их вручную.")
+                
     except Exception as ex:
-        logger.error(f"Ошибка в order_handler: {ex}", exc_info=True)
+        logger.error(f"Критическая ошибка в confirm_order: {ex}", exc_info=True)
 
 
-logger.info(f"$MAGENTA{LOGGER_PREFIX} v{VERSION} успешно запущен.$RESET")
+# ====================
+# УВЕДОМЛЕНИЯ В TELEGRAM
+# ====================
+
+def get_order_charge(order: PaidOrder, smm_order_id: int, api_url: str, api_key: str) -> Optional[Tuple[float, str]]:
+    """Стоимость заказа SMM в валюте FunPay и исходная валюта сайта"""
+    status_info = SocTypeAPI.get_order_status(smm_order_id, api_url, api_key)
+    if not status_info:
+        logger.warning(f"Не удалось получить стоимость заказа {smm_order_id}")
+        return None
+    
+    try:
+        charge = float(status_info.get('charge', 0) or 0)
+    except (ValueError, TypeError):
+        charge = 0.0
+    currency = status_info.get('currency', 'USD')
+    fp_currency = order.currency
+    return convert_charge(charge, currency, fp_currency), currency
 
 
-def msg_hook(c: Cardinal, e: NewMessageEvent) -> None:
-    """Обработка сообщений"""
+def send_order_info(c: Cardinal, order: PaidOrder, smm_order_id: int, api_url: str, api_key: str,
+                    charge: Optional[Tuple[float, str]] = None) -> None:
+    """Уведомление о новом заказе"""
     try:
-        orders_data = load_payorders()
-        
-        msg = e.message
-        msgname = msg.chat_name
-        message_text = msg.text.strip() if msg.text else ""
+        fp_balance = c.get_balance()
         
-        # Проверка системных сообщений
-        if msg.type != MessageTypes.NON_SYSTEM:
+        # Получение данных о заказе из SMM
+        if charge is None:
+            charge = get_order_charge(order, smm_order_id, api_url, api_key)
+        if not charge:
+            logger.warning(f"Не удалось получить данные заказа {smm_order_id} для уведомления")
             return
         
-        # Игнорируем свои сообщения
-        if msg.author_id == c.account.id:
-            return
+        price_smm_order, currency = charge
+        fp_currency = order.currency
         
-        # Проверка на возврат средств
-        if "вернул деньги покупателю" in message_text:
-            order = find_order_by_buyer(orders_data, msgname)
-            if order:
-                try:
-                    orders_data.remove(order)
-                    save_payorders(orders_data)
-                    logger.info(f"Заказ отменен: {order.get('OrderID')}")
-                except Exception as e:
-                    logger.error(f"Ошибка при возврате: {e}")
-            return
+        # Получение баланса SMM
+        smm_balance_info = SocTypeAPI.get_balance(api_url, api_key)
+        balance, smm_currency = smm_balance_info if smm_balance_info else (0, currency)
+        if balance is None:
+            balance, smm_currency = 0, currency
         
-        # Поиск заказа по покупателю
-        order = find_order_by_buyer(orders_data, msgname)
+        # Расчет прибыли
+        sum_order = float(order.price or 0) - price_smm_order
+        sum_order_6com = sum_order * 0.94
+        sum_order_3com = sum_order * 0.97
         
-        # Получаем API данные
-        try:
-            api_key = get_api_key() if order and order.get('api_type') == 'API_1' else get_api_key(order.get('api_type') if order else None)
-            api_url = get_api_url() if order and order.get('api_type') == 'API_1' else get_api_url(order.get('api_type') if order else None)
-        except Exception as e:
-            logger.error(f"Ошибка получения API данных: {e}")
-            api_key = get_api_key()
-            api_url = get_api_url()
-        
-        # Обработка подтверждения
-        if msg.chat_id in pending_confirmations:
-            if message_text in ["+", "-"]:
-                confirm_order(c, msg.chat_id, message_text, api_url, api_key)
-            elif "http" in message_text:
-                order = pending_confirmations.get(msg.chat_id)
-                if order:
-                    order['chat_id'] = msg.chat_id
-                    links = extract_links(message_text)
-                    handle_order(c, order, links)
-            else:
-                c.send_message(msg.chat_id, "⚪️ Пожалуйста, отправьте +, если всё верно, или -, для возврата средств.")
-            return
+        order_info = (
+            f"✅ Создан заказ `{NAME}`: `{order.title or 'N/A'}`\n\n"
+            f"🙍‍♂️ Покупатель: `{order.buyer}`\n\n"
+            f"💵 Сумма заказа: `{order.price} {fp_currency}`\n"
+            f"💵 Потрачено: `{price_smm_order:.2f} {currency}`\n"
+            f"💵 Прибыль: `{sum_order:.2f}`\n"
+            f"💵 Прибыль с комиссией: `{sum_order_6com:.2f} (6%) / {sum_order_3com:.2f} (3%)`\n"
+            f"💰 Остаток на балансе: `{balance:.2f} {smm_currency}`\n"
+            f"💰 Баланс на FunPay: `{fp_balance.total_rub}₽, {fp_balance.available_usd}$, {fp_balance.total_eur}€`\n\n"
+            f"📇 ID заказа на FunPay: `{order.order_id}`\n"
+            f"🆔 ID заказа на сайте: `{smm_order_id}`\n"
+            f"🔍 Сервис ID: `{order.service_id}`\n"
+            f"🔢 Кол-во: `{order.amount}`\n"
+            f"🔗 Ссылка: {(order.url or 'N/A').replace('https://', '').replace('http://', '')}\n\n"
+        )
         
-        # Обработка заказа от покупателя
-        if order:
-            logger.info(f"Обработка сообщения от {msgname} для заказа #{order.get('OrderID')}")
-            order['chat_id'] = msg.chat_id
-            links = extract_links(message_text)
-            handle_order(c, order, links)
-        else:
-            logger.debug(f"Пользователь {msgname} не имеет активных заказов")
+        button = InlineKeyboardButton(
+            text="🌐 Открыть страницу заказа",
+            url=f"https://funpay.com/orders/{order.order_id}/"
+        )
+        keyboard = InlineKeyboardMarkup().add(button)
         
-        # Команды проверки статуса
-        command_parts = message_text.split()
+        users = load_authorized_users()
+        if not users:
+            logger.warning("Нет авторизованных пользователей для уведомления")
+            return
         
-        if len(command_parts) >= 2 and command_parts[0] == "#статус":
+        for user_id in users:
             try:
-                smm_order_id = command_parts[1]
-                status = SocTypeAPI.get_order_status(int(smm_order_id), api_url, api_key)
-                if status:
-                    start_count = status.get('start_count', 0)
-                    display_start_count = "*" if start_count == 0 else str(start_count)
-                    
-                    status_text = f"📈 Статус заказа: {smm_order_id}\n"
-                    status_text += f"⠀∟📊 Статус: {status.get('status', 'Unknown')}\n"
-                    status_text += f"⠀∟🔢 Было: {display_start_count}\n"
-                    status_text += f"⠀∟👀 Остаток выполнения: {status.get('remains', 'N/A')}"
-                    c.send_message(msg.chat_id, status_text)
-                else:
-                    c.send_message(msg.chat_id, "🔴 Не удалось получить статус заказа.")
+                c.telegram.bot.send_message(
+                    user_id,
+                    order_info,
+                    parse_mode='Markdown',
+                    reply_markup=keyboard,
+                    disable_web_page_preview=True
+                )
             except Exception as e:
-                logger.error(f"Ошибка получения статуса: {e}")
-                c.send_message(msg.chat_id, "🔴 Ошибка при получении статуса.")
+                logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+                
+    except Exception as e:
+        logger.error(f"Ошибка в send_order_info: {e}", exc_info=True)
+
+
+def send_order_error_info(c: Cardinal, text: str, order: PaidOrder) -> None:
+    """Уведомление об ошибке"""
+    try:
+        error_text = (
+            f"❌ Ошибка при создании заказа `{NAME} #{order.order_id}`: `{text}`\n\n"
+        )
+        
+        button = InlineKeyboardButton(
+            text="🌐 Открыть страницу заказа",
+            url=f"https://funpay.com/orders/{order.order_id}/"
+        )
+        keyboard = InlineKeyboardMarkup().add(button)
+        
+        users = load_authorized_users()
+        if not users:
+            return
         
-        elif len(command_parts) >= 2 and command_parts[0] == "#инфо":
+        for user_id in users:
             try:
-                smm_order_id = command_parts[1]
-                status = SocTypeAPI.get_order_status(int(smm_order_id), get_api_url('API_2'), get_api_key('API_2'))
-                if status:
-                    start_count = status.get('start_count', 0)
-                    display_start_count = "*" if start_count == 0 else str(start_count)
-                    
-                    status_text = f"📈 Статус заказа: {smm_order_id}\n"
-                    status_text += f"⠀∟📊 Статус: {status.get('status', 'Unknown')}\n"
-                    status_text += f"⠀∟🔢 Было: {display_start_count}\n"
-                    status_text += f"⠀∟👀 Остаток выполнения: {status.get('remains', 'N/A')}"
-                    c.send_message(msg.chat_id, status_text)
-                else:
-                    c.send_message(msg.chat_id, "🔴 Не удалось получить статус заказа.")
+                c.telegram.bot.send_message(
+                    user_id,
+                    error_text,
+                    parse_mode='Markdown',
+                    reply_markup=keyboard,
+                    disable_web_page_preview=True
+                )
             except Exception as e:
-                logger.error(f"Ошибка получения статуса (API 2): {e}")
-                c.send_message(msg.chat_id, "🔴 Ошибка при получении статуса.")
+                logger.error(f"Ошибка отправки уведомления об ошибке: {e}")
+                
+    except Exception as e:
+        logger.error(f"Ошибка в send_order_error_info: {e}")
+
+
+def send_admin_alert(c: Cardinal, text: str) -> None:
+    """Сообщение авторизованным пользователям без разметки"""
+    for user_id in load_authorized_users():
+        try:
+            c.telegram.bot.send_message(user_id, text, disable_web_page_preview=True)
+        except Exception as e:
+            logger.error(f"Ошибка отправки уведомления администратору: {e}")
+
+
+def send_smm_balance_info(c: Cardinal) -> None:
+    """Уведомление о балансе"""
+    try:
+        fp_balance = c.get_balance()
+        
+        text_balance = ""
+        for name in SettingsCache.providers():
+            api_url, api_key = SettingsCache.credentials(name)
+            ProviderCache.refresh_balance(api_url, api_key)
+            balance, currency, _ = ProviderCache.get_balance(api_url)
+            host = api_url.replace('https://', '').replace('/api/v2/', '').replace('/api/v2', '')
+            text_balance += f"💰 Баланс {host}: `{balance or 0:.2f} {currency or 'N/A'}`\n"
+        text_balance += f"💰 Баланс на FunPay: `{fp_balance.total_rub}₽, {fp_balance.available_usd}$, {fp_balance.total_eur}€`"
         
-        elif len(command_parts) >= 2 and command_parts[0] == "#рефилл":
+        users = load_authorized_users()
+        if not users:
+            return
+        
+        for user_id in users:
             try:
-                smm_order_id = command_parts[1]
-                refill_result = SocTypeAPI.refill_order(int(smm_order_id), api_url, api_key)
-                if refill_result is not None:
-                    c.send_message(msg.chat_id, f"✅ Запрос на рефилл отправлен!")
-                else:
-                    c.send_message(msg.chat_id, f"🔴 Ошибка при выполнении рефилла.\n⚠️ Возможно, рефилл еще недоступен!")
+                c.telegram.bot.send_message(
+                    user_id,
+                    text_balance,
+                    parse_mode='Markdown'
+                )
             except Exception as e:
-                logger.error(f"Ошибка рефилла: {e}")
-                c.send_message(msg.chat_id, "🔴 Ошибка при выполнении рефилла.")
+                logger.error(f"Ошибка отправки баланса: {e}")
                 
-    except Exception as ex:
-        logger.error(f"Критическая ошибка в msg_hook: {ex}", exc_info=True)
+    except Exception as e:
+        logger.error(f"Ошибка в send_smm_balance_info: {e}")
 
 
-def handle_order(c: Cardinal, order: Dict, links: List[str]) -> None:
-    """Обработка заказа с ссылкой"""
+def send_smm_start_info(c: Cardinal) -> None:
+    """Уведомление при старте"""
     try:
-        settings = SettingsCache.get_settings()
+        text_start = (
+            f"✅ Авто-накрутка инициализирована!\n\n"
+            f"ℹ️ Версия: `{VERSION}`\n"
+            f"⚙️ Настройки: /autosmm\n\n"
+            f"*ℹ️ Авто-накрутка by @klaymov (improved)*"
+        )
         
-        if links:
-            link = links[0]
-            orders_data = load_payorders()
+        users = load_authorized_users()
+        if not users:
+            return
+        
+        for user_id in users:
+            try:
+                c.telegram.bot.send_message(
+                    user_id,
+                    text_start,
+                    parse_mode='Markdown'
+                )
+            except Exception as e:
+                logger.error(f"Ошибка отправки стартового сообщения: {e}")
+                
+    except Exception as e:
+        logger.error(f"Ошибка в send_smm_start_info: {e}")
+
+
+# ====================
+# ЧЕКЕР ЗАКАЗОВ
+# ====================
+
+# Статусы панели, при которых заказ уже начал выполняться
+STARTED_STATUSES = frozenset({"In progress", "Processing", "Completed", "Partial"})
+
+
+def format_eta(seconds: float) -> str:
+    """Грубая длительность для покупателя"""
+    if seconds < 60:
+        return "меньше минуты"
+    if seconds < 3600:
+        return f"{max(1, round(seconds / 60))} мин"
+    if seconds < 86400:
+        hours = seconds / 3600
+        return f"{hours:.1f} ч".replace(".0 ч", " ч") if hours < 10 else f"{round(hours)} ч"
+    return f"{seconds / 86400:.1f} дн".replace(".0 дн", " дн")
+
+
+class ServiceTiming:
+    """Время до старта, время выполнения и скорость заказов по услугам панелей.
+    
+    Для выполненного заказа чекер по своим наблюдениям статуса оценивает
+    время до старта, полное время и скорость в единицах в час. Наблюдения
+    копятся в компактных гистограммах eta.json по ключу "панель:услуга";
+    при MAX_SAMPLES наблюдений счетчики делятся пополам, поэтому оценки
+    следуют за изменениями панели. По ним покупателю сообщается срок,
+    медленные заказы отмечаются, а чекер реже проверяет долгие заказы.
+    """
+    SECONDS_BUCKETS = (60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400, 28800, 57600, 86400, 172800, 345600)
+    SPEED_BUCKETS = (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000, 300000, 1000000)
+    MIN_SAMPLES = 5
+    MAX_SAMPLES = 500
+    POLL_MAX_FACTOR = 10  # пауза между проверками - не больше стольких check_interval
+    
+    _data = None
+    _version = None
+    _pending: List[Tuple[str, str, float]] = []
+    _lock = threading.Lock()
+    
+    @staticmethod
+    def key(provider: str, service_id: Any) -> str:
+        return f"{provider or 'API_1'}:{service_id}"
+    
+    @classmethod
+    def _load(cls) -> Dict:
+        if cls._data is None or file_version(ETA_FILE) != cls._version:
+            cls._data, cls._version = load_json_versioned(ETA_FILE, {}, 'eta')
+        return cls._data
+    
+    @classmethod
+    def _bounds(cls, name: str) -> Tuple:
+        return cls.SPEED_BUCKETS if name == "speed" else cls.SECONDS_BUCKETS
+    
+    @classmethod
+    def quantile(cls, name: str, counts: Optional[List[int]], q: float) -> Optional[float]:
+        """Квантиль с интерполяцией внутри корзины; None - мало наблюдений"""
+        total = sum(counts) if counts else 0
+        if total < cls.MIN_SAMPLES:
+            return None
+        bounds = cls._bounds(name)
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = bounds[i - 1] if i else 0
+                upper = bounds[i] if i < len(bounds) else bounds[-1] * 2
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return float(bounds[-1])
+    
+    @classmethod
+    def observe(cls, order: ActiveOrder, seen: Optional[float], started: Optional[float], done_at: float) -> None:
+        """Выполненный заказ; started - None, если заказ не застали в работе"""
+        if not seen:
+            return
+        key = cls.key(order.provider, order.service_id)
+        samples = [("complete", max(0.0, done_at - seen))]
+        if started is not None:
+            samples.append(("start", max(0.0, started - seen)))
+            samples.append(("speed", order.amount / max(done_at - started, 1.0) * 3600))
+        with cls._lock:
+            cls._pending.extend((key, name, value) for name, value in samples)
+    
+    @classmethod
+    def flush(cls) -> None:
+        """Запись накопленных наблюдений; вызывается в конце цикла чекера"""
+        with cls._lock:
+            pending, cls._pending = cls._pending, []
+        if not pending:
+            return
+        
+        def apply(data: Dict):
+            for key, name, value in pending:
+                bounds = cls._bounds(name)
+                counts = data.setdefault(key, {}).setdefault(name, [0] * (len(bounds) + 1))
+                counts[next((i for i, bound in enumerate(bounds) if value <= bound), len(bounds))] += 1
+                if sum(counts) >= cls.MAX_SAMPLES:
+                    counts[:] = [count // 2 for count in counts]
+        
+        if update_json_safe(ETA_FILE, {}, 'eta', apply, compact=True) is None:
+            logger.warning(f"Не удалось сохранить статистику сроков ({len(pending)} наблюдений)")
+        cls._data = None
+    
+    @classmethod
+    def estimate(cls, provider: str, service_id: Any, amount: int, status: Optional[str] = None,
+                 remains: Optional[int] = None, elapsed: float = 0.0) -> Optional[Tuple[float, float, float]]:
+        """Оставшееся время в секундах: (быстро, обычно, p95); None - мало наблюдений"""
+        stats = cls._load().get(cls.key(provider, service_id)) or {}
+        started = status in STARTED_STATUSES
+        units = remains if started and remains is not None else amount
+        
+        result = []
+        for q in (0.1, 0.5, 0.95):
+            # Медленный заказ - поздний старт и низкая скорость
+            speed = cls.quantile("speed", stats.get("speed"), 1 - q)
+            start = 0.0 if started else cls.quantile("start", stats.get("start"), q)
+            if speed is not None and start is not None:
+                result.append(max(0.0, start - elapsed) + units / max(speed, 1e-6) * 3600)
+                continue
+            complete = cls.quantile("complete", stats.get("complete"), q)
+            if complete is None:
+                return None
+            result.append(max(0.0, complete - elapsed))
+        return result[0], result[1], result[2]
+    
+    @classmethod
+    def format(cls, provider: str, service_id: Any, amount: int, **kwargs) -> Optional[str]:
+        """Срок для покупателя, None - мало наблюдений"""
+        estimate = cls.estimate(provider, service_id, amount, **kwargs)
+        if estimate is None:
+            return None
+        _, typical, slow = estimate
+        if format_eta(typical) == format_eta(slow):
+            return f"около {format_eta(typical)}"
+        return f"обычно {format_eta(typical)}, не дольше {format_eta(slow)}"
+    
+    @classmethod
+    def poll_delay(cls, order: ActiveOrder, entry: Dict, status: str, remains: int, now: float,
+                   interval: float) -> float:
+        """Пауза до следующей проверки: половина оптимистичной оценки остатка"""
+        started = entry.get("started")
+        if status in STARTED_STATUSES and started and order.amount > remains and now > started:
+            # Собственная скорость заказа точнее статистики услуги
+            left = remains / ((order.amount - remains) / (now - started))
+        else:
+            estimate = cls.estimate(order.provider, order.service_id, order.amount, status, remains,
+                                    now - entry.get("seen", now))
+            if estimate is None:
+                return interval
+            left = estimate[0]
+        return min(max(interval, left / 2), interval * cls.POLL_MAX_FACTOR)
+    
+    @classmethod
+    def is_slow(cls, order: ActiveOrder, entry: Dict, now: float) -> bool:
+        """Заказ выполняется дольше p95 услуги для своего объема"""
+        seen = entry.get("seen")
+        if not seen:
+            return False
+        estimate = cls.estimate(order.provider, order.service_id, order.amount)
+        return estimate is not None and now - seen > estimate[2]
+
+
+class CheckerSchedule:
+    """Расписание проверок чекера, переживающее перезапуск.
+    
+    Для каждого заказа хранится время последней и следующей проверки и
+    последний статус. После перезапуска просроченные проверки
+    распределяются по окну прогрева: сначала заказы, которые вероятнее
+    всего уже выполнены.
+    """
+    _state = None
+    _warmed = False
+    _dirty = False
+    _lock = threading.Lock()
+    
+    @classmethod
+    def _load(cls) -> Dict:
+        if cls._state is None:
+            cls._state = load_json_safe(CHECKER_STATE_FILE, {}, 'checker_state')
+        return cls._state
+    
+    @classmethod
+    def invalidate(cls) -> None:
+        """Сброс расписания: перечитать файл и заново пройти прогрев"""
+        with cls._lock:
+            cls._state = None
+            cls._warmed = False
+            cls._dirty = False
+    
+    @staticmethod
+    def _finish_likelihood(entry: Optional[Dict], order: ActiveOrder, now: float, interval: float) -> float:
+        """Оценка вероятности, что заказ уже выполнен"""
+        if not entry:
+            return 0.5
+        
+        progress = 0.0
+        amount = order.amount
+        if entry.get("status") == "In progress" and amount > 0 and entry.get("remains") is not None:
+            progress = 1 - min(int(entry["remains"]), amount) / amount
+        overdue = max(0.0, now - entry.get("next", now)) / max(interval, 1)
+        return progress + overdue
+    
+    @classmethod
+    def _warm_up(cls, orders: Dict, now: float, interval: float, window: float) -> None:
+        state = cls._load()
+        overdue = [
+            order_id for order_id in orders
+            if order_id not in state or state[order_id].get("next", 0) <= now
+        ]
+        overdue.sort(key=lambda oid: cls._finish_likelihood(state.get(oid), orders[oid], now, interval), reverse=True)
+        
+        step = window / len(overdue) if overdue else 0
+        for index, order_id in enumerate(overdue):
+            entry = state.setdefault(order_id, {})
+            entry["next"] = round(now + index * step, 3)
+        cls._dirty = bool(overdue)
+        
+        if overdue:
+            logger.info(f"Прогрев чекера: {len(overdue)} просроченных проверок распределено на {window} сек")
+    
+    @classmethod
+    def due(cls, orders: Dict, now: float, interval: float, window: float) -> List[str]:
+        """Заказы, срок проверки которых наступил"""
+        with cls._lock:
+            state = cls._load()
+            if not cls._warmed:
+                cls._warm_up(orders, now, interval, window)
+                cls._warmed = True
             
-            # Валидация Telegram ссылки
-            allow_private = settings.get("set_tg_private", False)
-            is_valid, error = validate_telegram_link(link, allow_private)
+            result = []
+            for order_id in orders:
+                entry = state.get(order_id)
+                if entry is None:
+                    # Новый заказ: первая проверка через интервал после создания
+                    state[order_id] = {"next": round(now + interval, 3), "seen": round(now, 3)}
+                    cls._dirty = True
+                elif entry.get("next", 0) <= now:
+                    result.append(order_id)
             
-            if not is_valid:
-                c.send_message(order['chat_id'], f"❌ {error}")
+            result.sort(key=lambda oid: state[oid].get("next", 0))
+            return result
+    
+    @classmethod
+    def record(cls, order_id: str, status: Optional[str], remains: Optional[int], interval: float,
+               order: Optional[ActiveOrder] = None) -> None:
+        """Запоминание результата проверки и планирование следующей.
+        
+        С order наблюдение учитывается в ServiceTiming: момент старта и
+        завершения - середина между предыдущей и этой проверкой.
+        """
+        now = time.time()
+        with cls._lock:
+            entry = cls._load().setdefault(order_id, {})
+            delay = interval
+            if status is not None and order is not None:
+                observed = (entry.get("last", entry.get("seen", now)) + now) / 2
+                started = entry.get("started")
+                if status in STARTED_STATUSES and started is None:
+                    entry["started"] = round(observed, 3)
+                if status == "Completed":
+                    ServiceTiming.observe(order, entry.get("seen"), started, observed)
+                elif status in STARTED_STATUSES or status.lower() == "pending":
+                    delay = ServiceTiming.poll_delay(order, entry, status, remains or 0, now, interval)
+                    if not entry.get("slow") and ServiceTiming.is_slow(order, entry, now):
+                        entry["slow"] = True
+                        Metrics.inc("autosmm_orders_slow_total", provider=order.provider or "API_1")
+                        logger.warning(f"Заказ {order_id} (услуга {order.service_id}) выполняется дольше обычного")
+            entry["last"] = round(now, 3)
+            entry["next"] = round(now + delay, 3)
+            if status is not None:
+                entry["status"] = status
+                entry["remains"] = remains
+            cls._dirty = True
+    
+    @classmethod
+    def entry(cls, order_id: str) -> Dict:
+        with cls._lock:
+            return dict(cls._load().get(order_id) or {})
+    
+    @classmethod
+    def slow_orders(cls) -> List[str]:
+        """Активные заказы, выполняющиеся дольше p95 своей услуги"""
+        with cls._lock:
+            return [order_id for order_id, entry in cls._load().items() if entry.get("slow")]
+    
+    @classmethod
+    def reschedule(cls, interval: float) -> None:
+        """Подтягивание запланированных проверок к новому интервалу"""
+        limit = round(time.time() + interval, 3)
+        with cls._lock:
+            for entry in cls._load().values():
+                if entry.get("next", 0) > limit:
+                    entry["next"] = limit
+                    cls._dirty = True
+    
+    @classmethod
+    def expedite(cls, order_ids) -> None:
+        """Проверить заказы в ближайшем цикле"""
+        now = round(time.time(), 3)
+        with cls._lock:
+            state = cls._load()
+            for order_id in order_ids:
+                state.setdefault(order_id, {})["next"] = now
+                cls._dirty = True
+    
+    @classmethod
+    def forget(cls, order_ids) -> None:
+        with cls._lock:
+            state = cls._load()
+            for order_id in order_ids:
+                if state.pop(order_id, None) is not None:
+                    cls._dirty = True
+    
+    @classmethod
+    def save(cls, orders: Dict) -> None:
+        """Сохранение расписания, записи удаленных заказов отбрасываются"""
+        with cls._lock:
+            state = cls._load()
+            for order_id in [oid for oid in state if oid not in orders]:
+                del state[order_id]
+                cls._dirty = True
+            if not cls._dirty:
                 return
-            
-            order['url'] = link
-            link_display = link.replace("https://", "").replace("http://", "")
-            
-            confirmation_text = f"""📋 Пожалуйста, проверьте детали вашего заказа:
-🛒 Лот: {order.get('Order', 'N/A')}
-🔢 Количество: {order.get('Amount', 'N/A')} шт
-🔗 Ссылка: {link_display}
+            snapshot = {oid: dict(entry) for oid, entry in state.items()}
+            cls._dirty = False
+        save_json_safe(CHECKER_STATE_FILE, snapshot, 'checker_state', compact=True)
+
+
+def checkbox(cardinal: Cardinal):
+    """Запуск чекера под наблюдением супервизора"""
+    settings = SettingsCache.get_settings()
+    if settings.get("metrics_port"):
+        MetricsServer.start(settings.get("metrics_host", "127.0.0.1"), settings.get("metrics_port"))
+    
+    try:
+        CheckerSupervisor.start(cardinal)
+        logger.info("Чекер заказов запущен")
+    except Exception as e:
+        logger.error(f"Ошибка запуска чекера: {e}")
 
-✅ Если всё верно, отправьте: +
-❌ Для возврата средств, отправьте: -
-🔄 Или отправьте новую ссылку для обновления."""
-            
-            c.send_message(order['chat_id'], confirmation_text)
-            pending_confirmations[order['chat_id']] = order
-            
-            # Обновляем заказ в списке
-            existing_order = next((o for o in orders_data if o.get('OrderID') == order.get('OrderID')), None)
+
+def shutdown(cardinal: Cardinal = None, *args) -> None:
+    """Остановка чекера и сохранение данных при выгрузке плагина"""
+    CheckerSupervisor.stop()
+    LogPipeline.stop()
+
+
+def check_orders_cycle(c: Cardinal, generation: Optional[int] = None) -> None:
+    """Один проход проверки заказов, срок проверки которых наступил.
+    
+    generation - поколение потока чекера: отстраненный перезапуском поток
+    перестает действовать по заказам и только сохраняет уже сделанное.
+    """
+    if not SettingsCache.providers():
+        logger.warning("API не настроен, пропускаем проверку")
+        return
+    
+    settings = SettingsCache.get_settings()
+    check_interval = settings.get("check_interval", 60)
+    
+    def check_order_status(order_id: str, order: ActiveOrder) -> Optional[dict]:
+        """Проверка статуса одного заказа на его панели"""
+        api_url, api_key = SettingsCache.credentials(order.provider)
+        if not api_url or not api_key:
+            return None
+        try:
+            return SocTypeAPI.get_order_status(int(order_id), api_url, api_key)
+        except Exception as e:
+            logger.error(f"Ошибка проверки статуса заказа {order_id}: {e}", extra=log_fields("check", order_id))
+            return None
+    
+    def send_completion_message(c: Cardinal, order_id: str, order: ActiveOrder):
+        """Отправка сообщения о завершении"""
+        try:
+            if not order.chat_id:
+                logger.warning(f"Нет chat_id для заказа {order_id}")
+                return
             
-            if existing_order:
-                existing_order.update(order)
-            else:
-                orders_data.append(order)
+            message_text = (
+                f"✅ Заказ #{order.order_id} выполнен!\n"
+                f"Пожалуйста, перейдите по ссылке https://funpay.com/orders/{order.order_id}/ "
+                f"и нажмите кнопку «Подтвердить выполнение заказа»."
+            )
+            c.send_message(order.chat_id, message_text)
+            OrderTrace.mark(order.order_id, "notified")
+            logger.info(f"Отправлено уведомление о завершении заказа {order_id}",
+                        extra=log_fields("completed", order_id, order.provider or None))
+        except Exception as e:
+            logger.error(f"Ошибка отправки уведомления о завершении: {e}")
+    
+    def send_canceled_message(c: Cardinal, order_id: str, order: ActiveOrder):
+        """Отправка сообщения об отмене"""
+        try:
+            if not order.chat_id:
+                return
             
-            save_payorders(orders_data)
-            logger.info(f"Заказ #{order.get('OrderID')} обновлен с URL")
+            message_text = f"❌ Заказ #{order.order_id} отменён!"
+            c.send_message(order.chat_id, message_text)
             
-    except Exception as ex:
-        logger.error(f"Ошибка в handle_order: {ex}", exc_info=True)
-
-
-def confirm_order(c: Cardinal, chat_id: int, text: str, api_url: str, api_key: str) -> None:
-    """Подтверждение заказа"""
-    try:
-        orders_data = load_payorders()
-        settings = SettingsCache.get_settings()
-        
-        if chat_id not in pending_confirmations:
-            logger.warning(f"Подтверждение для несуществующего заказа (chat_id: {chat_id})")
-            return
-        
-        order = pending_confirmations.pop(chat_id)
-        
-        if text.strip() == "+":
-            logger.info(f"Создание заказа в SMM для #{order.get('OrderID')}")
+            # Возврат средств в фоне, учет в статистике - после выполнения
+            if not RefundQueue.enqueue(c, order.order_id, "provider_canceled", order_id):
+                send_admin_alert(c, f"⚠️ Не удалось вернуть средства за отмененный панелью заказ "
+                                    f"#{order.order_id} ({order_id}). Верните их вручную.")
+                
+        except Exception as e:
+            logger.error(f"Ошибка отправки уведомления об отмене: {e}")
+    
+    def send_partial_message(c: Cardinal, order_id: str, order: ActiveOrder):
+        """Обработка частично выполненного заказа"""
+        try:
+            partial_amount = order.remains
             
-            try:
-                smm_order_id = SocTypeAPI.create_order(
-                    order['service_id'],
-                    order['url'],
-                    order['Amount'],
-                    api_url,
-                    api_key
-                )
-            except Exception as e:
-                logger.error(f"Исключение при создании заказа в SMM: {e}", exc_info=True)
-                smm_order_id = f"Ошибка: {str(e)}"
+            if partial_amount <= 0:
+                logger.warning(f"Некорректное partial_amount для заказа {order_id}")
+                return
             
-            # Проверка успешности создания
-            if isinstance(smm_order_id, (int, str)) and str(smm_order_id).isdigit():
+            # Пересоздание заказа если включено
+            if settings.get("set_recreated_order", False):
                 try:
-                    orders = load_orders()
-                    orders[str(smm_order_id)] = {
-                        "service_id": order['service_id'],
-                        "chat_id": order['chat_id'],
-                        "order_id": order['OrderID'],
-                        "order_url": order['url'],
-                        "order_amount": order['Amount'],
-                        "partial_amount": 0,
-                        "orderdatetime": order['OrderDateTime'],
-                        "status": "pending"
-                    }
-                    save_orders(orders)
-                    
-                    # Уведомление об успехе
-                    if settings.get("set_alert_neworder", False):
-                        try:
-                            send_order_info(c, order, int(smm_order_id), api_url, api_key)
-                        except Exception as e:
-                            logger.error(f"Ошибка отправки уведомления: {e}")
-                    
-                    status_cmd = 'статус' if order.get('api_type') == 'API_1' else 'инфо'
-                    success_message = f"""📊 Ваш заказ СОЗДАН и отправлен SMM сервису!
-🆔 ID заказа: {smm_order_id}
-
-📋 Доступные команды:
-⠀∟📗 Узнать статус заказа: #{status_cmd} {smm_order_id}
-⠀∟📙 Рефилл (если доступно): #рефилл {smm_order_id}
-
-⌛ Время выполнения: от нескольких минут до 48 часов. В редких случаях возможны задержки."""
-                    
-                    c.send_message(order['chat_id'], success_message)
-                    logger.info(f"Заказ #{order.get('OrderID')} успешно создан в SMM: {smm_order_id}")
+                    api_url, api_key = SettingsCache.credentials(order.provider)
+                    smm_order_id = ProviderGate.create_order(
+                        order.provider or "API_1",
+                        order.service_id,
+                        order.url,
+                        partial_amount,
+                        api_url,
+                        api_key
+                    )
                     
+                    if isinstance(smm_order_id, (int, str)) and str(smm_order_id).isdigit():
+                        recreated = ActiveOrder(
+                            order.service_id, order.chat_id, order.order_id, order.url,
+                            partial_amount, 0, order.created_at, "new", order.provider
+                        )
+                        update_orders(lambda orders: orders.__setitem__(str(smm_order_id), recreated))
+                        
+                        SalesStats.record_recreated(order_id, smm_order_id)
+                        
+                        message = f"""📈 Ваш заказ #{order.order_id} был пересоздан!
+🆔 Новый ID заказа: {smm_order_id}
+⏳ Остаток выполнения: {partial_amount}"""
+                        c.send_message(order.chat_id, message)
+                        logger.info(f"Заказ {order_id} пересоздан как {smm_order_id}")
                 except Exception as e:
-                    logger.error(f"Ошибка сохранения заказа: {e}", exc_info=True)
+                    logger.error(f"Ошибка пересоздания заказа: {e}")
             else:
-                # Ошибка создания заказа
-                error_message = f"❌ Ошибка при создании заказа: {smm_order_id}"
-                c.send_message(order['chat_id'], error_message)
-                logger.error(f"Не удалось создать заказ #{order.get('OrderID')}: {smm_order_id}")
+                message = f"""🔴 Заказ #{order.order_id} был приостановлен!
+⏳ Остаток выполнения: {partial_amount}"""
+                c.send_message(order.chat_id, message)
                 
-                # Уведомление об ошибке
-                if settings.get("set_alert_errororder", False):
-                    try:
-                        send_order_error_info(c, smm_order_id, order)
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки уведомления об ошибке: {e}")
+        except Exception as e:
+            logger.error(f"Ошибка обработки Partial заказа: {e}")
+    
+    # Проверяем только заказы, срок проверки которых наступил
+    orders = load_orders()
+    due = CheckerSchedule.due(orders, time.time(), check_interval, settings.get("checker_warmup_window", 120))
+    if due:
+        logger.info("Проверка статусов заказов: %d из %d...", len(due), len(orders),
+                    extra=log_fields("check", sample=True))
+    
+    changed = {}
+    finished = set()
+    
+    for order_id in due:
+        if not CheckerSupervisor.is_current(generation):
+            break
+        order = orders[order_id]
+        try:
+            order_status = check_order_status(order_id, order)
+            # Пока поток ждал панель, его могли заменить: уведомлять и пересоздавать будет новый
+            if not CheckerSupervisor.is_current(generation):
+                break
+            
+            if order_status:
+                status = order_status.get("status", "unknown")
+                remains = int(order_status.get("remains", 0))
+                OrderTrace.mark(order.order_id, "first_status")
                 
-                # Уведомление о балансе
-                if settings.get("set_alert_smmbalance", False):
-                    try:
-                        send_smm_balance_info(c)
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки баланса: {e}")
+                if status != order.status or remains != order.remains:
+                    order.apply_status(status, remains)
+                    changed[order_id] = (status, remains)
                 
-                # Автовозврат
-                if settings.get("set_refund_smm", False):
-                    try:
-                        c.account.refund(order['OrderID'])
-                        logger.info(f"Выполнен автовозврат для заказа #{order.get('OrderID')}")
-                    except Exception as e:
-                        logger.error(f"Ошибка автовозврата: {e}")
-        
-        elif text.strip() == "-":
-            c.send_message(chat_id, "❌ Заказ отменен.\n")
-            logger.info(f"Заказ #{order.get('OrderID')} отменен пользователем")
-            
-            try:
-                c.account.refund(order['OrderID'])
-            except Exception as e:
-                logger.error(f"Ошибка возврата средств: {e}")
-            
-            try:
-                orders_data.remove(order)
-                save_payorders(orders_data)
-            except Exception as e:
-                logger.error(f"Ошибка удаления заказа из списка: {e}")
+                # Сортировка по статусам
+                if status == "Completed":
+                    Metrics.inc("autosmm_orders_completed_total")
+                    OrderTrace.mark(order.order_id, "completed")
+                    finished.add(order_id)
+                    send_completion_message(c, order_id, order)
+                elif status == "Canceled":
+                    OrderTrace.mark(order.order_id, "canceled")
+                    finished.add(order_id)
+                    send_canceled_message(c, order_id, order)
+                elif status == "Partial":
+                    finished.add(order_id)
+                    send_partial_message(c, order_id, order)
                 
-    except Exception as ex:
-        logger.error(f"Критическая ошибка в confirm_order: {ex}", exc_info=True)
-
-
-# ====================
-# УВЕДОМЛЕНИЯ В TELEGRAM
-# ====================
-
-def send_order_info(c: Cardinal, order: Dict, smm_order_id: int, api_url: str, api_key: str) -> None:
-    """Уведомление о новом заказе"""
-    try:
-        def getcoingaterate(fromcurrency='USD', tocurrency='RUB'):
-            try:
-                url = f'https://api.coingate.com/v2/rates/merchant/{fromcurrency}/{tocurrency}'
-                response = requests.get(url, timeout=10)
-                response.raise_for_status()
-                return float(response.text)
-            except Exception as e:
-                logger.error(f"Ошибка получения курса валют: {e}")
-                return 1.0
-        
-        fp_balance = c.get_balance()
-        
-        # Получение данных о заказе из SMM
-        status_info = SocTypeAPI.get_order_status(smm_order_id, api_url, api_key)
-        if not status_info:
-            logger.warning(f"Не удалось получить данные заказа {smm_order_id} для уведомления")
-            return
-        
-        price_smm_order = float(status_info.get('charge', 0))
-        currency = status_info.get('currency', 'USD')
+                if status in ("Completed", "Partial"):
+                    SalesStats.record_completed(
+                        order_id, order_status.get("charge"), order_status.get("currency", "USD")
+                    )
+                
+                CheckerSchedule.record(order_id, status, remains, check_interval, order)
+            else:
+                # Статус не получен, повторим через интервал
+                CheckerSchedule.record(order_id, None, None, check_interval)
+                
+        except Exception as e:
+            logger.error(f"Ошибка обработки заказа {order_id}: {e}", extra=log_fields("check", order_id))
+            CheckerSchedule.record(order_id, None, None, check_interval)
+    
+    # Заказы из кэшлиста прошлых версий переносятся в общий список
+    cashlist = load_cashlist() if os.path.exists(CASHLIST_FILE) else {}
+    
+    # Изменения накладываются на свежую версию файла, чтобы не потерять
+    # заказы, созданные во время проверки; без изменений файл не пишется
+    if changed or finished or cashlist:
+        def apply_changes(current: Dict[str, ActiveOrder]) -> None:
+            for order_id, (status, remains) in changed.items():
+                if order_id in current:
+                    current[order_id].apply_status(status, remains)
+            for order_id in finished:
+                current.pop(order_id, None)
+            for order_id, data in cashlist.items():
+                current.setdefault(order_id, ActiveOrder.from_dict(data))
         
-        # Получение баланса SMM
-        smm_balance_info = SocTypeAPI.get_balance(api_url, api_key)
-        balance, smm_currency = smm_balance_info if smm_balance_info else (0, currency)
+        orders = update_orders(apply_changes)
         
-        # Конвертация валют
-        fp_currency = order.get('OrderCurrency', '₽')
-        if fp_currency == '₽':
-            if currency == 'USD':
-                price_smm_order = price_smm_order * getcoingaterate('USD', 'RUB')
-        elif fp_currency == '$':
-            if currency == 'RUB':
-                price_smm_order = price_smm_order * getcoingaterate('RUB', 'USD')
+        if cashlist:
+            os.remove(CASHLIST_FILE)
+    
+    CheckerSchedule.forget(finished)
+    CheckerSchedule.save(orders)
+    ServiceTiming.flush()
+    Metrics.set_gauge("autosmm_active_orders", len(orders))
+    OrderTrace.flush()
+    if due:
+        logger.info("Проверка завершена. Активных заказов: %d", len(orders),
+                    extra=log_fields("check", sample=True))
+
+
+def process_orders(c: Cardinal, stop: threading.Event = None, generation: int = None):
+    """Проверка статусов заказов до сигнала остановки"""
+    stop = stop or threading.Event()
+    next_run = time.time()
+    interval = SettingsCache.get_settings().get("check_interval", 60)
+    
+    while not stop.is_set() and CheckerSupervisor.is_current(generation):
+        # Интервал подхватывается на лету, расписание подтягивается к новому значению
+        new_interval = SettingsCache.get_settings().get("check_interval", 60)
+        if new_interval != interval:
+            logger.info(f"Интервал проверки изменен: {interval} -> {new_interval} сек")
+            CheckerSchedule.reschedule(new_interval)
+            interval = new_interval
         
-        # Расчет прибыли
-        sum_order = float(order.get('OrderPrice', 0)) - price_smm_order
-        sum_order_6com = sum_order * 0.94
-        sum_order_3com = sum_order * 0.97
+        # Заказы проверяет только один процесс на хранилище, остальные ждут в резерве
+        if not CheckerSupervisor.lead():
+            CheckerSupervisor.beat(time.time(), busy=False)
+            next_run = time.time() + CHECKER_TICK
+            CheckerSupervisor.wait(CHECKER_TICK)
+            continue
         
-        order_info = (
-            f"✅ Создан заказ `{NAME}`: `{order.get('Order', 'N/A')}`\n\n"
-            f"🙍‍♂️ Покупатель: `{order.get('buyer', 'N/A')}`\n\n"
-            f"💵 Сумма заказа: `{order.get('OrderPrice', 0)} {fp_currency}`\n"
-            f"💵 Потрачено: `{price_smm_order:.2f} {currency}`\n"
-            f"💵 Прибыль: `{sum_order:.2f}`\n"
-            f"💵 Прибыль с комиссией: `{sum_order_6com:.2f} (6%) / {sum_order_3com:.2f} (3%)`\n"
-            f"💰 Остаток на балансе: `{balance:.2f} {smm_currency}`\n"
-            f"💰 Баланс на FunPay: `{fp_balance.total_rub}₽, {fp_balance.available_usd}$, {fp_balance.total_eur}€`\n\n"
-            f"📇 ID заказа на FunPay: `{order.get('OrderID', 'N/A')}`\n"
-            f"🆔 ID заказа на сайте: `{smm_order_id}`\n"
-            f"🔍 Сервис ID: `{order.get('service_id', 'N/A')}`\n"
-            f"🔢 Кол-во: `{order.get('Amount', 'N/A')}`\n"
-            f"🔗 Ссылка: {order.get('url', 'N/A').replace('https://', '').replace('http://', '')}\n\n"
-        )
+        # Отстраненный поток может еще доделывать свой цикл: новый ждет его, а не идет параллельно
+        if not CheckerSupervisor._cycle_lock.acquire(timeout=CHECKER_TICK):
+            CheckerSupervisor.beat(time.time(), busy=False)
+            continue
         
-        button = InlineKeyboardButton(
-            text="🌐 Открыть страницу заказа",
-            url=f"https://funpay.com/orders/{order.get('OrderID')}/"
-        )
-        keyboard = InlineKeyboardMarkup().add(button)
+        cycle_started = time.time()
+        CheckerSupervisor.beat(cycle_started, busy=True)
+        Metrics.set_gauge("autosmm_checker_lag_seconds", max(0.0, cycle_started - next_run))
+        try:
+            if CheckerSupervisor.is_current(generation):
+                Profiler.run("process_orders", check_orders_cycle, c, generation)
+        except Exception as e:
+            logger.error(f"Критическая ошибка в process_orders: {e}", exc_info=True)
+        try:
+            DeferredSubmissions.process(c, generation)
+        except Exception as e:
+            logger.error(f"Ошибка обработки отложенных заказов: {e}", exc_info=True)
+        finally:
+            CheckerSupervisor._cycle_lock.release()
+        Reconciler.schedule(c)
         
-        users = load_authorized_users()
-        if not users:
-            logger.warning("Нет авторизованных пользователей для уведомления")
-            return
+        finished = time.time()
+        CheckerSupervisor.beat(finished, busy=False, duration=finished - cycle_started)
+        Metrics.observe("autosmm_checker_cycle_seconds", finished - cycle_started)
+        Metrics.set_gauge("autosmm_checker_last_cycle_timestamp", finished)
         
-        for user_id in users:
-            try:
-                c.telegram.bot.send_message(
-                    user_id,
-                    order_info,
-                    parse_mode='Markdown',
-                    reply_markup=keyboard,
-                    disable_web_page_preview=True
-                )
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
-                
-    except Exception as e:
-        logger.error(f"Ошибка в send_order_info: {e}", exc_info=True)
+        # Заказы проверяются по расписанию, чекер просыпается чаще интервала
+        tick = min(interval, CHECKER_TICK)
+        next_run = finished + tick
+        CheckerSupervisor.wait(tick)
 
 
-def send_order_error_info(c: Cardinal, text: str, order: Dict) -> None:
-    """Уведомление об ошибке"""
-    try:
-        error_text = (
-            f"❌ Ошибка при создании заказа `{NAME} #{order.get('OrderID')}`: `{text}`\n\n"
-        )
-        
-        button = InlineKeyboardButton(
-            text="🌐 Открыть страницу заказа",
-            url=f"https://funpay.com/orders/{order.get('OrderID')}/"
-        )
-        keyboard = InlineKeyboardMarkup().add(button)
+class CheckerSupervisor:
+    """Жизненный цикл чекера: запуск, остановка, перезапуск и сторож.
+    
+    Сторож перезапускает чекер, если поток умер или цикл завис дольше
+    checker_stall_timeout. Зависший поток нельзя прервать, поэтому он
+    отстраняется по номеру поколения: проснувшись, он перестает действовать
+    по заказам, сохраняет сделанное и выходит. Новый поток начинает цикл
+    только после этого (_cycle_lock), поэтому два цикла не идут одновременно.
+    
+    Если хранилище общее для нескольких процессов FPC, циклы выполняет
+    только владелец блокировки лидера: иначе покупатели получали бы
+    уведомления о завершении заказа дважды.
+    """
+    _cardinal = None
+    _thread: Optional[threading.Thread] = None
+    _stop = threading.Event()
+    _wake = threading.Event()
+    _watchdog: Optional[threading.Thread] = None
+    _generation = 0
+    _enabled = False
+    _heartbeat = 0.0
+    _busy_since: Optional[float] = None
+    _last_duration: Optional[float] = None
+    _started_at: Optional[float] = None
+    _restarts = 0
+    _leader = InterProcessLock(f"{LOCKS_PATH}/checker_leader.lock")
+    _lock = threading.RLock()
+    _cycle_lock = threading.Lock()  # один цикл за раз, даже если отстраненный поток еще работает
+    
+    @classmethod
+    def start(cls, cardinal: Cardinal = None) -> bool:
+        """Запуск чекера, False если уже работает"""
+        with cls._lock:
+            if cardinal is not None:
+                cls._cardinal = cardinal
+            if cls.is_running():
+                return False
+            
+            cls._enabled = True
+            cls._generation += 1
+            cls._stop = threading.Event()
+            cls._wake.clear()
+            cls._busy_since = None
+            cls._heartbeat = cls._started_at = time.time()
+            cls._thread = threading.Thread(
+                target=process_orders, args=[cls._cardinal, cls._stop, cls._generation],
+                name=f"autosmm-checker-{cls._generation}", daemon=True
+            )
+            cls._thread.start()
+            Metrics.set_gauge("autosmm_checker_running", 1)
+            
+            if cls._watchdog is None or not cls._watchdog.is_alive():
+                cls._watchdog = threading.Thread(target=cls._watch, name="autosmm-checker-watchdog", daemon=True)
+                cls._watchdog.start()
+            return True
+    
+    @classmethod
+    def stop(cls, timeout: float = 10.0) -> bool:
+        """Остановка чекера с финальным сохранением, False если не запущен"""
+        with cls._lock:
+            was_running = cls._enabled
+            cls._enabled = False
+            cls._stop.set()
+            cls._wake.set()
+            thread = cls._thread
         
-        users = load_authorized_users()
-        if not users:
-            return
+        if thread is None:
+            return False
+        if thread is not threading.current_thread():
+            thread.join(timeout)
+            if thread.is_alive():
+                logger.warning(f"Чекер не остановился за {timeout} сек")
         
-        for user_id in users:
+        Metrics.set_gauge("autosmm_checker_running", 0)
+        cls._flush()
+        cls._resign()
+        if was_running:
+            logger.info("Чекер заказов остановлен")
+        return was_running
+    
+    @classmethod
+    def restart(cls, reason: str = "manual") -> None:
+        logger.info(f"Перезапуск чекера ({reason})")
+        with cls._lock:
+            cls._restarts += 1
+            Metrics.inc("autosmm_checker_restarts_total", reason=reason)
+            # Отстраняем текущий поток, даже если он завис внутри цикла
+            cls._generation += 1
+            cls._stop.set()
+            cls._wake.set()
+            cls._thread = None
+        cls.start()
+    
+    @classmethod
+    def is_running(cls) -> bool:
+        return cls._thread is not None and cls._thread.is_alive() and not cls._stop.is_set()
+    
+    @classmethod
+    def lead(cls) -> bool:
+        """Захват роли лидера без ожидания; True, если этот процесс проверяет заказы"""
+        with cls._lock:
+            if cls._leader.held:
+                return True
             try:
-                c.telegram.bot.send_message(
-                    user_id,
-                    error_text,
-                    parse_mode='Markdown',
-                    reply_markup=keyboard,
-                    disable_web_page_preview=True
-                )
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления об ошибке: {e}")
+                acquired = cls._leader.acquire(blocking=False)
+            except OSError as e:
+                logger.error(f"Не удалось взять блокировку лидера чекера: {e}")
+                return False
+            Metrics.set_gauge("autosmm_checker_leader", 1 if acquired else 0)
+            if acquired:
+                # Расписание мог вести предыдущий лидер
+                CheckerSchedule.invalidate()
+                logger.info("Чекер стал лидером: заказы проверяет этот процесс")
+            return acquired
+    
+    @classmethod
+    def is_leader(cls) -> bool:
+        return cls._leader.held
+    
+    @classmethod
+    def _resign(cls) -> None:
+        with cls._lock:
+            if cls._leader.held:
+                cls._leader.release()
+                Metrics.set_gauge("autosmm_checker_leader", 0)
+                logger.info("Чекер передал роль лидера")
+    
+    @classmethod
+    def is_current(cls, generation: Optional[int]) -> bool:
+        """Поток чекера еще не отстранен перезапуском"""
+        return generation is None or generation == cls._generation
+    
+    @classmethod
+    def beat(cls, now: float, busy: bool, duration: float = None) -> None:
+        """Отметка жизни чекера"""
+        cls._heartbeat = now
+        cls._busy_since = now if busy else None
+        if duration is not None:
+            cls._last_duration = duration
+            Metrics.set_gauge("autosmm_checker_last_cycle_duration_seconds", duration)
+        Metrics.set_gauge("autosmm_checker_heartbeat_timestamp", now)
+    
+    @classmethod
+    def wait(cls, seconds: float) -> None:
+        """Пауза между циклами, прерываемая остановкой или wake()"""
+        cls._wake.wait(seconds)
+        cls._wake.clear()
+    
+    @classmethod
+    def wake(cls) -> None:
+        """Досрочный запуск следующего цикла"""
+        cls._wake.set()
+    
+    @classmethod
+    def status(cls) -> Dict:
+        now = time.time()
+        return {
+            "running": cls.is_running(),
+            "leader": cls.is_leader(),
+            "enabled": cls._enabled,
+            "generation": cls._generation,
+            "restarts": cls._restarts,
+            "uptime": now - cls._started_at if cls._started_at and cls.is_running() else None,
+            "heartbeat_age": now - cls._heartbeat if cls._heartbeat else None,
+            "busy_for": now - cls._busy_since if cls._busy_since else None,
+            "last_duration": cls._last_duration,
+        }
+    
+    @classmethod
+    def _flush(cls) -> None:
+        try:
+            OrderTrace.flush(force=True)
+            if cls.is_leader():
+                CheckerSchedule.save(load_orders())
+        except Exception as e:
+            logger.error(f"Ошибка сохранения при остановке чекера: {e}")
+    
+    @classmethod
+    def _watch(cls) -> None:
+        while True:
+            time.sleep(CHECKER_WATCHDOG_TICK)
+            try:
+                if not cls._enabled:
+                    continue
                 
-    except Exception as e:
-        logger.error(f"Ошибка в send_order_error_info: {e}")
+                stall_timeout = SettingsCache.get_settings().get("checker_stall_timeout", 600)
+                busy_since = cls._busy_since
+                if cls._thread is None or not cls._thread.is_alive():
+                    logger.error("Поток чекера завершился, перезапуск")
+                    cls.restart("dead")
+                elif busy_since and time.time() - busy_since > stall_timeout:
+                    logger.error(f"Цикл чекера завис более {stall_timeout} сек, перезапуск")
+                    cls.restart("stalled")
+            except Exception as e:
+                logger.error(f"Ошибка сторожа чекера: {e}", exc_info=True)
 
 
-def send_smm_balance_info(c: Cardinal) -> None:
-    """Уведомление о балансе"""
-    try:
-        fp_balance = c.get_balance()
+def _on_checker_settings_changed(old: Optional[MappingProxyType], new: MappingProxyType) -> None:
+    """Новый интервал применяется без ожидания текущей паузы"""
+    if old is not None and old.get("check_interval") != new.get("check_interval"):
+        CheckerSupervisor.wake()
+
+
+SettingsCache.subscribe(_on_checker_settings_changed)
+
+
+# ====================
+# СВЕРКА С FUNPAY И ПАНЕЛЯМИ
+# ====================
+
+reconcile_worker = TaskWorker("reconcile")
+
+
+class Reconciler:
+    """Сверка payorders.json и orders.json с продажами FunPay и статусами панелей.
+    
+    Продажи читаются страницами get_sales, пока не найдутся все отслеживаемые
+    заказы, статусы панелей - пачками по STATUS_BATCH. Исправляются:
+    оплаченные заказы, возвращенные или закрытые на FunPay, и их дубли;
+    активные заказы, деньги за которые вернули, и заказы, которых панель
+    не знает; возвраты в очереди, уже выполненные вручную. Заказы в
+    конечном статусе на панели передаются чекеру вне очереди.
+    """
+    MAX_PAGES = 20
+    PAGE_PAUSE = 1.0  # секунды между страницами продаж
+    FIRST_RUN_DELAY = 300  # секунды после запуска
+    SHOWN = 10
+    INFO_KINDS = ("orders_finished", "unknown_sales")
+    
+    _next_at = time.time() + FIRST_RUN_DELAY
+    _running = threading.Lock()
+    
+    @classmethod
+    def schedule(cls, c: Cardinal) -> None:
+        """Постановка периодической сверки в фон, если срок наступил"""
+        interval = SettingsCache.get_settings().get("reconcile_interval", 3600)
+        if not interval or time.time() < cls._next_at:
+            return
+        cls._next_at = time.time() + interval
+        reconcile_worker.submit(cls.run, c)
+    
+    @staticmethod
+    def _status_name(status: Any) -> str:
+        return str(getattr(status, "name", status)).upper()
+    
+    @classmethod
+    def fetch_sales(cls, c: Cardinal, wanted: set) -> Tuple[Dict[str, str], bool]:
+        """Статусы продаж FunPay (PAID, CLOSED, REFUNDED) по ID; второе значение -
+        просмотрена ли вся нужная история"""
+        statuses: Dict[str, str] = {}
+        start_from = None
+        for page in range(cls.MAX_PAGES):
+            if page:
+                time.sleep(cls.PAGE_PAUSE)
+            start_from, sales = c.account.get_sales(start_from=start_from)
+            for sale in sales:
+                statuses[str(sale.id)] = cls._status_name(sale.status)
+            if not start_from or wanted <= statuses.keys():
+                return statuses, True
+        return statuses, False
+    
+    @staticmethod
+    def fetch_provider_statuses(orders: Dict[str, ActiveOrder]) -> Dict[str, dict]:
+        """Статусы активных заказов с их панелей пачками"""
+        by_provider: Dict[Tuple[str, str], List[str]] = {}
+        for smm_id, order in orders.items():
+            by_provider.setdefault(SettingsCache.credentials(order.provider), []).append(smm_id)
+        
+        statuses: Dict[str, dict] = {}
+        for (api_url, api_key), smm_ids in by_provider.items():
+            if not api_url or not api_key:
+                continue
+            for start in range(0, len(smm_ids), STATUS_BATCH):
+                batch = SocTypeAPI.get_orders_status(smm_ids[start:start + STATUS_BATCH], api_url, api_key)
+                if batch:
+                    statuses.update(batch)
+        return statuses
+    
+    @classmethod
+    def run(cls, c: Cardinal, notify: bool = False) -> Optional[Dict[str, List[str]]]:
+        """Одна сверка; отчет администраторам, если что-то исправлено или notify"""
+        if not cls._running.acquire(blocking=False):
+            logger.info("Сверка уже выполняется")
+            return None
+        started = time.perf_counter()
+        try:
+            report = cls._reconcile(c)
+        except Exception as e:
+            logger.error(f"Ошибка сверки: {e}", exc_info=True)
+            if notify:
+                cls.notify(c, f"❌ Ошибка сверки: {e}")
+            return None
+        finally:
+            cls._running.release()
+            Metrics.observe("autosmm_reconcile_seconds", time.perf_counter() - started)
         
-        # Пытаемся получить баланс первого API
-        api_url = get_api_url()
-        api_key = get_api_key()
-        smm_balance_info = SocTypeAPI.get_balance(api_url, api_key)
-        balance, currency = smm_balance_info if smm_balance_info else (0, 'N/A')
+        # Завершенные заказы чекер обработает сам, а ненайденные не исправлялись
+        fixed = 0
+        for kind, items in report.items():
+            if items and kind not in cls.INFO_KINDS:
+                Metrics.inc("autosmm_reconcile_fixes_total", len(items), kind=kind)
+                fixed += len(items)
+        logger.info(f"Сверка завершена за {time.perf_counter() - started:.1f} сек, исправлено: {fixed}")
+        if fixed or notify:
+            cls.notify(c, cls.format_report(report))
+        return report
+    
+    @classmethod
+    def _reconcile(cls, c: Cardinal) -> Dict[str, List[str]]:
+        report: Dict[str, List[str]] = {
+            "payorders_refunded": [], "payorders_closed": [], "payorders_duplicates": [],
+            "orders_refunded": [], "orders_orphaned": [], "orders_finished": [],
+            "refunds_done": [], "unknown_sales": [],
+        }
+        payorders = load_payorders()
+        orders = dict(load_orders())
+        refunds = {oid: e for oid, e in RefundQueue.load().items() if e.status == "pending"}
         
-        # Пытаемся получить баланс второго API
-        api_url_2 = get_api_url('2')
-        api_key_2 = get_api_key('2')
+        wanted = {o.order_id for o in payorders} | {o.order_id for o in orders.values()} | set(refunds)
+        sales, complete = cls.fetch_sales(c, wanted) if wanted else ({}, True)
+        if not complete:
+            report["unknown_sales"] = sorted(wanted - sales.keys())
         
-        if api_url_2 and api_key_2:
-            smm_balance_info_2 = SocTypeAPI.get_balance(api_url_2, api_key_2)
-            balance_2, currency_2 = smm_balance_info_2 if smm_balance_info_2 else (0, 'N/A')
-            
-            text_balance = (
-                f"💰 Баланс {api_url.replace('https://', '').replace('/api/v2/', '').replace('/api/v2', '')}: `{balance:.2f} {currency}`\n"
-                f"💰 Баланс {api_url_2.replace('https://', '').replace('/api/v2/', '').replace('/api/v2', '')}: `{balance_2:.2f} {currency_2}`\n"
-                f"💰 Баланс на FunPay: `{fp_balance.total_rub}₽, {fp_balance.available_usd}$, {fp_balance.total_eur}€`"
-            )
-        else:
-            text_balance = (
-                f"💰 Баланс сайта: `{balance:.2f} {currency}`\n"
-                f"💰 Баланс на FunPay: `{fp_balance.total_rub}₽, {fp_balance.available_usd}$, {fp_balance.total_eur}€`"
-            )
+        # Оплаченные заказы: возвращенные и закрытые на FunPay больше не ждут ссылку
+        seen = set()
+        for order in payorders:
+            if order.order_id in seen:
+                report["payorders_duplicates"].append(order.order_id)
+            seen.add(order.order_id)
+        if report["payorders_duplicates"]:
+            def dedupe(data: List[PaidOrder]):
+                unique = {}
+                for order in data:
+                    unique.setdefault(order.order_id, order)
+                data[:] = list(unique.values())
+            update_payorders(dedupe)
         
-        users = load_authorized_users()
-        if not users:
-            return
+        for order_id in seen:
+            status = sales.get(order_id)
+            if status not in ("REFUNDED", "CLOSED") or remove_payorder(order_id, f"{status.lower()}_external") is None:
+                continue
+            for chat_id, pending in list(pending_confirmations.items()):
+                if pending.order_id == order_id:
+                    pending_confirmations.pop(chat_id, None)
+            report["payorders_refunded" if status == "REFUNDED" else "payorders_closed"].append(order_id)
+            if status == "REFUNDED":
+                log_refund(order_id, "external", True)
         
-        for user_id in users:
-            try:
-                c.telegram.bot.send_message(
-                    user_id,
-                    text_balance,
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logger.error(f"Ошибка отправки баланса: {e}")
-                
-    except Exception as e:
-        logger.error(f"Ошибка в send_smm_balance_info: {e}")
-
-
-def send_smm_start_info(c: Cardinal) -> None:
-    """Уведомление при старте"""
-    try:
-        text_start = (
-            f"✅ Авто-накрутка инициализирована!\n\n"
-            f"ℹ️ Версия: `{VERSION}`\n"
-            f"⚙️ Настройки: /autosmm\n\n"
-            f"*ℹ️ Авто-накрутка by @klaymov (improved)*"
-        )
+        # Возвраты, уже выполненные вне плагина
+        for fp_order_id in refunds:
+            if sales.get(fp_order_id) == "REFUNDED" and RefundQueue.settle(fp_order_id):
+                report["refunds_done"].append(fp_order_id)
         
-        users = load_authorized_users()
-        if not users:
-            return
+        # Активные заказы: возвращенные на FunPay и неизвестные панели больше не проверяются
+        provider_statuses = cls.fetch_provider_statuses(orders)
+        stale: Dict[str, str] = {}
+        for smm_id, order in orders.items():
+            info = provider_statuses.get(smm_id)
+            if sales.get(order.order_id) == "REFUNDED" and order.order_id not in refunds:
+                stale[smm_id] = "orders_refunded"
+            elif info is not None and "error" in info and "status" not in info:
+                stale[smm_id] = "orders_orphaned"
+            elif info and info.get("status") in ("Completed", "Canceled", "Partial"):
+                report["orders_finished"].append(smm_id)
         
-        for user_id in users:
+        if stale:
+            def drop_stale(data: Dict[str, ActiveOrder]):
+                for smm_id in stale:
+                    data.pop(smm_id, None)
+            update_orders(drop_stale)
+            CheckerSchedule.forget(stale)
+            for smm_id, kind in stale.items():
+                report[kind].append(smm_id)
+                if kind == "orders_refunded":
+                    SalesStats.record_refunded(smm_id)
+                    log_refund(orders[smm_id].order_id, "external", True, smm_order_id=smm_id)
+        if report["orders_finished"]:
+            CheckerSchedule.expedite(report["orders_finished"])
+        return report
+    
+    @classmethod
+    def format_report(cls, report: Dict[str, List[str]]) -> str:
+        titles = {
+            "payorders_refunded": "Оплаченные, возвращенные на FunPay",
+            "payorders_closed": "Оплаченные, закрытые на FunPay",
+            "payorders_duplicates": "Дубли оплаченных",
+            "orders_refunded": "Активные, возвращенные на FunPay",
+            "orders_orphaned": "Активные, неизвестные панели",
+            "orders_finished": "Завершенные на панели (переданы чекеру)",
+            "refunds_done": "Возвраты, выполненные вручную",
+            "unknown_sales": "Не найдены в продажах (не исправлялись)",
+        }
+        text = f"🧾 Сверка `{NAME}`\n\n"
+        if not any(report.values()):
+            text += "Расхождений не найдено.\n"
+        for kind, title in titles.items():
+            items = report.get(kind) or []
+            if items:
+                shown = ", ".join(f"`{item}`" for item in items[:cls.SHOWN])
+                more = f" и еще {len(items) - cls.SHOWN}" if len(items) > cls.SHOWN else ""
+                text += f"• {title}: {len(items)}\n⠀∟ {shown}{more}\n"
+        return text
+    
+    @classmethod
+    def notify(cls, c: Cardinal, text: str) -> None:
+        """Отчет сверки авторизованным пользователям"""
+        for user_id in load_authorized_users():
             try:
-                c.telegram.bot.send_message(
-                    user_id,
-                    text_start,
-                    parse_mode='Markdown'
-                )
+                c.telegram.bot.send_message(user_id, text, parse_mode='Markdown')
             except Exception as e:
-                logger.error(f"Ошибка отправки стартового сообщения: {e}")
-                
-    except Exception as e:
-        logger.error(f"Ошибка в send_smm_start_info: {e}")
+                logger.error(f"Ошибка отправки отчета сверки: {e}")
+
+
+def format_checker_status() -> str:
+    """Состояние чекера для Telegram"""
+    status = CheckerSupervisor.status()
+    settings = SettingsCache.get_settings()
+    
+    def seconds(value: Optional[float]) -> str:
+        return format_duration_ms(value * 1000) if value is not None else "—"
+    
+    text = "🔄 Чекер заказов\n\n"
+    text += f"Состояние: {'🟢 работает' if status['running'] else '🔴 остановлен'}\n"
+    if status['running']:
+        text += f"Роль: {'лидер' if status['leader'] else 'резерв (заказы проверяет другой процесс)'}\n"
+    text += f"Интервал проверки: {settings.get('check_interval', 60)} сек\n"
+    text += f"Аптайм: {seconds(status['uptime'])}\n"
+    text += f"Последний сигнал: {seconds(status['heartbeat_age'])} назад\n"
+    text += f"Последний цикл: {seconds(status['last_duration'])}\n"
+    if status["busy_for"] is not None:
+        text += f"Текущий цикл идет: {seconds(status['busy_for'])}\n"
+    text += f"Перезапусков: {status['restarts']}\n"
+    deferred = DeferredSubmissions.load()
+    if deferred:
+        text += f"Отложенных заказов (панель недоступна): {len(deferred)}\n"
+    queued = CreationQueue.qsize()
+    if queued:
+        text += f"Заказов в очереди на создание: {queued}\n"
+    slow = CheckerSchedule.slow_orders()
+    if slow:
+        text += f"Медленнее p95 услуги: {len(slow)} ({', '.join(slow[:10])}{' …' if len(slow) > 10 else ''})\n"
+    text += "\n"
+    text += "Управление: /autosmm_checker start|stop|restart"
+    return text
 
 
 # ====================
-# ЧЕКЕР ЗАКАЗОВ
+# МАССОВЫЕ ОПЕРАЦИИ
 # ====================
 
-def checkbox(cardinal: Cardinal):
-    """Запуск чекера в отдельном потоке"""
-    try:
-        threading.Thread(target=process_orders, args=[cardinal], daemon=True).start()
-        logger.info("Чекер заказов запущен")
-    except Exception as e:
-        logger.error(f"Ошибка запуска чекера: {e}")
+bulk_worker = TaskWorker("bulk")
 
 
-def process_orders(c: Cardinal):
-    """Проверка статусов заказов"""
-    settings = SettingsCache.get_settings()
-    check_interval = settings.get("check_interval", 60)
+class BulkOperations:
+    """Статус, рефилл и отмена сразу для многих активных заказов из Telegram.
     
-    while True:
-        try:
-            logger.info("Проверка статусов заказов...")
-            api_url = get_api_url()
-            api_key = get_api_key()
-            
+    Заказы выбираются фильтрами (услуга, панель, возраст, статус) или списком
+    ID и группируются по панелям. Каждая группа идет пачками по STATUS_BATCH
+    через пакетные методы панели, а если панель их не поддерживает - по одному
+    заказу в BULK_PARALLEL потоков. Завершение и возвраты после отмены
+    оформляет чекер: измененные заказы он проверяет в ближайшем цикле.
+    """
+    ACTIONS = {"status": "обновление статуса", "refill": "рефилл", "cancel": "отмена"}
+    USAGE = (
+        "Формат: /autosmm_bulk status|refill|cancel [service=ID] [provider=NAME] "
+        "[status=Pending] [age>2d|age<6h] [ID ID ...|all] [confirm]"
+    )
+    AGE_PATTERN = re.compile(r'^age([<>])(\d+)([mhd])$')
+    AGE_UNITS = {"m": 60, "h": 3600, "d": 86400}
+    SHOWN = 10
+    
+    @classmethod
+    def parse(cls, args: List[str]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Аргументы команды -> запрос; вторым значением - текст ошибки"""
+        if not args or args[0] not in cls.ACTIONS:
+            return None, cls.USAGE
+        request = {"action": args[0], "ids": [], "filters": {}, "all": False, "confirm": False}
+        for arg in args[1:]:
+            key, sep, value = arg.partition("=")
+            age = cls.AGE_PATTERN.match(arg)
+            if arg in ("all", "confirm"):
+                request[arg] = True
+            elif age:
+                seconds = int(age.group(2)) * cls.AGE_UNITS[age.group(3)]
+                request["filters"]["older" if age.group(1) == ">" else "newer"] = seconds
+            elif sep and key in ("service", "provider", "status") and value:
+                request["filters"][key] = {item.lower() for item in value.split(",") if item}
+            elif all(part.isdigit() for part in arg.split(",") if part) and arg.strip(","):
+                request["ids"].extend(part for part in arg.split(",") if part)
+            else:
+                return None, f"❌ Непонятный аргумент: {arg}\n{cls.USAGE}"
+        if not request["ids"] and not request["filters"] and not request["all"]:
+            return None, f"❌ Укажите фильтр, ID заказов или all\n{cls.USAGE}"
+        return request, None
+    
+    @classmethod
+    def select(cls, orders: Dict[str, ActiveOrder], request: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+        """Активные заказы под запрос и ID из списка, которых нет среди активных"""
+        filters = request["filters"]
+        now = datetime.now()
+        
+        def matches(order: ActiveOrder) -> bool:
+            if "service" in filters and str(order.service_id) not in filters["service"]:
+                return False
+            if "provider" in filters and (order.provider or "API_1").lower() not in filters["provider"]:
+                return False
+            if "status" in filters and order.status.lower() not in filters["status"]:
+                return False
+            if "older" in filters or "newer" in filters:
+                try:
+                    age = (now - datetime.strptime(order.created_at, "%Y-%m-%d %H:%M:%S")).total_seconds()
+                except ValueError:
+                    return False
+                if age < filters.get("older", 0) or age > filters.get("newer", float("inf")):
+                    return False
+            return True
+        
+        candidates = request["ids"] or list(orders)
+        missing = [oid for oid in candidates if oid not in orders]
+        selected = [oid for oid in dict.fromkeys(candidates) if oid in orders and matches(orders[oid])]
+        return selected[:BULK_MAX_ORDERS], missing
+    
+    @staticmethod
+    def _single(action: str, order_id: str, api_url: str, api_key: str) -> Tuple[bool, Any]:
+        """Операция над одним заказом, когда у панели нет пакетного метода"""
+        if action == "status":
+            status = SocTypeAPI.get_order_status(int(order_id), api_url, api_key)
+            return (True, status) if status else (False, "статус не получен")
+        call = SocTypeAPI.refill_order if action == "refill" else SocTypeAPI.cancel_order
+        result = call(int(order_id), api_url, api_key)
+        return (True, result) if result is not None else (False, "панель отказала")
+    
+    @classmethod
+    def _batch(cls, action: str, order_ids: List[str], api_url: str, api_key: str) -> Optional[Dict[str, Tuple[bool, Any]]]:
+        if action == "status":
+            statuses = SocTypeAPI.get_orders_status(order_ids, api_url, api_key)
+            if statuses is None:
+                return None
+            return {
+                oid: (False, data["error"]) if "error" in data else (True, data)
+                for oid, data in statuses.items()
+            }
+        call = SocTypeAPI.refill_orders if action == "refill" else SocTypeAPI.cancel_orders
+        return call(order_ids, api_url, api_key)
+    
+    @classmethod
+    def run(cls, action: str, order_ids: List[str], progress=None) -> Dict[str, Tuple[bool, Any]]:
+        """Выполнение над заказами; progress(готово, всего) вызывается по ходу.
+        
+        Заказы, завершенные, пока задача ждала в очереди, пропускаются с ошибкой.
+        """
+        orders = load_orders()
+        results: Dict[str, Tuple[bool, Any]] = {
+            oid: (False, "нет среди активных") for oid in order_ids if oid not in orders
+        }
+        groups: Dict[Tuple[str, str], List[str]] = {}
+        for order_id in order_ids:
+            if order_id in orders:
+                groups.setdefault(SettingsCache.credentials(orders[order_id].provider), []).append(order_id)
+        
+        def report(chunk_results: Dict[str, Tuple[bool, Any]]) -> None:
+            results.update(chunk_results)
+            if progress:
+                progress(len(results), len(order_ids))
+        
+        for (api_url, api_key), group in groups.items():
             if not api_url or not api_key:
-                logger.warning("API не настроен, пропускаем проверку")
-                time.sleep(check_interval)
+                report({oid: (False, "панель не настроена") for oid in group})
                 continue
-            
-            def check_order_status(order_id: str) -> Optional[dict]:
-                """Проверка статуса одного заказа"""
-                try:
-                    return SocTypeAPI.get_order_status(int(order_id), api_url, api_key)
-                except Exception as e:
-                    logger.error(f"Ошибка проверки статуса заказа {order_id}: {e}")
-                    return None
-            
-            def send_completion_message(c: Cardinal, order_id: str):
-                """Отправка сообщения о завершении"""
-                try:
-                    orders = load_orders()
-                    if order_id not in orders:
-                        return
-                    
-                    order_info = orders[order_id]
-                    chat_id = order_info.get("chat_id")
-                    fp_order_id = order_info.get("order_id")
-                    
-                    if not chat_id:
-                        logger.warning(f"Нет chat_id для заказа {order_id}")
-                        return
-                    
-                    message_text = (
-                        f"✅ Заказ #{fp_order_id} выполнен!\n"
-                        f"Пожалуйста, перейдите по ссылке https://funpay.com/orders/{fp_order_id}/ "
-                        f"и нажмите кнопку «Подтвердить выполнение заказа»."
-                    )
-                    c.send_message(chat_id, message_text)
-                    logger.info(f"Отправлено уведомление о завершении заказа {order_id}")
-                except Exception as e:
-                    logger.error(f"Ошибка отправки уведомления о завершении: {e}")
-            
-            def send_canceled_message(c: Cardinal, order_id: str):
-                """Отправка сообщения об отмене"""
-                try:
-                    orders = load_orders()
-                    if order_id not in orders:
-                        return
-                    
-                    order_info = orders[order_id]
-                    chat_id = order_info.get("chat_id")
-                    fp_order_id = order_info.get("order_id")
-                    
-                    if not chat_id:
-                        return
-                    
-                    message_text = f"❌ Заказ #{fp_order_id} отменён!"
-                    c.send_message(chat_id, message_text)
-                    
-                    # Попытка возврата средств
-                    try:
-                        c.account.refund(fp_order_id)
-                        logger.info(f"Выполнен возврат средств для заказа {order_id}")
-                    except Exception as e:
-                        logger.error(f"Ошибка возврата средств: {e}")
-                        
-                except Exception as e:
-                    logger.error(f"Ошибка отправки уведомления об отмене: {e}")
-            
-            def send_partial_message(c: Cardinal, order_id: str):
-                """Обработка частично выполненного заказа"""
-                try:
-                    settings = SettingsCache.get_settings()
-                    orders = load_orders()
-                    
-                    if order_id not in orders:
-                        return
-                    
-                    order_info = orders[order_id]
-                    cashlist = load_cashlist()
-                    chat_id = order_info.get("chat_id")
-                    partial_amount = int(order_info.get('partial_amount', 0))
-                    
-                    if partial_amount <= 0:
-                        logger.warning(f"Некорректное partial_amount для заказа {order_id}")
-                        return
-                    
-                    new_service_id = order_info.get('service_id')
-                    new_link = order_info.get('order_url')
-                    order_fid = order_info.get('order_id')
-                    orderdatetime = order_info.get('orderdatetime')
-                    
-                    # Пересоздание заказа если включено
-                    if settings.get("set_recreated_order", False):
-                        try:
-                            smm_order_id = SocTypeAPI.create_order(
-                                new_service_id,
-                                new_link,
-                                partial_amount,
-                                api_url,
-                                api_key
-                            )
-                            
-                            if isinstance(smm_order_id, (int, str)) and str(smm_order_id).isdigit():
-                                cashlist[str(smm_order_id)] = {
-                                    "service_id": new_service_id,
-                                    "chat_id": chat_id,
-                                    "order_id": order_fid,
-                                    "order_url": new_link,
-                                    "order_amount": partial_amount,
-                                    "partial_amount": 0,
-                                    "orderdatetime": orderdatetime,
-                                    "status": "new"
-                                }
-                                save_cashlist(cashlist)
-                                
-                                message = f"""📈 Ваш заказ #{order_fid} был пересоздан!
-🆔 Новый ID заказа: {smm_order_id}
-⏳ Остаток выполнения: {partial_amount}"""
-                                c.send_message(chat_id, message)
-                                logger.info(f"Заказ {order_id} пересоздан как {smm_order_id}")
-                        except Exception as e:
-                            logger.error(f"Ошибка пересоздания заказа: {e}")
-                    else:
-                        message = f"""🔴 Заказ #{order_fid} был приостановлен!
-⏳ Остаток выполнения: {partial_amount}"""
-                        c.send_message(chat_id, message)
-                        
-                except Exception as e:
-                    logger.error(f"Ошибка обработки Partial заказа: {e}")
-            
-            # Основная логика проверки
-            orders = load_orders()
-            updated_orders = {}
-            completed_orders = []
-            canceled_orders = []
-            partial_orders = []
-            
-            for order_id, order_info in orders.items():
-                try:
-                    order_status = check_order_status(order_id)
-                    
-                    if order_status:
-                        status = order_status.get("status", "unknown")
-                        remains = int(order_status.get("remains", 0))
-                        
-                        updated_orders[order_id] = {
-                            "service_id": order_info.get('service_id'),
-                            "chat_id": order_info.get("chat_id"),
-                            "order_id": order_info.get("order_id"),
-                            "order_url": order_info.get('order_url'),
-                            "order_amount": order_info.get('order_amount'),
-                            "partial_amount": remains,
-                            "orderdatetime": order_info.get('orderdatetime'),
-                            "status": status
-                        }
-                        
-                        # Сортировка по статусам
-                        if status == "Completed":
-                            completed_orders.append(order_id)
-                            send_completion_message(c, order_id)
-                        elif status == "Canceled":
-                            canceled_orders.append(order_id)
-                            send_canceled_message(c, order_id)
-                        elif status == "Partial":
-                            partial_orders.append(order_id)
-                            send_partial_message(c, order_id)
-                    else:
-                        # Статус не получен, оставляем заказ как есть
-                        updated_orders[order_id] = order_info
-                        
-                except Exception as e:
-                    logger.error(f"Ошибка обработки заказа {order_id}: {e}")
-                    updated_orders[order_id] = order_info
-            
-            # Удаление завершенных/отмененных заказов
-            for order_id in completed_orders + canceled_orders + partial_orders:
-                if order_id in updated_orders:
-                    del updated_orders[order_id]
-            
-            # Добавление заказов из кэшлиста
-            cashlist = load_cashlist()
-            for order_id, order_info in cashlist.items():
-                if order_id not in updated_orders:
-                    updated_orders[order_id] = order_info
-            
-            # Сохранение обновленных заказов
-            save_orders(updated_orders)
-            
-            # Очистка кэшлиста
-            if cashlist:
-                save_cashlist({})
-            
-            logger.info(f"Проверка завершена. Активных заказов: {len(updated_orders)}")
-            
-        except Exception as e:
-            logger.error(f"Критическая ошибка в process_orders: {e}", exc_info=True)
+            batch_supported = True
+            for start in range(0, len(group), STATUS_BATCH):
+                chunk = group[start:start + STATUS_BATCH]
+                batch = cls._batch(action, chunk, api_url, api_key) if batch_supported else None
+                if batch is not None:
+                    report({oid: batch.get(oid, (False, "нет в ответе панели")) for oid in chunk})
+                    continue
+                # Панель не знает пакетного метода: дальше по одному заказу
+                batch_supported = False
+                with ThreadPoolExecutor(max_workers=BULK_PARALLEL, thread_name_prefix="AutoSmm-bulk") as executor:
+                    for order_id, outcome in zip(chunk, executor.map(
+                            lambda oid: cls._single(action, oid, api_url, api_key), chunk)):
+                        report({order_id: outcome})
+        
+        cls._apply(action, orders, results)
+        for ok, _ in results.values():
+            Metrics.inc("autosmm_bulk_orders_total", action=action, outcome="ok" if ok else "failed")
+        return results
+    
+    @staticmethod
+    def _apply(action: str, orders: Dict[str, ActiveOrder], results: Dict[str, Tuple[bool, Any]]) -> None:
+        """Учет результатов: рефиллы в refill.json, изменившиеся заказы - в ближайший цикл чекера"""
+        succeeded = [oid for oid, (ok, _) in results.items() if ok and oid in orders]
+        if action == "refill":
+            for order_id in succeeded:
+                record_refill(order_id, results[order_id][1], orders[order_id].chat_id)
+        elif action == "cancel":
+            CheckerSchedule.expedite(succeeded)
+        else:
+            CheckerSchedule.expedite([
+                oid for oid in succeeded
+                if str(results[oid][1].get("status", "")).lower() != orders[oid].status.lower()
+            ])
+    
+    @classmethod
+    def format_result(cls, action: str, results: Dict[str, Tuple[bool, Any]], elapsed: float) -> str:
+        ok = [oid for oid, (success, _) in results.items() if success]
+        failed = [(oid, value) for oid, (success, value) in results.items() if not success]
+        text = f"✅ {cls.ACTIONS[action].capitalize()}: {len(ok)} из {len(results)} за {elapsed:.1f} сек\n"
+        if action == "status" and ok:
+            counts: Dict[str, int] = {}
+            for oid in ok:
+                status = results[oid][1].get("status", "Unknown")
+                counts[status] = counts.get(status, 0) + 1
+            text += "".join(f"⠀∟{status}: {count}\n" for status, count in sorted(counts.items()))
+        elif action == "cancel" and ok:
+            text += "Возвраты покупателям оформит чекер, когда панель подтвердит отмену.\n"
+        if failed:
+            text += f"\n❌ Не выполнено: {len(failed)}\n"
+            text += "".join(f"⠀∟{oid}: {error}\n" for oid, error in failed[:cls.SHOWN])
+            if len(failed) > cls.SHOWN:
+                text += f"⠀∟... и еще {len(failed) - cls.SHOWN}\n"
+        return text
+    
+    @classmethod
+    def execute(cls, bot, chat_id: Any, message_id: int, action: str, order_ids: List[str]) -> None:
+        """Фоновое выполнение с ходом операции в одном сообщении"""
+        title = f"⏳ {cls.ACTIONS[action].capitalize()} для {len(order_ids)} заказов"
+        last_edit = [time.monotonic()]
+        
+        def edit(text: str) -> None:
+            try:
+                bot.edit_message_text(text, chat_id, message_id)
+            except Exception as e:
+                logger.warning(f"Не удалось обновить ход массовой операции: {e}")
         
-        # Пауза перед следующей проверкой
-        time.sleep(check_interval)
+        def progress(done: int, total: int) -> None:
+            if time.monotonic() - last_edit[0] >= BULK_PROGRESS_EVERY and done < total:
+                last_edit[0] = time.monotonic()
+                edit(f"{title}: {done}/{total}")
+        
+        started = time.perf_counter()
+        try:
+            results = cls.run(action, order_ids, progress)
+        except Exception as e:
+            logger.error(f"Ошибка массовой операции {action}: {e}", exc_info=True)
+            edit(f"❌ Ошибка массовой операции: {e}")
+            return
+        logger.info(f"Массовая операция {action}: {sum(ok for ok, _ in results.values())} из {len(results)}",
+                    extra=log_fields("bulk_" + action, latency=time.perf_counter() - started))
+        edit(cls.format_result(action, results, time.perf_counter() - started))
 
 
 # ====================
@@ -1348,13 +6106,50 @@ def process_orders(c: Cardinal):
 # ====================
 
 def init_commands(cardinal: Cardinal, *args):
-    """Инициализация команд"""
+    """Инициализация плагина: регистрация обработчиков, остальное в фоне"""
+    started = time.perf_counter()
+    register_commands(cardinal)
+    elapsed = time.perf_counter() - started
+    
+    Metrics.set_gauge("autosmm_startup_seconds", elapsed, phase="register")
+    threading.Thread(target=background_init, args=[cardinal], name="AutoSmm-init", daemon=True).start()
+    logger.info(f"$MAGENTA{LOGGER_PREFIX} v{VERSION} успешно запущен за {elapsed * 1000:.0f} мс.$RESET")
+
+
+def background_init(cardinal: Cardinal) -> None:
+    """Фоновая инициализация: настройки, прогрев соединений, стартовое сообщение"""
+    started = time.perf_counter()
+    LogPipeline.start()
+    atexit.register(shutdown)
     try:
-        # Стартовое сообщение
-        settings = SettingsCache.get_settings()
-        if settings.get("set_start_mess", False):
-            send_smm_start_info(cardinal)
+        persist_settings_defaults()
+        
+        for name in SettingsCache.providers():
+            try:
+                ProviderCache.prefetch(*SettingsCache.credentials(name))
+            except Exception as e:
+                logger.error(f"Ошибка предзагрузки данных провайдера {name}: {e}")
+        
+        get_currency_rate('USD', 'RUB')
+        
+        # Возвраты, не выполненные до перезапуска
+        RefundQueue.start(cardinal)
+        # Подтвержденные заказы, не созданные до перезапуска
+        CreationQueue.recover(cardinal)
         
+        if SettingsCache.get_settings().get("set_start_mess", False):
+            send_smm_start_info(cardinal)
+    except Exception as e:
+        logger.error(f"Ошибка фоновой инициализации: {e}", exc_info=True)
+    
+    elapsed = time.perf_counter() - started
+    Metrics.set_gauge("autosmm_startup_seconds", elapsed, phase="background")
+    logger.info(f"Фоновая инициализация завершена за {elapsed:.1f} сек")
+
+
+def register_commands(cardinal: Cardinal) -> None:
+    """Регистрация Telegram команд и обработчиков"""
+    try:
         if not cardinal.telegram:
             logger.warning("Telegram бот не настроен")
             return
@@ -1370,6 +6165,269 @@ def init_commands(cardinal: Cardinal, *args):
                 logger.error(f"Ошибка команды check_balance: {e}")
                 bot.reply_to(m, "❌ Ошибка получения баланса")
         
+        # Команда статистики продаж
+        def send_stats_command(m: types.Message):
+            try:
+                summary = SalesStats.get_summary()
+                text = "📊 Статистика AutoSmm\n\n"
+                text += format_stats_bucket("📅 Сегодня:", summary["today"]) + "\n"
+                text += format_stats_bucket("🗓 7 дней:", summary["week"]) + "\n"
+                text += format_stats_bucket("📈 Всего:", summary["totals"]) + "\n"
+                
+                for provider, bucket in sorted(summary["providers"].items()):
+                    text += format_stats_bucket(f"🌐 {provider}:", bucket) + "\n"
+                
+                top_services = sorted(summary["services"].items(), key=lambda x: x[1].get("profit", 0), reverse=True)[:5]
+                if top_services:
+                    text += "🔍 Маржа по услугам:\n"
+                    for service_id, bucket in top_services:
+                        revenue = bucket.get("revenue", 0)
+                        margin = (bucket.get("profit", 0) / revenue * 100) if revenue else 0
+                        text += f"⠀∟ID {service_id}: {bucket.get('orders', 0)} шт, прибыль {bucket.get('profit', 0):.2f} ({margin:.1f}%)\n"
+                    text += "\n"
+                
+                top_lots = sorted(summary["lots"].items(), key=lambda x: x[1].get("profit", 0), reverse=True)[:5]
+                if top_lots:
+                    text += "🛒 Лучшие лоты:\n"
+                    for lot, bucket in top_lots:
+                        text += f"⠀∟{lot}: {bucket.get('orders', 0)} шт, прибыль {bucket.get('profit', 0):.2f}\n"
+                    text += "\n"
+                
+                text += f"⏳ В работе: {summary['open']}"
+                bot.reply_to(m, text)
+            except Exception as e:
+                logger.error(f"Ошибка команды autosmm_stats: {e}", exc_info=True)
+                bot.reply_to(m, "❌ Ошибка получения статистики")
+        
+        # Команда выгрузки истории
+        def send_export_command(m: types.Message):
+            try:
+                date_from, date_to, fmt = parse_export_args(m.text or "")
+            except ValueError:
+                bot.reply_to(m, "❌ Формат: /autosmm_export [ГГГГ-ММ-ДД] [ГГГГ-ММ-ДД] [csv|jsonl]")
+                return
+            
+            try:
+                export_worker.submit(run_export, cardinal, m.chat.id, date_from, date_to, fmt)
+                bot.reply_to(m, f"⏳ Готовлю выгрузку {date_from} — {date_to} ({fmt})...")
+            except Exception as e:
+                logger.error(f"Ошибка команды autosmm_export: {e}")
+                bot.reply_to(m, "❌ Ошибка запуска выгрузки")
+        
+        # Команда метрик
+        def send_metrics_command(m: types.Message):
+            try:
+                bot.reply_to(m, format_metrics_summary())
+            except Exception as e:
+                logger.error(f"Ошибка команды autosmm_metrics: {e}", exc_info=True)
+                bot.reply_to(m, "❌ Ошибка получения метрик")
+        
+        # Команда трассировки заказов
+        def send_trace_command(m: types.Message):
+            try:
+                args = (m.text or "").split()[1:]
+                text = format_order_trace(args[0].lstrip("#")) if args else format_trace_percentiles()
+                bot.reply_to(m, text)
+            except Exception as e:
+                logger.error(f"Ошибка команды autosmm_trace: {e}", exc_info=True)
+                bot.reply_to(m, "❌ Ошибка получения трассировки")
+        
+        # Профилирование
+        def toggle_profiling(chat_id: int, seconds: int = PROFILE_DEFAULT_SECONDS) -> str:
+            if Profiler.is_active():
+                Profiler.finish()
+                return "🧪 Профилирование остановлено, отчеты сохранены."
+            
+            def on_finish(files: List[str], calls: Dict[str, int]):
+                calls_text = ", ".join(f"{name}: {count}" for name, count in calls.items()) or "вызовов не было"
+                bot.send_message(
+                    chat_id,
+                    f"🧪 Профилирование завершено ({calls_text}).\n"
+                    f"📁 Сохранено файлов: {len(files)} в {PROFILES_PATH}"
+                )
+            
+            Profiler.start(seconds, on_finish)
+            return f"🧪 Профилирование включено на {min(seconds, PROFILE_MAX_SECONDS)} сек."
+        
+        def send_profile_command(m: types.Message):
+            try:
+                args = (m.text or "").split()[1:]
+                if args and args[0] == "stop":
+                    if not Profiler.is_active():
+                        bot.reply_to(m, "🧪 Профилирование не запущено.")
+                        return
+                    bot.reply_to(m, toggle_profiling(m.chat.id))
+                    return
+                
+                if Profiler.is_active():
+                    bot.reply_to(m, "🧪 Профилирование уже идет. Остановить: /autosmm_profile stop")
+                    return
+                seconds = int(args[0]) if args else PROFILE_DEFAULT_SECONDS
+                bot.reply_to(m, toggle_profiling(m.chat.id, seconds))
+            except ValueError:
+                bot.reply_to(m, "❌ Формат: /autosmm_profile [секунды|stop]")
+            except Exception as e:
+                logger.error(f"Ошибка команды autosmm_profile: {e}", exc_info=True)
+                bot.reply_to(m, "❌ Ошибка профилирования")
+        
+        def send_checker_command(m: types.Message):
+            try:
+                args = (m.text or "").split()[1:]
+                action = args[0] if args else ""
+                
+                if action == "start":
+                    if not CheckerSupervisor.start(cardinal):
+                        bot.reply_to(m, "🔄 Чекер уже работает.")
+                        return
+                elif action == "stop":
+                    if not CheckerSupervisor.stop():
+                        bot.reply_to(m, "🔄 Чекер уже остановлен.")
+                        return
+                elif action == "restart":
+                    CheckerSupervisor.restart()
+                elif action:
+                    bot.reply_to(m, "❌ Формат: /autosmm_checker [start|stop|restart]")
+                    return
+                
+                bot.reply_to(m, format_checker_status())
+            except Exception as e:
+                logger.error(f"Ошибка команды autosmm_checker: {e}", exc_info=True)
+                bot.reply_to(m, "❌ Ошибка управления чекером")
+        
+        def send_providers_command(m: types.Message):
+            usage = (
+                "❌ Формат: /autosmm_providers [add имя url ключ | remove имя | "
+                "map услуга провайдер:ID ... | unmap услуга]"
+            )
+            try:
+                args = (m.text or "").split()[1:]
+                action = args[0] if args else ""
+                settings = dict(SettingsCache.get_settings())
+                providers = [dict(p) for p in settings.get("providers") or []]
+                service_map = {key: dict(value) for key, value in (settings.get("service_map") or {}).items()}
+                
+                if action == "add" and len(args) == 4:
+                    name, url, key = args[1:]
+                    for validator, value in ((Validator.validate_provider_name, name),
+                                             (Validator.validate_url, url), (Validator.validate_api_key, key)):
+                        is_valid, error = validator(value)
+                        if not is_valid:
+                            bot.reply_to(m, f"❌ {error}")
+                            return
+                    if name in ("API_1", "API_2"):
+                        bot.reply_to(m, "❌ API_1 и API_2 настраиваются в /autosmm")
+                        return
+                    providers = [p for p in providers if p.get("name") != name]
+                    providers.append({"name": name, "url": url, "key": key})
+                    settings["providers"] = providers
+                elif action == "remove" and len(args) == 2:
+                    settings["providers"] = [p for p in providers if p.get("name") != args[1]]
+                elif action == "map" and len(args) >= 3:
+                    mapping = {}
+                    for item in args[2:]:
+                        name, _, service_id = item.partition(":")
+                        is_valid, error = Validator.validate_service_id(service_id)
+                        if not name or not is_valid:
+                            bot.reply_to(m, f"❌ {item}: {error or 'ожидается провайдер:ID'}")
+                            return
+                        mapping[name] = int(service_id)
+                    service_map[args[1]] = mapping
+                    settings["service_map"] = service_map
+                elif action == "unmap" and len(args) == 2:
+                    service_map.pop(args[1], None)
+                    settings["service_map"] = service_map
+                elif action:
+                    bot.reply_to(m, usage)
+                    return
+                
+                if action and not save_settings(settings):
+                    bot.reply_to(m, "❌ Не удалось сохранить настройки")
+                    return
+                bot.reply_to(m, format_providers())
+            except Exception as e:
+                logger.error(f"Ошибка команды autosmm_providers: {e}", exc_info=True)
+                bot.reply_to(m, "❌ Ошибка управления провайдерами")
+        
+        def send_refunds_command(m: types.Message):
+            try:
+                args = (m.text or "").split()[1:]
+                action = args[0] if args else ""
+                
+                if action in ("retry", "drop") and len(args) == 2:
+                    handler = RefundQueue.retry if action == "retry" else RefundQueue.drop
+                    if not handler(args[1]):
+                        bot.reply_to(m, f"❌ Возврат #{args[1]} не найден среди ожидающих")
+                        return
+                    bot.reply_to(m, f"✅ Возврат #{args[1]}: {'повтор запущен' if action == 'retry' else 'снят с очереди'}")
+                    return
+                elif action:
+                    bot.reply_to(m, "❌ Формат: /autosmm_refunds [retry ID | drop ID]")
+                    return
+                
+                bot.reply_to(m, format_refunds())
+            except Exception as e:
+                logger.error(f"Ошибка команды autosmm_refunds: {e}", exc_info=True)
+                bot.reply_to(m, "❌ Ошибка очереди возвратов")
+        
+        def send_deferred_command(m: types.Message):
+            try:
+                args = (m.text or "").split()[1:]
+                action = args[0] if args else ""
+                
+                if action == "created" and len(args) == 3 and args[2].isdigit():
+                    bot.reply_to(m, DeferredSubmissions.resolve(cardinal, args[1], action, args[2]))
+                elif action in ("resend", "refund") and len(args) == 2:
+                    bot.reply_to(m, DeferredSubmissions.resolve(cardinal, args[1], action))
+                elif action:
+                    bot.reply_to(m, "❌ Формат: /autosmm_deferred [created ID ID_НА_ПАНЕЛИ | resend ID | refund ID]")
+                else:
+                    bot.reply_to(m, format_deferred())
+            except Exception as e:
+                logger.error(f"Ошибка команды autosmm_deferred: {e}", exc_info=True)
+                bot.reply_to(m, "❌ Ошибка отложенных заказов")
+        
+        def send_reconcile_command(m: types.Message):
+            try:
+                position = reconcile_worker.submit(Reconciler.run, cardinal, True)
+                queued = f" (в очереди: {position})" if position else ""
+                bot.reply_to(m, f"🧾 Сверка с FunPay и панелями запущена{queued}, отчет придет сюда.")
+            except Exception as e:
+                logger.error(f"Ошибка команды autosmm_reconcile: {e}", exc_info=True)
+                bot.reply_to(m, "❌ Ошибка запуска сверки")
+        
+        def send_bulk_command(m: types.Message):
+            try:
+                request, error = BulkOperations.parse((m.text or "").split()[1:])
+                if error:
+                    bot.reply_to(m, error)
+                    return
+                action = request["action"]
+                selected, missing = BulkOperations.select(load_orders(), request)
+                not_found = f"\nНет среди активных: {', '.join(missing[:10])}{' …' if len(missing) > 10 else ''}" if missing else ""
+                if not selected:
+                    bot.reply_to(m, f"📋 Под запрос не попал ни один активный заказ{not_found}")
+                    return
+                
+                # Рефилл и отмена меняют заказы на панели: сначала показать, что будет затронуто
+                if action != "status" and not request["confirm"]:
+                    shown = ", ".join(selected[:BulkOperations.SHOWN])
+                    more = f" и еще {len(selected) - BulkOperations.SHOWN}" if len(selected) > BulkOperations.SHOWN else ""
+                    bot.reply_to(
+                        m, f"⚠️ {BulkOperations.ACTIONS[action].capitalize()} для {len(selected)} заказов: "
+                           f"{shown}{more}{not_found}\n\nДля выполнения повторите команду с confirm в конце."
+                    )
+                    return
+                
+                position = bulk_worker.qsize()
+                queued = f" (в очереди: {position})" if position else ""
+                message = bot.reply_to(
+                    m, f"⏳ {BulkOperations.ACTIONS[action].capitalize()} для {len(selected)} заказов{queued}{not_found}"
+                )
+                bulk_worker.submit(BulkOperations.execute, bot, message.chat.id, message.message_id, action, selected)
+            except Exception as e:
+                logger.error(f"Ошибка команды autosmm_bulk: {e}", exc_info=True)
+                bot.reply_to(m, "❌ Ошибка массовой операции")
+        
         # Главное меню настроек
         settings_smm_keyboard = InlineKeyboardMarkup(row_width=1)
         set_api = InlineKeyboardButton("🔗 API URL", callback_data='set_api')
@@ -1379,9 +6437,10 @@ def init_commands(cardinal: Cardinal, *args):
         set_usersm_settings = InlineKeyboardButton("🛠 Настройки", callback_data='set_usersm_settings')
         pay_orders = InlineKeyboardButton("📝 Оплаченные заказы", callback_data='pay_orders')
         active_orders = InlineKeyboardButton("📋 Активные заказы", callback_data='active_orders')
+        set_profiling = InlineKeyboardButton("🧪 Профилирование", callback_data='set_profiling')
         settings_smm_keyboard.row(set_api, set_api_key)
         settings_smm_keyboard.row(set_api_2, set_api_key_2)
-        settings_smm_keyboard.add(set_usersm_settings, pay_orders, active_orders)
+        settings_smm_keyboard.add(set_usersm_settings, pay_orders, active_orders, set_profiling)
         
         def update_alerts_keyboard():
             """Обновление клавиатуры настроек"""
@@ -1400,6 +6459,8 @@ def init_commands(cardinal: Cardinal, *args):
                 ("set_start_mess", "Сообщение при запуске FPC"),
                 ("set_tg_private", "Закрытые ТГ каналы/группы"),
                 ("set_recreated_order", "Пересоздание заказа"),
+                ("set_provider_routing", "Выбор панели по цене"),
+                ("set_hedged_reads", "Дубли медленных запросов статуса"),
             ]:
                 icon = "🔔" if settings.get(key, False) and "alert" in key else ("🟢" if settings.get(key, False) else "🔴")
                 if "alert" in key and not settings.get(key, False):
@@ -1419,14 +6480,14 @@ def init_commands(cardinal: Cardinal, *args):
         # Обработчик команды /autosmm
         def send_settings(m: types.Message):
             try:
-                bot.reply_to(m, "API 1: `ID:`\nAPI 2: `ID2:`\n\n⚙️ AutoSmm:", reply_markup=settings_smm_keyboard, parse_mode='Markdown')
+                bot.reply_to(m, "API 1: `ID:`\nAPI 2: `ID2:`\nУслуга из карты: `SVC:`\n\n⚙️ AutoSmm:", reply_markup=settings_smm_keyboard, parse_mode='Markdown')
             except Exception as e:
                 logger.error(f"Ошибка send_settings: {e}")
         
         # Обработчик callback кнопок
         def edit(call: telebot.types.CallbackQuery):
             try:
-                settings = SettingsCache.get_settings()
+                settings = dict(SettingsCache.get_settings())
                 
                 if call.data == 'set_usersm_settings':
                     bot.edit_message_text(
@@ -1441,7 +6502,7 @@ def init_commands(cardinal: Cardinal, *args):
                     'set_alert_neworder', 'set_alert_errororder',
                     'set_alert_smmbalance_new', 'set_alert_smmbalance',
                     'set_refund_smm', 'set_start_mess', 'set_auto_refill',
-                    'set_tg_private', 'set_recreated_order'
+                    'set_tg_private', 'set_recreated_order', 'set_provider_routing', 'set_hedged_reads'
                 ]:
                     settings[call.data] = not settings.get(call.data, False)
                     save_settings(settings)
@@ -1490,6 +6551,9 @@ def init_commands(cardinal: Cardinal, *args):
                         state=f"setting_{setting_key}"
                     )
                 
+                elif call.data == 'set_profiling':
+                    bot.answer_callback_query(call.id, toggle_profiling(call.message.chat.id), show_alert=True)
+                
                 elif call.data == 'delete_back_butt':
                     bot.delete_message(call.message.chat.id, call.message.message_id)
                     tg.clear_state(call.message.chat.id, call.from_user.id)
@@ -1505,12 +6569,12 @@ def init_commands(cardinal: Cardinal, *args):
                     else:
                         orders_text = "📝 Оплаченные заказы:\n\n"
                         for order in orders_data[:10]:  # Ограничиваем 10 заказами
-                            orders_text += f"🆔 ID: {order.get('OrderID', 'N/A')}\n"
-                            orders_text += f"⠀∟📋 Название: {order.get('Order', 'N/A')}\n"
-                            orders_text += f"⠀∟🔢 Кол-во: {order.get('Amount', 'N/A')}\n"
-                            orders_text += f"⠀∟👤 Покупатель: {order.get('buyer', 'N/A')}\n"
-                            orders_text += f"⠀∟📅 Дата: {order.get('OrderDateTime', 'N/A')}\n"
-                            orders_text += f"⠀∟🔗 Ссылка: {order.get('url', 'N/A')}\n\n"
+                            orders_text += f"🆔 ID: {order.order_id}\n"
+                            orders_text += f"⠀∟📋 Название: {order.title or 'N/A'}\n"
+                            orders_text += f"⠀∟🔢 Кол-во: {order.amount}\n"
+                            orders_text += f"⠀∟👤 Покупатель: {order.buyer}\n"
+                            orders_text += f"⠀∟📅 Дата: {order.created_at or 'N/A'}\n"
+                            orders_text += f"⠀∟🔗 Ссылка: {order.url or 'N/A'}\n\n"
                         
                         if len(orders_data) > 10:
                             orders_text += f"... и еще {len(orders_data) - 10} заказов"
@@ -1529,9 +6593,9 @@ def init_commands(cardinal: Cardinal, *args):
                         orders_text = "📋 Активные заказы:\n\n"
                         for order_id, order in list(orders_data.items())[:10]:
                             orders_text += f"🆔 ID: {order_id}\n"
-                            orders_text += f"⠀∟🔢 Кол-во: {order.get('order_amount', 'N/A')}\n"
-                            orders_text += f"⠀∟📅 Дата: {order.get('orderdatetime', 'N/A')}\n"
-                            orders_text += f"⠀∟📋 Статус: {order.get('status', 'N/A')}\n\n"
+                            orders_text += f"⠀∟🔢 Кол-во: {order.amount}\n"
+                            orders_text += f"⠀∟📅 Дата: {order.created_at or 'N/A'}\n"
+                            orders_text += f"⠀∟📋 Статус: {order.status}\n\n"
                         
                         if len(orders_data) > 10:
                             orders_text += f"... и еще {len(orders_data) - 10} заказов"
@@ -1617,7 +6681,7 @@ def init_commands(cardinal: Cardinal, *args):
             'set_alert_smmbalance_new', 'set_alert_smmbalance',
             'set_refund_smm', 'set_auto_refill', 'set_start_mess',
             'set_tg_private', 'pay_orders', 'active_orders',
-            'set_recreated_order', 'delete_back_butt'
+            'set_recreated_order', 'set_provider_routing', 'set_hedged_reads', 'delete_back_butt', 'set_profiling'
         ])
         
         tg.msg_handler(
@@ -1630,10 +6694,32 @@ def init_commands(cardinal: Cardinal, *args):
         
         tg.msg_handler(send_settings, commands=["autosmm"])
         tg.msg_handler(send_smm_balance_command, commands=["check_balance"])
+        tg.msg_handler(send_stats_command, commands=["autosmm_stats"])
+        tg.msg_handler(send_export_command, commands=["autosmm_export"])
+        tg.msg_handler(send_metrics_command, commands=["autosmm_metrics"])
+        tg.msg_handler(send_trace_command, commands=["autosmm_trace"])
+        tg.msg_handler(send_profile_command, commands=["autosmm_profile"])
+        tg.msg_handler(send_checker_command, commands=["autosmm_checker"])
+        tg.msg_handler(send_providers_command, commands=["autosmm_providers"])
+        tg.msg_handler(send_refunds_command, commands=["autosmm_refunds"])
+        tg.msg_handler(send_reconcile_command, commands=["autosmm_reconcile"])
+        tg.msg_handler(send_deferred_command, commands=["autosmm_deferred"])
+        tg.msg_handler(send_bulk_command, commands=["autosmm_bulk"])
         
         cardinal.add_telegram_commands(UUID, [
             ("autosmm", f"настройки {NAME}", True),
-            ("check_balance", f"баланс {NAME}", True)
+            ("check_balance", f"баланс {NAME}", True),
+            ("autosmm_stats", f"статистика продаж {NAME}", True),
+            ("autosmm_export", f"выгрузка истории {NAME}", True),
+            ("autosmm_metrics", f"метрики {NAME}", True),
+            ("autosmm_trace", f"трассировка заказа {NAME}", True),
+            ("autosmm_profile", f"профилирование {NAME}", True),
+            ("autosmm_checker", f"управление чекером {NAME}", True),
+            ("autosmm_providers", f"провайдеры и маршрутизация {NAME}", True),
+            ("autosmm_refunds", f"очередь возвратов {NAME}", True),
+            ("autosmm_reconcile", f"сверка с FunPay и панелями {NAME}", True),
+            ("autosmm_deferred", f"отложенные заказы {NAME}", True),
+            ("autosmm_bulk", f"массовые операции с заказами {NAME}", True)
         ])
         
         logger.info("Telegram команды успешно инициализированы")
@@ -1650,4 +6736,4 @@ BIND_TO_PRE_INIT = [init_commands]
 BIND_TO_POST_INIT = [checkbox]
 BIND_TO_NEW_ORDER = [bind_to_new_order]
 BIND_TO_NEW_MESSAGE = [msg_hook]
-BIND_TO_DELETE = None
+BIND_TO_DELETE = shutdown
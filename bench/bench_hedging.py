@@ -0,0 +1,114 @@
+"""
+Бенчмарк дублирования медленных чтений статуса (hedged reads).
+
+Последовательно запрашивает статусы заказов у локальной панели, часть
+ответов которой очень медленные, с дублированием и без него, и сравнивает
+перцентили задержки и общее время прохода, как в цикле чекера.
+
+Запуск:
+    python bench/bench_hedging.py
+    python bench/bench_hedging.py --requests 500 --slow-rate 0.02 --slow-ms 20000
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fpc_stubs  # noqa: E402
+from stub_panel import PanelConfig, StubPanel  # noqa: E402
+
+
+def percentiles(values: list) -> dict:
+    ordered = sorted(values)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+    return {"p50_ms": pick(0.5), "p90_ms": pick(0.9), "p99_ms": pick(0.99), "max_ms": round(ordered[-1] * 1000, 1)}
+
+
+def sweep(plugin, panel: StubPanel, order_ids: list, hedged: bool) -> dict:
+    """Один проход по заказам, как в check_orders_cycle"""
+    plugin.save_settings(dict(
+        plugin.DEFAULT_SETTINGS, api_url=panel.url, api_key=panel.api_key,
+        set_hedged_reads=hedged, max_retries=1,
+    ))
+    plugin.ProviderHealth._samples.clear()
+    plugin.ProviderHealth._hosts.clear()
+
+    durations, failed = [], 0
+    started = time.perf_counter()
+    for order_id in order_ids:
+        request_started = time.perf_counter()
+        if plugin.SocTypeAPI.get_order_status(order_id, panel.url, panel.api_key) is None:
+            failed += 1
+        durations.append(time.perf_counter() - request_started)
+    total = time.perf_counter() - started
+    return {"sweep_sec": round(total, 2), "failed": failed, **percentiles(durations)}
+
+
+def run(requests: int, latency_ms: float, slow_rate: float, slow_ms: float, timeout: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix="autosmm_hedge_")
+    cwd = os.getcwd()
+    panel = StubPanel(PanelConfig(
+        latency_ms=latency_ms, slow_rate=slow_rate, slow_ms=slow_ms, start_delay=0, seed=1,
+    )).start()
+    try:
+        plugin = fpc_stubs.load_plugin(workdir)
+        plugin.SocTypeAPI._timeout = timeout
+        order_ids = [
+            plugin.SocTypeAPI.create_order(100, "https://t.me/bench", 100, panel.url, panel.api_key)
+            for _ in range(requests)
+        ]
+        panel.stats.slow_responses = 0
+        plain = sweep(plugin, panel, order_ids, hedged=False)
+        plain["slow_responses"] = panel.stats.slow_responses
+        panel.stats.slow_responses = 0
+        hedged = sweep(plugin, panel, order_ids, hedged=True)
+        hedged["slow_responses"] = panel.stats.slow_responses
+        hedged["hedges"] = {
+            dict(key[1:]).get("winner"): value
+            for key, value in plugin.Metrics._counters.items() if key[0] == "autosmm_api_hedged_total"
+        }
+        return {
+            "benchmark": "hedging",
+            "plugin_version": plugin.VERSION,
+            "python": platform.python_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "params": {"requests": requests, "latency_ms": latency_ms, "slow_rate": slow_rate, "slow_ms": slow_ms},
+            "plain": plain,
+            "hedged": hedged,
+        }
+    finally:
+        panel.stop()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300, help="запросов статуса за проход")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="обычная задержка панели")
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="доля медленных ответов")
+    parser.add_argument("--slow-ms", type=float, default=10000.0, help="задержка медленного ответа")
+    parser.add_argument("--timeout", type=int, default=30, help="api_timeout, сек")
+    parser.add_argument("--output", help="файл для результата (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    logging.getLogger("FPC").setLevel(logging.CRITICAL)
+    report = json.dumps(
+        run(args.requests, args.latency_ms, args.slow_rate, args.slow_ms, args.timeout), indent=2, ensure_ascii=False
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Бенчмарк разбора ссылок (LinkParser) против прежнего регулярного выражения.
+
+Замеряет скорость на корпусе сообщений покупателей и время разбора
+враждебных строк растущей длины: время должно расти линейно.
+
+Запуск:
+    python bench/bench_links.py
+    python bench/bench_links.py --repeat 2000 --output links.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fpc_stubs  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "links.txt")
+
+# Шаблон extract_links до появления LinkParser
+LEGACY_PATTERN = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+
+
+def load_corpus(path: str = CORPUS) -> list:
+    with open(path, encoding="utf-8") as file:
+        return [line.rstrip("\n") for line in file if line.strip() and not line.startswith("#")]
+
+
+def adversarial(size: int) -> dict:
+    """Строки, на которых регулярки с вложенными повторами деградируют"""
+    return {
+        "letters": "a" * size,
+        "dots": "a." * (size // 2),
+        "dashes_path": "https://t.me/" + "a-" * (size // 2),
+        "many_tokens": "t.me/x " * (size // 7),
+        "unclosed_scheme": "http://" * (size // 7),
+    }
+
+
+def timed(func, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+def run(repeat: int, sizes: list) -> dict:
+    workdir = tempfile.mkdtemp(prefix="autosmm_links_")
+    cwd = os.getcwd()
+    try:
+        plugin = fpc_stubs.load_plugin(workdir)
+        corpus = load_corpus()
+
+        def parse_corpus():
+            for text in corpus:
+                plugin.LinkParser.find_all(text)
+
+        def legacy_corpus():
+            for text in corpus:
+                LEGACY_PATTERN.findall(text)
+
+        per_message = timed(parse_corpus, repeat) / len(corpus)
+        legacy_per_message = timed(legacy_corpus, repeat) / len(corpus)
+
+        scaling = {}
+        for size in sizes:
+            for name, text in adversarial(size).items():
+                scaling.setdefault(name, {})[size] = round(
+                    timed(lambda: plugin.LinkParser.find_all(text), 3) * 1000, 3
+                )
+
+        recognized = sum(1 for text in corpus if plugin.LinkParser.find_all(text))
+        return {
+            "benchmark": "links",
+            "plugin_version": plugin.VERSION,
+            "python": platform.python_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "corpus_messages": len(corpus),
+            "corpus_with_links": recognized,
+            "corpus_with_links_legacy": sum(1 for text in corpus if LEGACY_PATTERN.findall(text)),
+            "per_message_us": round(per_message * 1e6, 3),
+            "legacy_per_message_us": round(legacy_per_message * 1e6, 3),
+            "adversarial_ms": scaling,
+        }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=500, help="проходов по корпусу")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="длины враждебных строк через запятую")
+    parser.add_argument("--output", help="файл для результата (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    report = json.dumps(run(args.repeat, sizes), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Бенчмарк слоя хранения AutoSmm без FunPay и сети.
+
+Генерирует синтетические orders.json и payorders.json нужного размера и
+измеряет загрузку/сохранение, поиск заказа по покупателю, проход чекера
+и пиковую память. Результат - JSON для сравнения версий.
+
+Запуск:
+    python bench/bench_storage.py --sizes 1000,10000,100000 --output result.json
+    python bench/bench_storage.py --compare old.json new.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fpc_stubs  # noqa: E402
+
+API_URL = "https://panel.bench.io/api/v2"
+API_KEY = "benchmarkkey0123456789"
+
+
+class BenchCardinal:
+    """Минимальный Cardinal: сообщения покупателям никуда не уходят"""
+
+    def __init__(self):
+        self.sent = 0
+        self.telegram = None
+        self.account = self
+
+    def send_message(self, chat_id, text, *args, **kwargs):
+        self.sent += 1
+
+    def refund(self, order_id):
+        pass
+
+
+def make_orders(plugin, n: int) -> dict:
+    """Активные заказы в формате orders.json"""
+    return {
+        str(10_000_000 + i): plugin.ActiveOrder.from_dict({
+            "service_id": 100 + i % 50,
+            "chat_id": 1_000_000 + i,
+            "order_id": f"FP{i:08d}",
+            "order_url": f"https://t.me/channel_{i}",
+            "order_amount": 1000,
+            "partial_amount": 0,
+            "orderdatetime": "2026-01-01 12:00:00",
+            "status": "In progress",
+        })
+        for i in range(n)
+    }
+
+
+def make_payorders(plugin, n: int) -> list:
+    """Оплаченные заказы в формате payorders.json"""
+    return [
+        plugin.PaidOrder.from_dict({
+            "OrderID": f"FP{i:08d}",
+            "Amount": 1000,
+            "OrderPrice": 150.0,
+            "OrderCurrency": "₽",
+            "Order": f"Подписчики Telegram 1000 шт #{i % 20}",
+            "service_id": 100 + i % 50,
+            "buyer": f"buyer_{i}",
+            "url": "",
+            "NewUser": True,
+            "chat_id": "",
+            "OrderDateTime": "2026-01-01 12:00:00",
+            "api_type": "API_1",
+        })
+        for i in range(n)
+    ]
+
+
+def summarize(durations: list, items: int) -> dict:
+    """Статистика по серии замеров"""
+    ordered = sorted(durations)
+    mean = statistics.fmean(ordered)
+    return {
+        "runs": len(ordered),
+        "mean_ms": round(mean * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "items_per_sec": round(items / mean, 1) if mean else None,
+    }
+
+
+def measure(func, repeat: int, setup=None) -> list:
+    durations = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def peak_memory(func, setup=None) -> int:
+    """Пиковая память одного вызова в байтах"""
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def reset_plugin_state(plugin) -> None:
+    """Сброс кэшей плагина между размерами"""
+    plugin.SettingsCache.invalidate()
+    plugin.SalesStats._data = None
+    plugin.OrderTrace._traces = None
+    plugin.pending_confirmations.clear()
+    plugin.ActiveOrderStore.invalidate()
+    reset_checker_schedule(plugin)
+
+
+def reset_checker_schedule(plugin) -> None:
+    """Все заказы считаются просроченными: проход чекера проверяет каждый"""
+    plugin.CheckerSchedule.invalidate()
+    if os.path.exists(plugin.CHECKER_STATE_FILE):
+        os.remove(plugin.CHECKER_STATE_FILE)
+
+
+def bench_size(plugin, size: int, repeat: int, lookups: int, checker_max_size: int) -> dict:
+    orders = make_orders(plugin, size)
+    payorders = make_payorders(plugin, size)
+    result = {"size": size}
+
+    # Загрузка и сохранение
+    plugin.save_orders(orders)
+    plugin.save_payorders(payorders)
+    result["orders_file_bytes"] = os.path.getsize(plugin.ORDERS_FILE)
+    result["payorders_file_bytes"] = os.path.getsize(plugin.PAYORDERS_FILE)
+
+    # load_orders отдает кэш, пока файл не изменился; холодная загрузка - разбор файла
+    result["load_orders"] = summarize(measure(plugin.load_orders, repeat), size)
+    result["load_orders_cold"] = summarize(
+        measure(plugin.load_orders, repeat, setup=plugin.ActiveOrderStore.invalidate), size
+    )
+    result["save_orders"] = summarize(measure(lambda: plugin.save_orders(orders), repeat), size)
+    result["load_payorders"] = summarize(measure(plugin.load_payorders, repeat), size)
+    result["save_payorders"] = summarize(measure(lambda: plugin.save_payorders(payorders), repeat), size)
+
+    # Поиск заказа по покупателю: половина попаданий, половина промахов
+    rnd = random.Random(size)
+    buyers = [
+        f"buyer_{rnd.randrange(size)}" if i % 2 == 0 else f"stranger_{i}"
+        for i in range(lookups)
+    ]
+
+    def lookup_all():
+        for buyer in buyers:
+            plugin.find_order_by_buyer(payorders, buyer)
+
+    result["find_order_by_buyer"] = summarize(measure(lookup_all, repeat), lookups)
+
+    # Проход чекера: статусы отдаются мгновенно, 1% заказов завершается
+    def fake_status(order_id, api_url, api_key, *args, **kwargs):
+        done = int(order_id) % 100 == 0
+        return {
+            "status": "Completed" if done else "In progress",
+            "remains": "0" if done else "10",
+            "charge": "0.10",
+            "currency": "USD",
+            "start_count": "100",
+        }
+
+    plugin.SocTypeAPI.get_order_status = staticmethod(fake_status)
+    cardinal = BenchCardinal()
+
+    def reset_orders():
+        plugin.save_orders(orders)
+        reset_checker_schedule(plugin)
+
+    # Пиковая память по операциям
+    result["peak_memory_bytes"] = {
+        "load_orders_cold": peak_memory(plugin.load_orders, setup=plugin.ActiveOrderStore.invalidate),
+        "save_orders": peak_memory(lambda: plugin.save_orders(orders)),
+        "load_payorders": peak_memory(plugin.load_payorders),
+    }
+
+    # Чекер может расти быстрее линейного, большие размеры включаются явно
+    if size <= checker_max_size:
+        result["checker_cycle"] = summarize(
+            measure(lambda: plugin.check_orders_cycle(cardinal), repeat, setup=reset_orders),
+            size,
+        )
+        result["peak_memory_bytes"]["checker_cycle"] = peak_memory(
+            lambda: plugin.check_orders_cycle(cardinal), setup=reset_orders
+        )
+    else:
+        result["checker_cycle"] = {"skipped": f"size > --checker-max-size ({checker_max_size})"}
+    return result
+
+
+def run(sizes: list, repeat: int, lookups: int, checker_max_size: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix="autosmm_bench_")
+    cwd = os.getcwd()
+    try:
+        plugin = fpc_stubs.load_plugin(workdir)
+        plugin.save_settings(dict(plugin.DEFAULT_SETTINGS, api_url=API_URL, api_key=API_KEY, checker_warmup_window=0))
+
+        results = []
+        for size in sizes:
+            size_dir = os.path.join(workdir, str(size))
+            os.makedirs(size_dir, exist_ok=True)
+            os.chdir(size_dir)
+            plugin.save_settings(dict(plugin.DEFAULT_SETTINGS, api_url=API_URL, api_key=API_KEY, checker_warmup_window=0))
+            reset_plugin_state(plugin)
+
+            started = time.perf_counter()
+            results.append(bench_size(plugin, size, repeat, lookups, checker_max_size))
+            print(f"size={size}: {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+        return {
+            "benchmark": "storage",
+            "plugin_version": plugin.VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": repeat,
+            "results": results,
+        }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """Сравнение двух файлов результатов по mean_ms"""
+    with open(old_path, encoding="utf-8") as file:
+        old = {r["size"]: r for r in json.load(file)["results"]}
+    with open(new_path, encoding="utf-8") as file:
+        new = {r["size"]: r for r in json.load(file)["results"]}
+
+    for size in sorted(set(old) & set(new)):
+        print(f"size={size}")
+        for name, data in new[size].items():
+            if isinstance(data, dict) and "mean_ms" in data and "mean_ms" in old[size].get(name, {}):
+                before, after = old[size][name]["mean_ms"], data["mean_ms"]
+                ratio = after / before if before else float("inf")
+                print(f"  {name:<22} {before:>10.3f} ms -> {after:>10.3f} ms  x{ratio:.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="размеры через запятую")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов на замер")
+    parser.add_argument("--lookups", type=int, default=1000, help="поисков по покупателю за замер")
+    parser.add_argument("--checker-max-size", type=int, default=10000,
+                        help="максимальный размер для замера прохода чекера")
+    parser.add_argument("--output", help="файл для результата (по умолчанию stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два результата")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    logging.getLogger("FPC").setLevel(logging.CRITICAL)
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    report = json.dumps(run(sizes, args.repeat, args.lookups, args.checker_max_size), indent=2, ensure_ascii=False)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Заглушки модулей FunPay Cardinal для запуска плагина вне FPC.
+
+Подменяются только модули самого Cardinal (cardinal, FunPayAPI, locales,
+tg_bot), и только если их нельзя импортировать. Зависимости плагина
+(requests, pyTelegramBotAPI) должны быть установлены.
+"""
+
+import enum
+import importlib
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+authorized_users = []
+
+
+class MessageTypes(enum.Enum):
+    NON_SYSTEM = 0
+    ORDER_PURCHASED = 1
+    ORDER_CONFIRMED = 2
+    REFUND = 3
+
+
+class NewOrderEvent:
+    def __init__(self, order):
+        self.order = order
+
+
+class NewMessageEvent:
+    def __init__(self, message):
+        self.message = message
+
+
+class Localizer:
+    def translate(self, key, *args, **kwargs):
+        return key
+
+
+class Cardinal:
+    pass
+
+
+def _module(name: str, **attrs) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def _importable(name: str) -> bool:
+    try:
+        importlib.import_module(name)
+        return True
+    except ImportError:
+        return False
+
+
+def install() -> None:
+    """Регистрация заглушек для недоступных модулей FPC"""
+    if not _importable("cardinal"):
+        _module("cardinal", Cardinal=Cardinal)
+    
+    if not _importable("FunPayAPI.updater.events"):
+        events = _module(
+            "FunPayAPI.updater.events",
+            NewOrderEvent=NewOrderEvent,
+            NewMessageEvent=NewMessageEvent,
+            __all__=["NewOrderEvent", "NewMessageEvent"],
+        )
+        types_module = _module("FunPayAPI.types", MessageTypes=MessageTypes)
+        updater = _module("FunPayAPI.updater", events=events)
+        _module("FunPayAPI", updater=updater, types=types_module)
+    
+    if not _importable("locales.localizer"):
+        localizer = _module("locales.localizer", Localizer=Localizer)
+        _module("locales", localizer=localizer)
+    
+    if not _importable("tg_bot.utils"):
+        utils = _module("tg_bot.utils", load_authorized_users=lambda: list(authorized_users))
+        _module("tg_bot", utils=utils)
+
+
+def load_plugin(workdir: str):
+    """Импорт плагина с хранилищем в workdir"""
+    install()
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return importlib.import_module("AutoSmm")
@@ -0,0 +1,96 @@
+"""
+Фаззинг LinkParser на мутациях корпуса bench/corpus/links.txt.
+
+Проверяет инварианты:
+- разбор не падает и укладывается в лимит времени;
+- каноническая ссылка разбирается в саму себя (идемпотентность);
+- каноническая ссылка не содержит пробелов и начинается со схемы.
+
+Запуск:
+    python bench/fuzz_links.py --iterations 100000 --seed 1
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fpc_stubs  # noqa: E402
+from bench_links import load_corpus  # noqa: E402
+
+ALPHABET = "abcxyzABC0189_-.:/?#&=+@%()[]«»,;!'\" \tт​"
+MAX_SECONDS = 0.05
+
+
+def mutate(rnd: random.Random, text: str, corpus: list) -> str:
+    """Случайная правка: вставка, удаление, повтор или склейка с другим сообщением"""
+    ops = rnd.randint(1, 4)
+    for _ in range(ops):
+        choice = rnd.random()
+        pos = rnd.randint(0, len(text))
+        if choice < 0.35:
+            text = text[:pos] + "".join(rnd.choice(ALPHABET) for _ in range(rnd.randint(1, 5))) + text[pos:]
+        elif choice < 0.6 and text:
+            end = min(len(text), pos + rnd.randint(1, 6))
+            text = text[:pos] + text[end:]
+        elif choice < 0.8:
+            chunk = text[pos:pos + rnd.randint(1, 8)]
+            text = text[:pos] + chunk * rnd.randint(2, 300) + text[pos:]
+        else:
+            text = text[:pos] + " " + rnd.choice(corpus) + " " + text[pos:]
+    return text
+
+
+def check(plugin, text: str, failures: list) -> None:
+    parser = plugin.LinkParser
+    started = time.perf_counter()
+    links = parser.find_all(text)
+    elapsed = time.perf_counter() - started
+    if elapsed > MAX_SECONDS:
+        failures.append(("slow", round(elapsed, 4), text[:200]))
+
+    for link in links:
+        if not link.url.startswith(("http://", "https://")) or any(ch.isspace() for ch in link.url):
+            failures.append(("bad_url", link, text[:200]))
+            continue
+        if link.kind == "invalid":
+            continue
+        again = parser.parse(link.url, link.platform)
+        if again is None or again.url != link.url:
+            failures.append(("not_idempotent", link, again))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--show", type=int, default=10, help="сколько ошибок показать")
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+    rnd = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix="autosmm_fuzz_")
+    try:
+        plugin = fpc_stubs.load_plugin(workdir)
+        corpus = load_corpus()
+        failures = []
+
+        for text in corpus:
+            check(plugin, text, failures)
+        for _ in range(args.iterations):
+            check(plugin, mutate(rnd, rnd.choice(corpus), corpus), failures)
+
+        print(f"seed={seed} iterations={args.iterations} failures={len(failures)}")
+        for failure in failures[:args.show]:
+            print(" ", failure)
+        sys.exit(1 if failures else 0)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
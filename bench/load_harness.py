@@ -0,0 +1,392 @@
+"""
+Нагрузочный прогон AutoSmm с фейковым Cardinal и локальной SMM панелью.
+
+Покупатели получают синтетические NewOrderEvent, присылают ссылку и «+»
+через NewMessageEvent, а реальные bind_to_new_order, msg_hook и
+process_orders обрабатывают их против stub_panel. В конце выводится JSON
+с пропускной способностью, перцентилями задержек и числом ошибок.
+
+Запуск:
+    python bench/load_harness.py --orders 200 --rate 20 --latency-ms 150 --error-rate 0.02
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fpc_stubs  # noqa: E402
+from stub_panel import PanelConfig, StubPanel  # noqa: E402
+
+
+# ====================
+# ФЕЙКОВЫЙ CARDINAL
+# ====================
+
+@dataclass
+class FakeOrderShortcut:
+    id: str
+    amount: int
+    price: float
+    currency: str
+    description: str
+    buyer_username: str
+
+    def __str__(self):
+        return self.description
+
+
+@dataclass
+class FakeOrder:
+    id: str
+    full_description: str
+    buyer_username: str
+
+
+@dataclass
+class FakeMessage:
+    chat_id: int
+    chat_name: str
+    text: str
+    author_id: int
+    type: object
+
+
+class FakeEvent:
+    def __init__(self, order=None, message=None):
+        self.order = order
+        self.message = message
+
+
+@dataclass
+class FakeBalance:
+    total_rub: float = 0.0
+    available_usd: float = 0.0
+    total_eur: float = 0.0
+
+
+class FakeAccount:
+    def __init__(self, harness: "LoadHarness"):
+        self.id = 0
+        self.harness = harness
+        self.orders: Dict[str, FakeOrder] = {}
+        self.refunds: List[str] = []
+        self.get_order_delay = 0.0
+
+    def get_order(self, order_id):
+        if self.get_order_delay:
+            time.sleep(self.get_order_delay)
+        return self.orders[str(order_id)]
+
+    def refund(self, order_id):
+        self.refunds.append(str(order_id))
+        self.harness.on_refund(str(order_id))
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent: List[tuple] = []
+
+    def send_message(self, chat_id, text, *args, **kwargs):
+        self.sent.append((chat_id, text))
+        return self
+
+    def send_document(self, chat_id, document, *args, **kwargs):
+        self.sent.append((chat_id, "<document>"))
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.bot = FakeBot()
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class FakeCardinal:
+    """Cardinal, который пересылает сообщения покупателям в симуляцию"""
+
+    def __init__(self, harness: "LoadHarness"):
+        self.harness = harness
+        self.account = FakeAccount(harness)
+        self.telegram = FakeTelegram()
+
+    def send_message(self, chat_id, text, *args, **kwargs):
+        self.harness.on_bot_message(int(chat_id), text)
+        return True
+
+    def get_balance(self):
+        return FakeBalance()
+
+    def add_telegram_commands(self, *args, **kwargs):
+        pass
+
+
+# ====================
+# СИМУЛЯЦИЯ
+# ====================
+
+class EventLoop:
+    """Очередь событий по времени, обрабатываемая одним потоком, как в FPC"""
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+    def schedule(self, delay: float, func: Callable, *args) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (time.time() + delay, next(self._counter), func, args))
+            self._cond.notify()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.time()):
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, func, args = heapq.heappop(self._heap)
+            func(*args)
+
+
+@dataclass
+class SimOrder:
+    order_id: str
+    chat_id: int
+    buyer: str
+    link: str
+    started: float
+    confirmed: Optional[float] = None
+    created: Optional[float] = None
+    completed: Optional[float] = None
+    failed: bool = False
+    refunded: bool = False
+    canceled: bool = False
+    messages: List[str] = field(default_factory=list)
+
+
+def percentiles(values: List[float]) -> Dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+    return {
+        "count": len(ordered),
+        "p50": pick(0.5), "p90": pick(0.9), "p95": pick(0.95), "p99": pick(0.99),
+        "max": round(ordered[-1], 3),
+    }
+
+
+class LoadHarness:
+    def __init__(self, plugin, panel: StubPanel, args):
+        self.plugin = plugin
+        self.panel = panel
+        self.args = args
+        self.loop = EventLoop()
+        self.cardinal = FakeCardinal(self)
+        self.cardinal.account.get_order_delay = args.get_order_ms / 1000
+        self.orders: Dict[str, SimOrder] = {}
+        self.by_chat: Dict[int, SimOrder] = {}
+        self._lock = threading.Lock()
+        self.handler_seconds: Dict[str, List[float]] = {"bind_to_new_order": [], "msg_hook": []}
+
+    # ---- события от покупателей ----
+
+    def _dispatch(self, name: str, func, event) -> None:
+        started = time.perf_counter()
+        func(self.cardinal, event)
+        self.handler_seconds[name].append(time.perf_counter() - started)
+
+    def new_order(self, index: int) -> None:
+        order_id = f"SIM{index:06d}"
+        chat_id = 500000 + index
+        buyer = f"sim_buyer_{index}"
+        service_id = 100 + index % 50
+        description = f"Подписчики Telegram ID: {service_id} #Quan: {self.args.quantity}"
+        sim = SimOrder(order_id, chat_id, buyer, f"https://t.me/sim_channel_{index}", time.time())
+        with self._lock:
+            self.orders[order_id] = sim
+            self.by_chat[chat_id] = sim
+
+        self.cardinal.account.orders[order_id] = FakeOrder(order_id, description, buyer)
+        shortcut = FakeOrderShortcut(order_id, 1, self.args.price, "₽", description, buyer)
+        self._dispatch("bind_to_new_order", self.plugin.bind_to_new_order, FakeEvent(order=shortcut))
+        self.loop.schedule(self.args.buyer_delay, self.buyer_says, chat_id, sim.link)
+
+    def buyer_says(self, chat_id: int, text: str) -> None:
+        sim = self.by_chat[chat_id]
+        if text == "+":
+            sim.confirmed = time.time()
+        message = FakeMessage(chat_id, sim.buyer, text, chat_id, self.plugin.MessageTypes.NON_SYSTEM)
+        self._dispatch("msg_hook", self.plugin.msg_hook, FakeEvent(message=message))
+
+    # ---- ответы бота ----
+
+    def on_bot_message(self, chat_id: int, text: str) -> None:
+        sim = self.by_chat.get(chat_id)
+        if sim is None:
+            return
+        sim.messages.append(text)
+        now = time.time()
+
+        if "проверьте детали" in text:
+            self.loop.schedule(self.args.buyer_delay, self.buyer_says, chat_id, "+")
+        elif "СОЗДАН" in text:
+            sim.created = sim.created or now
+        elif "выполнен!" in text:
+            sim.completed = sim.completed or now
+        elif "Ошибка при создании" in text:
+            sim.failed = True
+        elif "отменён" in text:
+            sim.canceled = True
+
+    def on_refund(self, order_id: str) -> None:
+        sim = self.orders.get(order_id)
+        if sim:
+            sim.refunded = True
+
+    # ---- прогон ----
+
+    def finished(self, sim: SimOrder) -> bool:
+        return bool(sim.completed or sim.failed or sim.canceled or sim.refunded)
+
+    def run(self) -> Dict:
+        settings = dict(
+            self.plugin.DEFAULT_SETTINGS,
+            api_url=self.panel.url,
+            api_key=self.panel.api_key,
+            check_interval=self.args.check_interval,
+            checker_warmup_window=self.args.check_interval,
+            set_start_mess=False,
+        )
+        self.plugin.save_settings(settings)
+
+        threading.Thread(target=self.loop.run, name="fpc-runner", daemon=True).start()
+        self.plugin.CheckerSupervisor.start(self.cardinal)
+
+        started = time.time()
+        interval = 1 / self.args.rate if self.args.rate else 0
+        for index in range(self.args.orders):
+            self.loop.schedule(index * interval, self.new_order, index)
+
+        deadline = started + self.args.orders * interval + self.args.timeout
+        while time.time() < deadline:
+            with self._lock:
+                sims = list(self.orders.values())
+            if len(sims) == self.args.orders and all(self.finished(sim) for sim in sims):
+                break
+            time.sleep(0.2)
+        elapsed = time.time() - started
+        self.loop.stop()
+        self.plugin.CheckerSupervisor.stop()
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> Dict:
+        sims = list(self.orders.values())
+        completed = [s for s in sims if s.completed]
+        created = [s for s in sims if s.created]
+        return {
+            "benchmark": "load",
+            "plugin_version": self.plugin.VERSION,
+            "params": {
+                k: v for k, v in vars(self.args).items() if k not in ("output",)
+            },
+            "elapsed_sec": round(elapsed, 2),
+            "orders": len(sims),
+            "created": len(created),
+            "completed": len(completed),
+            "failed": sum(1 for s in sims if s.failed),
+            "canceled": sum(1 for s in sims if s.canceled),
+            "refunded": sum(1 for s in sims if s.refunded),
+            "unfinished": sum(1 for s in sims if not self.finished(s)),
+            "created_per_sec": round(len(created) / elapsed, 2) if elapsed else None,
+            "completed_per_sec": round(len(completed) / elapsed, 2) if elapsed else None,
+            "latency_sec": {
+                "event_to_created": percentiles([s.created - s.started for s in created]),
+                "confirm_to_created": percentiles([s.created - s.confirmed for s in created if s.confirmed]),
+                "created_to_completed": percentiles([s.completed - s.created for s in completed if s.created]),
+                "event_to_completed": percentiles([s.completed - s.started for s in completed]),
+            },
+            "handler_sec": {name: percentiles(values) for name, values in self.handler_seconds.items()},
+            "panel": {
+                "requests": dict(self.panel.stats.requests),
+                "http_errors": self.panel.stats.http_errors,
+                "add_errors": self.panel.stats.add_errors,
+                "slow_responses": self.panel.stats.slow_responses,
+            },
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=100, help="сколько заказов создать")
+    parser.add_argument("--rate", type=float, default=10.0, help="заказов в секунду")
+    parser.add_argument("--quantity", type=int, default=100, help="множитель #Quan в лоте")
+    parser.add_argument("--price", type=float, default=100.0, help="цена заказа на FunPay")
+    parser.add_argument("--buyer-delay", type=float, default=0.5, help="задержка ответа покупателя, сек")
+    parser.add_argument("--get-order-ms", type=float, default=50.0, help="задержка account.get_order")
+    parser.add_argument("--check-interval", type=int, default=2, help="check_interval чекера, сек")
+    parser.add_argument("--timeout", type=float, default=120.0, help="ожидание после последнего заказа, сек")
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="средняя задержка панели")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="доля медленных ответов панели")
+    parser.add_argument("--slow-ms", type=float, default=20000.0, help="задержка медленного ответа")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля HTTP 500 от панели")
+    parser.add_argument("--add-error-rate", type=float, default=0.0, help="доля отказов в создании")
+    parser.add_argument("--cancel-rate", type=float, default=0.0, help="доля отмен панелью")
+    parser.add_argument("--partial-rate", type=float, default=0.0, help="доля частичных выполнений")
+    parser.add_argument("--start-delay", type=float, default=2.0, help="максимальная задержка старта, сек")
+    parser.add_argument("--speed", type=float, default=500.0, help="скорость выполнения, ед/сек")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="CRITICAL")
+    parser.add_argument("--output", help="файл для результата (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    logging.getLogger("FPC").setLevel(args.log_level)
+    panel = StubPanel(PanelConfig(
+        latency_ms=args.latency_ms, slow_rate=args.slow_rate, slow_ms=args.slow_ms,
+        error_rate=args.error_rate, add_error_rate=args.add_error_rate,
+        cancel_rate=args.cancel_rate, partial_rate=args.partial_rate,
+        start_delay=args.start_delay, speed=args.speed, seed=args.seed,
+    )).start()
+
+    workdir = tempfile.mkdtemp(prefix="autosmm_load_")
+    cwd = os.getcwd()
+    try:
+        plugin = fpc_stubs.load_plugin(workdir)
+        result = LoadHarness(plugin, panel, args).run()
+    finally:
+        panel.stop()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Локальный SMM панель-заглушка с API v2 (add, status, balance, refill, cancel, services).
+
+Задержка ответов, доля ошибок и скорость выполнения заказов настраиваются,
+поэтому панель подходит для нагрузочных прогонов плагина без реального сайта.
+
+Отдельный запуск:
+    python bench/stub_panel.py --port 8765 --latency-ms 200 --error-rate 0.05
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass
+class PanelConfig:
+    latency_ms: float = 100.0          # средняя задержка ответа
+    latency_jitter: float = 0.5        # разброс задержки, доля от средней
+    slow_rate: float = 0.0             # доля очень медленных ответов
+    slow_ms: float = 20000.0           # задержка медленного ответа
+    error_rate: float = 0.0            # доля ответов HTTP 500
+    add_error_rate: float = 0.0        # доля отказов в создании заказа
+    start_delay: float = 2.0           # максимальная задержка старта заказа, сек
+    speed: float = 500.0               # единиц в секунду при выполнении
+    cancel_rate: float = 0.0           # доля заказов, отмененных панелью
+    partial_rate: float = 0.0          # доля частично выполненных заказов
+    currency: str = "RUB"
+    balance: float = 100000.0
+    rate: float = 10.0                 # цена за 1000 единиц
+    seed: Optional[int] = None
+
+
+@dataclass
+class PanelOrder:
+    service: int
+    link: str
+    quantity: int
+    created: float
+    start_delay: float
+    outcome: str
+    refills: int = 0
+    canceled: bool = False
+
+
+@dataclass
+class PanelStats:
+    requests: Dict[str, int] = field(default_factory=dict)
+    http_errors: int = 0
+    add_errors: int = 0
+    slow_responses: int = 0
+
+
+class StubPanel:
+    """SMM панель в отдельном потоке на 127.0.0.1"""
+
+    def __init__(self, config: PanelConfig = None, port: int = 0, api_key: str = "stubpanelkey0123456789"):
+        self.config = config or PanelConfig()
+        self.api_key = api_key
+        self.orders: Dict[int, PanelOrder] = {}
+        self.stats = PanelStats()
+        self._next_id = 1000
+        self._lock = threading.Lock()
+        self._random = random.Random(self.config.seed)
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/v2"
+
+    def start(self) -> "StubPanel":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-panel", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    # ---- логика панели ----
+
+    def _status_of(self, order_id: int, order: PanelOrder) -> Dict:
+        elapsed = time.time() - order.created
+        cost = round(order.quantity / 1000 * self.config.rate, 4)
+        base = {"charge": str(cost), "currency": self.config.currency, "start_count": "100"}
+
+        if order.canceled or (order.outcome == "canceled" and elapsed >= order.start_delay):
+            return dict(base, status="Canceled", remains=str(order.quantity), charge="0")
+        if elapsed < order.start_delay:
+            return dict(base, status="Pending", remains=str(order.quantity))
+
+        done = int((elapsed - order.start_delay) * self.config.speed)
+        if done < order.quantity:
+            return dict(base, status="In progress", remains=str(order.quantity - done))
+        if order.outcome == "partial":
+            remains = max(1, order.quantity // 3)
+            return dict(base, status="Partial", remains=str(remains))
+        return dict(base, status="Completed", remains="0")
+
+    def handle(self, params: Dict[str, str]) -> Dict:
+        action = params.get("action", "")
+        with self._lock:
+            self.stats.requests[action] = self.stats.requests.get(action, 0) + 1
+
+        if params.get("key") != self.api_key:
+            return {"error": "Invalid API key"}
+
+        if action == "add":
+            if self._random.random() < self.config.add_error_rate:
+                with self._lock:
+                    self.stats.add_errors += 1
+                return {"error": "Not enough funds on balance"}
+            roll = self._random.random()
+            outcome = "canceled" if roll < self.config.cancel_rate else (
+                "partial" if roll < self.config.cancel_rate + self.config.partial_rate else "completed"
+            )
+            with self._lock:
+                self._next_id += 1
+                order_id = self._next_id
+                self.orders[order_id] = PanelOrder(
+                    service=int(params.get("service", 0)),
+                    link=params.get("link", ""),
+                    quantity=int(params.get("quantity", 0)),
+                    created=time.time(),
+                    start_delay=self._random.uniform(0, self.config.start_delay),
+                    outcome=outcome,
+                )
+            return {"order": order_id}
+
+        if action == "status":
+            if "orders" in params:
+                result = {}
+                for raw_id in params["orders"].split(","):
+                    order = self.orders.get(int(raw_id)) if raw_id.isdigit() else None
+                    result[raw_id] = self._status_of(int(raw_id), order) if order else {"error": "Incorrect order ID"}
+                return result
+            order_id = int(params.get("order", 0) or 0)
+            order = self.orders.get(order_id)
+            if not order:
+                return {"error": "Incorrect order ID"}
+            return self._status_of(order_id, order)
+
+        if action == "balance":
+            return {"balance": f"{self.config.balance:.5f}", "currency": self.config.currency}
+
+        if action == "refill":
+            order = self.orders.get(int(params.get("order", 0) or 0))
+            if not order:
+                return {"error": "Incorrect order ID"}
+            order.refills += 1
+            return {"refill": order.refills}
+
+        if action == "cancel":
+            ids = params.get("orders") or params.get("order", "")
+            result = []
+            for raw_id in ids.split(","):
+                order = self.orders.get(int(raw_id)) if raw_id.isdigit() else None
+                if order:
+                    order.canceled = True
+                    result.append({"order": int(raw_id), "cancel": 1})
+                else:
+                    result.append({"order": raw_id, "cancel": {"error": "Incorrect order ID"}})
+            return result if "orders" in params else (result[0] if result else {"error": "Incorrect order ID"})
+
+        if action == "services":
+            return [
+                {
+                    "service": service_id,
+                    "name": f"Stub service {service_id}",
+                    "type": "Default",
+                    "category": "Telegram",
+                    "rate": f"{self.config.rate:.2f}",
+                    "min": "10",
+                    "max": "100000",
+                    "refill": True,
+                    "cancel": True,
+                }
+                for service_id in range(100, 150)
+            ]
+
+        return {"error": "Incorrect request"}
+
+    def _delay(self) -> None:
+        if self._random.random() < self.config.slow_rate:
+            with self._lock:
+                self.stats.slow_responses += 1
+            time.sleep(self.config.slow_ms / 1000)
+            return
+        jitter = self.config.latency_ms * self.config.latency_jitter
+        time.sleep(max(0.0, self._random.uniform(self.config.latency_ms - jitter, self.config.latency_ms + jitter)) / 1000)
+
+    def _make_handler(self):
+        panel = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, params: Dict[str, str]):
+                panel._delay()
+                if panel._random.random() < panel.config.error_rate:
+                    with panel._lock:
+                        panel.stats.http_errors += 1
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                body = json.dumps(panel.handle(params)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                self._respond({k: v[0] for k, v in query.items()})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0) or 0)
+                query = parse_qs(self.rfile.read(length).decode("utf-8"))
+                self._respond({k: v[0] for k, v in query.items()})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--key", default="stubpanelkey0123456789")
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--add-error-rate", type=float, default=0.0)
+    parser.add_argument("--speed", type=float, default=500.0)
+    args = parser.parse_args()
+
+    config = PanelConfig(
+        latency_ms=args.latency_ms, error_rate=args.error_rate,
+        add_error_rate=args.add_error_rate, speed=args.speed,
+    )
+    panel = StubPanel(config, port=args.port, api_key=args.key).start()
+    print(f"Stub panel: {panel.url} key={panel.api_key}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        panel.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import logging
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+import fpc_stubs  # noqa: E402
+
+
+@pytest.fixture
+def plugin(tmp_path, monkeypatch):
+    """Плагин с пустым хранилищем в tmp_path"""
+    module = fpc_stubs.load_plugin(str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    logging.getLogger("FPC").setLevel(logging.CRITICAL)
+    os.makedirs(module.STORAGE_PATH, exist_ok=True)
+    module.SettingsCache.invalidate()
+    module.pending_confirmations.clear()
+    return module
+
+
+@pytest.fixture
+def cardinal():
+    """Cardinal, который запоминает отправленные сообщения"""
+    sent = []
+    return types.SimpleNamespace(
+        sent=sent,
+        account=types.SimpleNamespace(id=1),
+        send_message=lambda chat_id, text, *args, **kwargs: sent.append((chat_id, text)),
+        telegram=types.SimpleNamespace(bot=types.SimpleNamespace(send_message=lambda *args, **kwargs: None)),
+    )
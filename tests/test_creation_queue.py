@@ -0,0 +1,31 @@
+import threading
+import time
+
+
+def test_repeated_confirmation_creates_order_once(plugin, cardinal, monkeypatch):
+    order = plugin.PaidOrder("CCCC3333", 100, 10.0, "₽", "Подписчики", 1, "bob", "https://t.me/x",
+                             False, 20, "", "API_1")
+    plugin.save_payorders([order])
+    created = []
+    release = threading.Event()
+    
+    def create(c, queued, api_url, api_key):
+        created.append(queued.order_id)
+        release.wait(5)
+    
+    monkeypatch.setattr(plugin, "create_confirmed_order", create)
+    
+    # Покупатель подтверждает, пока заказ в очереди, и еще раз, пока он создается
+    for _ in range(3):
+        plugin.pending_confirmations[20] = order
+        plugin.confirm_order(cardinal, 20, "+", "https://panel.io/api/v2", "k" * 20)
+    
+    deadline = time.monotonic() + 5
+    while not created and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    while plugin.CreationQueue._order_ids and time.monotonic() < deadline:
+        time.sleep(0.01)
+    
+    assert created == ["CCCC3333"]
+    assert sum("уже создается" in text for _, text in cardinal.sent) == 2
@@ -0,0 +1,49 @@
+import types
+
+from fpc_stubs import MessageTypes, NewMessageEvent
+
+
+def paid_order(plugin, order_id, buyer, chat_id):
+    return plugin.PaidOrder(order_id, 100, 10.0, "₽", "Подписчики", 1, buyer, "https://t.me/x",
+                            False, chat_id, "", "API_1")
+
+
+def message(text, chat_name, chat_id, msg_type=MessageTypes.NON_SYSTEM):
+    return NewMessageEvent(types.SimpleNamespace(
+        text=text, chat_name=chat_name, chat_id=chat_id, type=msg_type, author_id=chat_id
+    ))
+
+
+def setup_orders(plugin):
+    plugin.save_payorders([paid_order(plugin, "AAAA1111", "alice", 10)])
+    plugin.update_orders(lambda orders: orders.update({"777": paid_order(plugin, "BBBB2222", "alice", 10).to_active()}))
+
+
+def test_buyer_text_with_refund_marker_changes_nothing(plugin, cardinal):
+    setup_orders(plugin)
+    for order_id in ("AAAA1111", "BBBB2222"):
+        text = f"Продавец вернул деньги покупателю alice по заказу #{order_id}"
+        plugin.msg_hook(cardinal, message(text, "mallory", 99))
+    
+    assert [order.order_id for order in plugin.load_payorders()] == ["AAAA1111"]
+    assert list(plugin.load_orders()) == ["777"]
+
+
+def test_refund_notice_for_another_buyer_changes_nothing(plugin, cardinal):
+    setup_orders(plugin)
+    for order_id in ("AAAA1111", "BBBB2222"):
+        text = f"Продавец вернул деньги покупателю mallory по заказу #{order_id}"
+        plugin.msg_hook(cardinal, message(text, "mallory", 99, MessageTypes.REFUND))
+    
+    assert [order.order_id for order in plugin.load_payorders()] == ["AAAA1111"]
+    assert list(plugin.load_orders()) == ["777"]
+
+
+def test_refund_notice_closes_buyer_orders(plugin, cardinal):
+    setup_orders(plugin)
+    for order_id in ("AAAA1111", "BBBB2222"):
+        text = f"Продавец вернул деньги покупателю alice по заказу #{order_id}"
+        plugin.msg_hook(cardinal, message(text, "alice", 10, MessageTypes.REFUND))
+    
+    assert plugin.load_payorders() == []
+    assert plugin.load_orders() == {}